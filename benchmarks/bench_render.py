@@ -0,0 +1,75 @@
+"""
+Per-render cost of the ScormXBlock views, with the process-level template and
+resource caches cold (as every render was before they existed) and warm.
+
+It needs the same environment as the tests, e.g. in the LMS container used by
+.github/test.sh:
+
+    DJANGO_SETTINGS_MODULE=lms.envs.test python benchmarks/bench_render.py
+"""
+import argparse
+import os
+import timeit
+
+import django
+from django.conf import settings
+
+if not os.environ.get("DJANGO_SETTINGS_MODULE"):
+    settings.configure(
+        TEMPLATES=[{"BACKEND": "django.template.backends.django.DjangoTemplates"}],
+        INSTALLED_APPS=[],
+        USE_I18N=True,
+    )
+django.setup()
+
+import mock  # noqa: E402
+from xblock.field_data import DictFieldData  # noqa: E402
+
+from scormxblock.scormxblock import ScormXBlock, load_resource, load_template  # noqa: E402
+
+
+def make_block(inline_assets=True):
+    block = ScormXBlock(mock.Mock(), DictFieldData({"path_index_page": "index.html"}), mock.Mock())
+    block.location = mock.Mock(block_id="block_id", org="org", course="course", run="run")
+    block.runtime.service().get_settings_bucket.return_value = {"INLINE_ASSETS": inline_assets}
+    block.runtime.local_resource_url.side_effect = lambda block, path: "/resource/" + path
+    return block
+
+
+def clear_caches():
+    load_resource.cache_clear()
+    load_template.cache_clear()
+
+
+def fragment_size(fragment):
+    return len(fragment.content) + sum(len(resource.data) for resource in fragment.resources)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=500, help="renders per measure")
+    args = parser.parse_args()
+
+    print("{:<14} {:>12} {:>12} {:>8} {:>14} {:>14}".format(
+        "view", "cold (us)", "warm (us)", "speedup", "inline (bytes)", "urls (bytes)"
+    ))
+    for view in ("student_view", "studio_view", "author_view"):
+        block = make_block()
+        render = getattr(block, view)
+
+        def cold_render():
+            clear_caches()
+            render()
+
+        cold = timeit.timeit(cold_render, number=args.number) / args.number * 1e6
+        render()
+        warm = timeit.timeit(render, number=args.number) / args.number * 1e6
+        inline_size = fragment_size(render())
+        urls_size = fragment_size(getattr(make_block(inline_assets=False), view)())
+        print("{:<14} {:>12.1f} {:>12.1f} {:>7.1f}x {:>14} {:>14}".format(
+            view, cold, warm, cold / warm, inline_size, urls_size
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Benchmarks of the hot paths of the SCORM xblock: package upload
+(studio_submit), file delivery (proxy_scorm_media), the runtime handlers
+(scorm_get_value, scorm_set_value, scorm_set_values) and update_package_fields.
+
+Each scenario runs on synthetic packages (few large files, thousands of tiny
+files, a deep manifest) against a local filesystem storage, the same storage
+through the generic storage API path ("fs_generic", without the local fast
+path) and an in-memory storage. Throughput, latency percentiles and peak memory (traced by
+tracemalloc in a separate run, so that tracing does not skew the timings) are
+printed, and can be saved as a baseline for later runs to be compared with:
+
+    DJANGO_SETTINGS_MODULE=lms.envs.test python benchmarks/bench_suite.py --save-baseline baseline.json
+    DJANGO_SETTINGS_MODULE=lms.envs.test python benchmarks/bench_suite.py --baseline baseline.json
+
+The comparison exits with status 1 if a metric is worse than the baseline by
+more than --threshold.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+
+if not os.environ.get("DJANGO_SETTINGS_MODULE"):
+    settings.configure(
+        TEMPLATES=[{"BACKEND": "django.template.backends.django.DjangoTemplates"}],
+        INSTALLED_APPS=[],
+        USE_I18N=True,
+        SCORM_STORAGE_CLASS={"class": "django.core.files.storage.FileSystemStorage", "options": {}},
+    )
+django.setup()
+
+import mock  # noqa: E402
+from django.core.files.storage import FileSystemStorage  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+from xblock.field_data import DictFieldData  # noqa: E402
+
+from scormxblock import views  # noqa: E402
+from scormxblock.scormxblock import ScormXBlock  # noqa: E402
+from synthetic import PACKAGES, MemoryStorage, read_response  # noqa: E402
+
+# Metrics where a higher value is better, the others are better lower
+HIGHER_IS_BETTER = ("mb_per_s", "files_per_s", "calls_per_s")
+
+
+def make_block(**fields):
+    block = ScormXBlock(mock.Mock(), DictFieldData(fields), mock.Mock())
+    block.location = mock.Mock(block_id="block_id", org="org", course="course", run="run", block_type="scormxblock")
+    block.runtime.service.return_value = None
+    return block
+
+
+@contextmanager
+def use_storage(storage, local_fast_path=True):
+    """
+    Make every module of the xblock use the given storage.
+    """
+    storage_class = dict(settings.SCORM_STORAGE_CLASS, local_fast_path=local_fast_path)
+    with mock.patch("scormxblock.scormxblock.get_scorm_storage", return_value=storage), \
+            mock.patch("scormxblock.jobs.get_scorm_storage", return_value=storage), \
+            mock.patch("scormxblock.views.get_scorm_storage", return_value=storage), \
+            override_settings(SCORM_PROCESSING={"executor": "sync"}, SCORM_STORAGE_CLASS=storage_class):
+        views.clear_package_records()
+        yield
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+
+    def percentile(rank):
+        return latencies[min(len(latencies) - 1, int(rank / 100.0 * len(latencies)))] * 1000
+
+    return {"p50_ms": percentile(50), "p90_ms": percentile(90), "p99_ms": percentile(99)}
+
+
+def peak_memory(function):
+    """
+    Peak memory allocated by a call of the function, in MB.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2.0 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def submit_package(block, package_path):
+    with open(package_path, "rb") as package_file:
+        upload = SimpleUploadedFile("package.zip", package_file.read(), "application/zip")
+    request = mock.Mock(method="POST", params={
+        "display_name": "Bench", "has_score": "True", "width": None, "height": 450, "weight": 1,
+        "file": mock.Mock(file=upload),
+    })
+    response = json.loads(block.studio_submit(request).body.decode("utf8"))
+    if response["errors"] or response.get("status") != "done":
+        raise RuntimeError("Upload failed: {}".format(response))
+
+
+def bench_upload(make_storage, package_path, repeat, local_fast_path=True):
+    """
+    studio_submit of a package into an empty storage.
+    """
+    size = os.path.getsize(package_path)
+    files = None
+    durations = []
+    for _ in range(repeat):
+        storage = make_storage()
+        block = make_block()
+        with use_storage(storage, local_fast_path):
+            start = time.perf_counter()
+            submit_package(block, package_path)
+            durations.append(time.perf_counter() - start)
+            record = views.get_package_record(storage, block.scorm_file_meta["sha1"])
+        files = len(record["files"])
+    with use_storage(make_storage(), local_fast_path):
+        peak = peak_memory(lambda: submit_package(make_block(), package_path))
+    best = min(durations)
+    return {
+        "seconds": best,
+        "mb_per_s": size / 2.0 ** 20 / best,
+        "files_per_s": files / best,
+        "peak_mb": peak,
+    }
+
+
+def bench_proxy(storage, block, calls):
+    """
+    proxy_scorm_media of the files of an extracted package, in turn.
+    """
+    sha1 = block.scorm_file_meta["sha1"]
+    record = views.get_package_record(storage, sha1)
+    names = sorted(record["files"])
+    factory = RequestFactory()
+    served = [0]
+
+    def serve(name):
+        request = factory.get("/", HTTP_ACCEPT_ENCODING="gzip, br")
+        served[0] += len(read_response(views.proxy_scorm_media(request, name, sha1=sha1)))
+
+    latencies = []
+    start = time.perf_counter()
+    for index in range(calls):
+        call_start = time.perf_counter()
+        serve(names[index % len(names)])
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    result = {
+        "calls_per_s": calls / elapsed,
+        "mb_per_s": served[0] / 2.0 ** 20 / elapsed,
+        "peak_mb": peak_memory(lambda: [serve(name) for name in names[:100]]),
+    }
+    result.update(percentiles(latencies))
+    return result
+
+
+def bench_handler(call, calls):
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    result = {"calls_per_s": len(latencies) / sum(latencies)}
+    result.update(percentiles(latencies))
+    return result
+
+
+def bench_handlers(calls):
+    """
+    Runtime handlers of a learner with a realistic amount of CMI data.
+    """
+    block = make_block(has_score=True, weight=1)
+    suspend_data = json.dumps({"slides": [{"id": index, "visited": True} for index in range(300)]})
+
+    def json_request(data):
+        return mock.Mock(method="POST", body=json.dumps(data).encode("utf8"))
+
+    for index in range(50):
+        block.scorm_set_value(json_request({"name": "cmi.interactions.{}.id".format(index), "value": "q{}".format(index)}))
+    values = [
+        {"name": "cmi.core.lesson_location", "value": "page 3"},
+        {"name": "cmi.suspend_data", "value": suspend_data[:4096]},
+        {"name": "cmi.core.score.raw", "value": "50"},
+        {"name": "cmi.core.lesson_status", "value": "incomplete"},
+    ]
+    return {
+        "set_value": bench_handler(
+            lambda: block.scorm_set_value(json_request({"name": "cmi.suspend_data", "value": suspend_data[:4096]})),
+            calls,
+        ),
+        "set_values": bench_handler(lambda: block.scorm_set_values(json_request({"values": values})), calls),
+        "get_value": bench_handler(
+            lambda: block.scorm_get_value(json_request({"name": "cmi.suspend_data"})), calls
+        ),
+    }
+
+
+def bench_update_package_fields(storage, block, calls, local_fast_path=True):
+    """
+    update_package_fields reading the manifest from the storage.
+    """
+    with use_storage(storage, local_fast_path):
+        result = bench_handler(lambda: block.update_package_fields(), calls)
+        result["peak_mb"] = peak_memory(block.update_package_fields)
+    return result
+
+
+def run(args, work_dir):
+    packages = {}
+    for name, build in sorted(PACKAGES.items()):
+        packages[name] = os.path.join(work_dir, name + ".zip")
+        build(packages[name])
+
+    storage_dirs = []
+
+    def make_fs_storage():
+        storage_dirs.append(tempfile.mkdtemp(dir=work_dir))
+        return FileSystemStorage(location=storage_dirs[-1])
+
+    # Storage factories, and whether the local filesystem fast path is enabled
+    storages = {
+        "fs": (make_fs_storage, True),
+        "fs_generic": (make_fs_storage, False),
+        "memory": (MemoryStorage, True),
+    }
+    results = {}
+    for storage_name, (make_storage, local_fast_path) in sorted(storages.items()):
+        for package_name, package_path in sorted(packages.items()):
+            print("upload {} to {}...".format(package_name, storage_name), file=sys.stderr)
+            results["upload.{}.{}".format(package_name, storage_name)] = bench_upload(
+                make_storage, package_path, args.repeat, local_fast_path
+            )
+
+            storage = make_storage()
+            block = make_block()
+            with use_storage(storage, local_fast_path):
+                submit_package(block, package_path)
+                print("proxy {} from {}...".format(package_name, storage_name), file=sys.stderr)
+                results["proxy.{}.{}".format(package_name, storage_name)] = bench_proxy(storage, block, args.calls)
+            if package_name == "deep_manifest":
+                results["update_package_fields.{}".format(storage_name)] = bench_update_package_fields(
+                    storage, block, max(1, args.calls // 10), local_fast_path
+                )
+            while storage_dirs:
+                shutil.rmtree(storage_dirs.pop(), ignore_errors=True)
+
+    for name, result in bench_handlers(args.calls).items():
+        results["handler.{}".format(name)] = result
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every metric from the baseline, and return the
+    metrics worse than the baseline by more than the threshold.
+    """
+    regressions = []
+    print("\n{:<40} {:<12} {:>12} {:>12} {:>9}".format("scenario", "metric", "baseline", "current", "change"))
+    for scenario, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            reference = baseline.get(scenario, {}).get(metric)
+            if not reference:
+                continue
+            change = (value - reference) / reference
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = " !" if worse > threshold else ""
+            if flag:
+                regressions.append((scenario, metric))
+            print("{:<40} {:<12} {:>12.3f} {:>12.3f} {:>+8.1%}{}".format(
+                scenario, metric, reference, value, change, flag
+            ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="uploads per scenario, the best one is kept")
+    parser.add_argument("--calls", type=int, default=1000, help="calls per proxy and handler scenario")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--save-baseline", help="save the results to this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="tolerated relative regression")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        results = run(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for scenario, metrics in sorted(results.items()):
+        print("{:<40} {}".format(scenario, "  ".join(
+            "{}={:.3f}".format(metric, value) for metric, value in sorted(metrics.items())
+        )))
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        if regressions:
+            print("\n{} metrics regressed by more than {:.0%}".format(len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
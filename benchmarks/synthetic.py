@@ -0,0 +1,170 @@
+"""
+Synthetic SCORM packages and an in-memory storage for the benchmarks.
+"""
+import io
+import os
+import threading
+import zipfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.utils import timezone
+
+MANIFEST_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest identifier="BENCH" version="1.0"
+    xmlns="http://www.imsproject.org/xsd/imscp_rootv1p1p2"
+    xmlns:adlcp="http://www.adlnet.org/xsd/adlcp_rootv1p2">
+  <metadata><schema>ADL SCORM</schema><schemaversion>1.2</schemaversion></metadata>
+"""
+PAGE = "<html><head><script src=\"app.js\"></script></head><body><p>{}</p></body></html>\n"
+
+
+def build_manifest(resources, depth=1):
+    """
+    Manifest with a resource per (identifier, href, files) and an organization
+    whose items are nested `depth` levels deep.
+    """
+    lines = [MANIFEST_HEADER, '  <organizations default="ORG"><organization identifier="ORG"><title>Bench</title>']
+    for index, (identifier, _, _) in enumerate(resources):
+        nesting = min(depth, index + 1)
+        for level in range(nesting - 1):
+            lines.append('<item identifier="GROUP-{}-{}"><title>Group</title>'.format(index, level))
+        lines.append('<item identifier="ITEM-{0}" identifierref="{1}"><title>Item {0}</title></item>'.format(
+            index, identifier
+        ))
+        lines.append("</item>" * (nesting - 1))
+    lines.append("</organization></organizations>\n  <resources>")
+    for identifier, href, files in resources:
+        lines.append('<resource identifier="{}" type="webcontent" adlcp:scormtype="sco" href="{}">'.format(
+            identifier, href
+        ))
+        lines.extend('<file href="{}"/>'.format(path) for path in files)
+        lines.append("</resource>")
+    lines.append("</resources>\n</manifest>\n")
+    return "\n".join(lines).encode("utf8")
+
+
+def write_package(path, files, manifest):
+    """
+    Write a zip package with the manifest and the {path: content} files.
+    """
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("imsmanifest.xml", manifest)
+        for name, content in files.items():
+            package.writestr(name, content)
+
+
+def few_large_files(path, count=4, size=8 * 2 ** 20):
+    """
+    Package with a few large, incompressible media files and a page.
+    """
+    files = {"index.html": PAGE.format("media").encode("utf8")}
+    for index in range(count):
+        files["media/video-{}.mp4".format(index)] = os.urandom(size)
+    write_package(path, files, build_manifest([("RES", "index.html", sorted(files))]))
+
+
+def many_tiny_files(path, count=2000, size=256):
+    """
+    Package with thousands of tiny text files.
+    """
+    files = {"index.html": PAGE.format("tiny").encode("utf8")}
+    filler = ("x" * size).encode("utf8")
+    for index in range(count):
+        files["assets/{:03d}/file-{}.js".format(index % 100, index)] = filler
+    write_package(path, files, build_manifest([("RES", "index.html", ["index.html"])]))
+
+
+def deep_manifest(path, count=1000, depth=20):
+    """
+    Package with a large manifest: a resource and page per item, and items
+    nested `depth` levels deep.
+    """
+    files = {}
+    resources = []
+    for index in range(count):
+        href = "pages/page-{}.html".format(index)
+        files[href] = PAGE.format(index).encode("utf8")
+        resources.append(("RES-{}".format(index), href, [href, "app.js"]))
+    files["app.js"] = b"var page = 0;\n" * 100
+    write_package(path, files, build_manifest(resources, depth))
+
+
+PACKAGES = {
+    "few_large": few_large_files,
+    "many_tiny": many_tiny_files,
+    "deep_manifest": deep_manifest,
+}
+
+
+class MemoryStorage(Storage):
+    """
+    Thread-safe storage of the files in a dict, standing in for an object
+    storage without its network latency.
+    """
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def _open(self, name, mode="rb"):
+        with self.lock:
+            try:
+                content = self.files[name][0]
+            except KeyError:
+                raise IOError("No such file: {}".format(name))
+        return ContentFile(content, name=name)
+
+    def _save(self, name, content):
+        data = b"".join(content.chunks()) if hasattr(content, "chunks") else content.read()
+        with self.lock:
+            self.files[name] = (data, timezone.now())
+        return name
+
+    def exists(self, name):
+        with self.lock:
+            return name in self.files
+
+    def delete(self, name):
+        with self.lock:
+            self.files.pop(name, None)
+
+    def size(self, name):
+        with self.lock:
+            return len(self.files[name][0])
+
+    def get_modified_time(self, name):
+        with self.lock:
+            return self.files[name][1]
+
+    def listdir(self, path):
+        prefix = path.rstrip("/") + "/"
+        directories, files = set(), set()
+        with self.lock:
+            names = list(self.files)
+        for name in names:
+            if name.startswith(prefix):
+                head, _, tail = name[len(prefix):].partition("/")
+                (directories if tail else files).add(head)
+        return sorted(directories), sorted(files)
+
+    def url(self, name):
+        return "/memory/" + name
+
+    def path(self, name):
+        raise NotImplementedError("MemoryStorage files have no local path")
+
+    def total_size(self):
+        with self.lock:
+            return sum(len(data) for data, _ in self.files.values())
+
+
+def read_response(response):
+    """
+    Bytes of a Django response, streamed or not.
+    """
+    if getattr(response, "streaming", False):
+        buffer = io.BytesIO()
+        for chunk in response.streaming_content:
+            buffer.write(chunk)
+        return buffer.getvalue()
+    return response.content
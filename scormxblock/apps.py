@@ -20,7 +20,12 @@ class ScormXBlockConfig(AppConfig):
                 SettingsType.COMMON: {
                     PluginSettings.RELATIVE_PATH: u'settings.common'},
             },
+            ProjectType.CMS: {
+                SettingsType.COMMON: {
+                    PluginSettings.RELATIVE_PATH: u'settings.common'},
+            },
         }}
 
     def ready(self):
-        pass 
\ No newline at end of file
+        # Register the package processing task with the celery workers
+        from . import tasks  # pylint: disable=unused-import
@@ -0,0 +1,247 @@
+"""
+Garbage collection of the packages that no block uses anymore.
+
+Packages are collected in two passes, so that learners who still have a page
+of a superseded package open are not broken: the first pass that finds a
+package unreferenced leaves a marker in the gc folder of the storage, and the
+package is only deleted by a later pass once the marker is older than the
+grace period, if it is still unreferenced. A package referenced again has its
+marker removed.
+
+Both the packages of the shared store (packages/<sha1>) and the legacy
+per-block trees (<block_id>/<sha1>) are collected.
+"""
+import json
+import logging
+import os.path
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+from django.core.files.base import ContentFile
+
+from .utils import JOBS_FOLDER, PACKAGES_FOLDER, REFERENCES_FOLDER, UPLOADS_FOLDER
+
+logger = logging.getLogger(__name__)
+
+GC_FOLDER = "gc"
+DEFAULT_GRACE_PERIOD = timedelta(days=7)
+DEFAULT_WORKERS = 8
+SHA1_RE = re.compile(r'^[0-9a-f]{40}$')
+MARKER_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def get_referenced_packages(blocks):
+    """
+    Packages used by the given blocks: the set of the sha1 of the packages of
+    the shared store, and the set of the (block_id, sha1) of legacy trees.
+
+    The package of the processing job of a block counts as used as soon as
+    the job hashed it, so that it is not collected while it is extracted nor
+    before the block switches to it.
+    """
+    from .jobs import JOB_FAILED, get_job
+
+    shared, legacy = set(), set()
+    for block in blocks:
+        meta = block.scorm_file_meta or {}
+        if meta.get("sha1"):
+            if meta.get("shared"):
+                shared.add(meta["sha1"])
+            else:
+                legacy.add((block.location.block_id, meta["sha1"]))
+        job = get_job(block.package_job)
+        if job is not None and job["status"] != JOB_FAILED:
+            sha1 = job.get("sha1") or (job.get("meta") or {}).get("sha1")
+            if sha1:
+                shared.add(sha1)
+    return shared, legacy
+
+
+def iter_scorm_blocks():
+    """
+    Yield the draft and published versions of every SCORM block of every course.
+    """
+    from xmodule.modulestore import ModuleStoreEnum
+    from xmodule.modulestore.django import modulestore
+
+    store = modulestore()
+    for course in store.get_courses():
+        for branch in (ModuleStoreEnum.Branch.draft_preferred, ModuleStoreEnum.Branch.published_only):
+            with store.branch_setting(branch, course.id):
+                for block in store.get_items(course.id, qualifiers={"category": "scormxblock"}):
+                    yield block
+
+
+def find_packages(storage, location):
+    """
+    Packages present in the storage, as {key: [paths]} where the key is the
+    sha1 of a package of the shared store, or (block_id, sha1) for a legacy
+    tree, and the paths are the folders and files of the package.
+    """
+    packages = {}
+    packages_folder = os.path.join(location, PACKAGES_FOLDER)
+    directories, files = listdir(storage, packages_folder)
+    for name in directories + files:
+        sha1 = name.split(".", 1)[0]
+        if SHA1_RE.match(sha1):
+            packages.setdefault(sha1, []).append(os.path.join(packages_folder, name))
+
+    for block_id in listdir(storage, location)[0]:
+        if block_id in (PACKAGES_FOLDER, REFERENCES_FOLDER, UPLOADS_FOLDER, JOBS_FOLDER, GC_FOLDER):
+            continue
+        sha1_directories, _ = listdir(storage, os.path.join(location, block_id))
+        for sha1 in sha1_directories:
+            if SHA1_RE.match(sha1):
+                packages[(block_id, sha1)] = [os.path.join(location, block_id, sha1)]
+    return packages
+
+
+def collect_garbage(
+        storage, location, referenced, grace_period=DEFAULT_GRACE_PERIOD, workers=DEFAULT_WORKERS,
+        dry_run=False, now=None
+):
+    """
+    Mark the unreferenced packages of the storage, and delete those marked for
+    longer than the grace period. `referenced` is the pair of sets returned by
+    get_referenced_packages.
+
+    Return a report: {"marked": [keys], "deleted": [keys], "unmarked": [keys],
+    "files_deleted": count}. Nothing is written nor deleted in a dry run, the
+    report then tells what would be.
+    """
+    now = now or datetime.now(tz=pytz.utc)
+    shared, legacy = referenced
+    report = {"marked": [], "deleted": [], "unmarked": [], "files_deleted": 0}
+    markers = get_markers(storage, location)
+
+    packages = find_packages(storage, location)
+    for key, paths in sorted(packages.items(), key=lambda item: (isinstance(item[0], tuple), item[0])):
+        marker_path = get_marker_path(location, key)
+        if key in shared or key in legacy:
+            if marker_path in markers:
+                report["unmarked"].append(key)
+                if not dry_run:
+                    storage.delete(marker_path)
+            continue
+        if marker_path not in markers:
+            report["marked"].append(key)
+            if not dry_run:
+                write_marker(storage, marker_path, now)
+            continue
+        if now - markers[marker_path] < grace_period:
+            continue
+        if not dry_run and not storage.exists(marker_path):
+            # An upload of the package removed the marker since the run started
+            continue
+        report["deleted"].append(key)
+        if not isinstance(key, tuple):
+            paths = get_shared_package_paths(location, key, paths)
+        if dry_run:
+            report["files_deleted"] += sum(len(list_files(storage, path)) for path in paths)
+        else:
+            report["files_deleted"] += delete_paths(storage, paths, workers)
+            storage.delete(marker_path)
+        logger.info('SCORM package "%s" %s', key, "would be deleted" if dry_run else "deleted")
+
+    # Markers of packages removed by other means
+    if not dry_run:
+        for marker_path in set(markers) - set(get_marker_path(location, key) for key in packages):
+            storage.delete(marker_path)
+    return report
+
+
+def get_shared_package_paths(location, sha1, paths):
+    """
+    Paths of a package of the shared store in deletion order: the record goes
+    first, so that an upload of the same package during the deletion extracts
+    it again instead of reusing a partial tree. Its references follow last.
+    """
+    record_path = os.path.join(location, PACKAGES_FOLDER, sha1 + ".json")
+    paths = sorted(paths, key=lambda path: path != record_path)
+    return paths + [os.path.join(location, REFERENCES_FOLDER, sha1)]
+
+
+def get_marker_path(location, key):
+    name = "+".join(key) if isinstance(key, tuple) else key
+    return os.path.join(location, GC_FOLDER, name + ".json")
+
+
+def get_markers(storage, location):
+    """
+    Markers of the unreferenced packages, as {path: marking time}. Markers
+    that can't be read count as written now, so that the grace period starts
+    over rather than being skipped.
+    """
+    folder = os.path.join(location, GC_FOLDER)
+    now = datetime.now(tz=pytz.utc)
+    markers = {}
+    for name in listdir(storage, folder)[1]:
+        path = os.path.join(folder, name)
+        try:
+            with storage.open(path) as marker_file:
+                marked = json.loads(marker_file.read().decode("utf8"))["unreferenced_since"]
+            markers[path] = pytz.utc.localize(datetime.strptime(marked, MARKER_TIME_FORMAT))
+        except (IOError, ValueError, KeyError):
+            markers[path] = now
+    return markers
+
+
+def write_marker(storage, path, now):
+    marker = {"unreferenced_since": now.astimezone(pytz.utc).strftime(MARKER_TIME_FORMAT)}
+    storage.save(path, ContentFile(json.dumps(marker).encode("utf8")))
+
+
+def list_files(storage, path):
+    """
+    Files under a folder of the storage, or the path itself if it is a file.
+    """
+    directories, files = listdir(storage, path)
+    if not directories and not files:
+        return [path] if storage.exists(path) else []
+    paths = [os.path.join(path, name) for name in files]
+    for directory in directories:
+        paths.extend(list_files(storage, os.path.join(path, directory)))
+    return paths
+
+
+def listdir(storage, path):
+    """
+    Folders and files in a folder of the storage, none if it does not exist.
+    Object storages have no folders, so their existence is not checked first.
+    """
+    try:
+        return storage.listdir(path)
+    except (IOError, OSError, NotImplementedError):
+        return [], []
+
+
+def delete_paths(storage, paths, workers=DEFAULT_WORKERS):
+    """
+    Delete the files under the given paths, at most `workers` at a time, then
+    the empty folders left on local storages. Return the number of files deleted.
+    """
+    deleted = 0
+    for path in paths:
+        files = list_files(storage, path)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(storage.delete, files))
+        deleted += len(files)
+        remove_empty_folders(storage, path)
+    return deleted
+
+
+def remove_empty_folders(storage, path):
+    """
+    Remove a folder tree emptied by delete_paths, for storages with local paths.
+    """
+    try:
+        local_path = storage.path(path)
+    except NotImplementedError:
+        return
+    for root, _, _ in os.walk(local_path, topdown=False):
+        try:
+            os.rmdir(root)
+        except OSError:
+            pass
@@ -0,0 +1,318 @@
+"""
+Compact storage of the learner's CMI data model in the data_scorm field.
+
+The elements set by a package used to be kept as a flat {element: value} dict,
+where every cmi.interactions.N.* key repeats its prefix and large blobs such as
+cmi.suspend_data are stored as they come. The compact store instead holds:
+
+* "values": small values, by element name;
+* "zipped": large values, zlib-compressed and base64-encoded, when that is
+  shorter;
+* "arrays": the elements of the collections of the data model, such as
+  cmi.interactions, as a list of {sub-element: value} dicts per collection.
+
+The whole store is bounded by SCORM_CMI_LIMITS['max_size']. With
+SCORM_CMI_LIMITS['enforce_spm'], the size of each value is bounded too, by the
+smallest permitted maximum (SPM) of its element in the SCORM specification,
+and the number of items of each collection by its SPM.
+Legacy flat dicts are still read, and converted on their first write.
+"""
+import base64
+import json
+import re
+import zlib
+
+from django.conf import settings
+
+from .utils import ScormError
+
+STORE_VERSION = 2
+
+# Values of at least this many characters are compressed
+COMPRESS_MIN_SIZE = 1024
+
+# Collections of the data model, stored as arrays
+COLLECTION_RE = re.compile(
+    r'^(cmi\.(?:interactions|objectives|comments_from_learner|comments_from_lms))\.(\d+)\.(.+)$'
+)
+
+# Smallest permitted maximum number of characters of the elements, by version
+SPM_LIMITS = {
+    "SCORM_12": [
+        (r'cmi\.core\.lesson_location', 255),
+        (r'cmi\.suspend_data', 4096),
+        (r'cmi\.comments', 4096),
+        (r'cmi\.objectives\.n\.id', 255),
+        (r'cmi\.interactions\.n\.(id|objectives\.n\.id)', 255),
+        (r'cmi\.interactions\.n\.(student_response|correct_responses\.n\.pattern)', 255),
+    ],
+    "SCORM_2004": [
+        (r'cmi\.location', 1000),
+        (r'cmi\.suspend_data', 64000),
+        (r'cmi\.comments_from_(learner|lms)\.n\.comment', 4000),
+        (r'cmi\.comments_from_(learner|lms)\.n\.location', 250),
+        (r'cmi\.objectives\.n\.id', 4000),
+        (r'cmi\.objectives\.n\.description', 250),
+        (r'cmi\.interactions\.n\.(id|objectives\.n\.id)', 4000),
+        (r'cmi\.interactions\.n\.description', 250),
+        (r'cmi\.interactions\.n\.(learner_response|correct_responses\.n\.pattern)', 4000),
+    ],
+}
+# Limit of the elements missing from SPM_LIMITS
+DEFAULT_SPM = 4096
+# Smallest permitted maximum number of items of the collections, enforced
+# with enforce_spm
+COLLECTION_LIMITS = {
+    "cmi.interactions": 250,
+    "cmi.objectives": 100,
+    "cmi.comments_from_learner": 250,
+    "cmi.comments_from_lms": 100,
+}
+DEFAULT_LIMITS = {
+    # Maximum number of characters of all the stored values of a learner
+    'max_size': 256 * 1024,
+    # Reject the values longer than the SPM of their element. Off by default:
+    # many SCORM 1.2 packages, e.g. Storyline ones, save more than 4096
+    # characters of cmi.suspend_data.
+    'enforce_spm': False,
+    # Limits of some elements, e.g. {'cmi.suspend_data': 64000}, enforced
+    # even without enforce_spm
+    'elements': {},
+}
+
+_compiled_limits = {
+    version: [(re.compile("^{}$".format(pattern)), limit) for pattern, limit in limits]
+    for version, limits in SPM_LIMITS.items()
+}
+
+
+class CmiLimitError(ScormError):
+    pass
+
+
+def get_limits():
+    """
+    Size limits of the learner data, see SCORM_CMI_LIMITS in the README.
+    """
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(getattr(settings, 'SCORM_CMI_LIMITS', {}))
+    return limits
+
+
+def is_compact(data):
+    return data.get("v") == STORE_VERSION
+
+
+def get_values(data):
+    """
+    Flat {element: value} dict of the values of a store.
+    """
+    if not is_compact(data):
+        return dict(data)
+    values = dict(data["values"])
+    for name, value in data["zipped"].items():
+        values[name] = decompress(value)
+    for collection, items in data["arrays"].items():
+        for index, item in enumerate(items):
+            for key, value in item.items():
+                values["{}.{}.{}".format(collection, index, key)] = value
+    return values
+
+
+def get_value(data, name):
+    """
+    Stored value of a single element, or None if it is not set, without
+    unpacking the whole store.
+    """
+    if not is_compact(data):
+        return data.get(name)
+    match = COLLECTION_RE.match(name)
+    if match:
+        items = data["arrays"].get(match.group(1), [])
+        index = int(match.group(2))
+        return items[index].get(match.group(3)) if index < len(items) else None
+    if name in data["zipped"]:
+        return decompress(data["zipped"][name])
+    return data["values"].get(name)
+
+
+def get_count(data, collection):
+    """
+    Number of items of a collection, such as cmi.interactions, or of a
+    collection of an item, such as cmi.interactions.0.objectives.
+    """
+    if not is_compact(data):
+        return count_items(data, collection + ".")
+    items = data["arrays"].get(collection)
+    if items is not None:
+        return len(items)
+    match = COLLECTION_RE.match(collection + "._count")
+    if match is None:
+        return 0
+    items = data["arrays"].get(match.group(1), [])
+    index = int(match.group(2))
+    if index >= len(items):
+        return 0
+    return count_items(items[index], match.group(3)[:-len("_count")])
+
+
+def count_items(names, prefix):
+    """
+    Number of items of the collection of the names that start with prefix,
+    i.e. the highest <prefix><index>. index plus one.
+    """
+    count = 0
+    for name in names:
+        if name.startswith(prefix):
+            index = name[len(prefix):].split(".", 1)[0]
+            if index.isdigit():
+                count = max(count, int(index) + 1)
+    return count
+
+
+def is_empty(data):
+    """
+    Whether the learner has no value stored yet.
+    """
+    if not is_compact(data):
+        return not data
+    return not (data["values"] or data["zipped"] or any(data["arrays"].values()))
+
+
+def set_value(data, name, value, version="SCORM_12"):
+    """
+    Set an element in the store, checking the size limits, and return the
+    store, which is a new dict when a legacy one had to be converted.
+    """
+    value = to_cmi_string(value)
+    limits = get_limits()
+    check_value_size(name, value, version, limits)
+    if not is_compact(data):
+        data = convert(data)
+    previous = put_value(data, name, value, item_limits=COLLECTION_LIMITS if limits['enforce_spm'] else {})
+    if get_store_size(data) > limits['max_size']:
+        # Restore the store before reporting the error
+        if previous is None:
+            remove_value(data, name)
+        else:
+            put_value(data, name, previous, strict=False)
+        raise CmiLimitError("The learner data exceeds {} characters".format(limits['max_size']))
+    return data
+
+
+def convert(legacy_data):
+    """
+    Compact store with the values of a legacy flat dict, without limits, so
+    that no learner data is lost.
+    """
+    data = {"v": STORE_VERSION, "values": {}, "zipped": {}, "arrays": {}}
+    for name, value in sorted(legacy_data.items(), key=lambda item: collection_sort_key(item[0])):
+        put_value(data, name, to_cmi_string(value), strict=False)
+    return data
+
+
+def collection_sort_key(name):
+    """
+    Sort key that puts the items of the collections in index order.
+    """
+    match = COLLECTION_RE.match(name)
+    if match is None:
+        return (name, 0, "")
+    return (match.group(1), int(match.group(2)), match.group(3))
+
+
+def put_value(data, name, value, strict=True, item_limits=None):
+    """
+    Store a value, and return the value it replaced, if any. In strict mode,
+    items must be added in order, and collections can't hold more items than
+    item_limits allows.
+    """
+    match = COLLECTION_RE.match(name)
+    if match:
+        collection, index, key = match.group(1), int(match.group(2)), match.group(3)
+        items = data["arrays"].setdefault(collection, [])
+        if index > len(items):
+            if strict:
+                raise CmiLimitError("{} is not the next item of {}".format(name, collection))
+            items.extend({} for _ in range(index - len(items)))
+        if index == len(items):
+            if strict and index >= (item_limits or {}).get(collection, index + 1):
+                raise CmiLimitError("{} cannot hold more than {} items".format(collection, index))
+            items.append({})
+        previous = items[index].get(key)
+        items[index][key] = value
+        return previous
+
+    previous = data["values"].pop(name, None)
+    if name in data["zipped"]:
+        previous = decompress(data["zipped"].pop(name))
+    compressed = compress(value) if len(value) >= COMPRESS_MIN_SIZE else None
+    if compressed is not None and len(compressed) < len(value):
+        data["zipped"][name] = compressed
+    else:
+        data["values"][name] = value
+    return previous
+
+
+def remove_value(data, name):
+    match = COLLECTION_RE.match(name)
+    if match:
+        items = data["arrays"][match.group(1)]
+        index = int(match.group(2))
+        items[index].pop(match.group(3), None)
+        if index == len(items) - 1 and not items[index]:
+            items.pop()
+    else:
+        data["values"].pop(name, None)
+        data["zipped"].pop(name, None)
+
+
+def get_store_size(data):
+    """
+    Number of characters of all the stored values and their element names.
+    """
+    size = 0
+    for values in (data["values"], data["zipped"]):
+        size += sum(len(name) + len(value) for name, value in values.items())
+    for items in data["arrays"].values():
+        for item in items:
+            size += sum(len(key) + len(value) for key, value in item.items())
+    return size
+
+
+def check_value_size(name, value, version, limits):
+    """
+    Raise a CmiLimitError if the value is longer than the limit of its element
+    in limits['elements'], or than its SPM if limits['enforce_spm'] is set.
+    """
+    generic_name = re.sub(r'\.\d+(?=\.)', '.n', name)
+    limit = limits['elements'].get(name, limits['elements'].get(generic_name))
+    if limit is None:
+        if not limits['enforce_spm']:
+            return
+        limit = DEFAULT_SPM
+        for pattern, spm in _compiled_limits.get(version, []):
+            if pattern.match(generic_name):
+                limit = spm
+                break
+    if len(value) > limit:
+        raise CmiLimitError("{} cannot hold more than {} characters".format(name, limit))
+
+
+def to_cmi_string(value):
+    """
+    Characterstring of a value, as the SCORM API returns it.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def compress(value):
+    return base64.b64encode(zlib.compress(value.encode("utf8"), 9)).decode("ascii")
+
+
+def decompress(value):
+    return zlib.decompress(base64.b64decode(value)).decode("utf8")
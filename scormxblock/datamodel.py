@@ -0,0 +1,500 @@
+"""
+CMI data model of SCORM 1.2 and SCORM 2004, as the runtime API exposes it.
+
+Elements are defined by their generic name, where the indexes of the
+collections are replaced by "n" (e.g. cmi.interactions.n.id), with their
+access and the check of their values, so that resolving an element is a dict
+lookup. The keywords of the data model (_version, _children and the _count of
+the collections) are answered from these definitions and from the learner
+store (see the cmi module), without unpacking it.
+
+Errors are raised as DataModelError, with the error code of the SCORM version
+that GetLastError reports.
+"""
+import re
+
+from .cmi import get_count, get_value as get_stored_value, is_empty
+from .utils import ScormError
+
+READ = "r"
+WRITE = "w"
+READ_WRITE = "rw"
+
+# Error codes by kind of error, for each version. Values that are not
+# initialized are not an error in SCORM 1.2, they are empty.
+ERROR_CODES = {
+    "SCORM_12": {
+        "general": "101",
+        "undefined": "201",
+        "get_failure": "201",
+        "invalid_index": "201",
+        "dependency": "201",
+        "no_children": "202",
+        "no_count": "203",
+        "keyword": "402",
+        "read_only": "403",
+        "write_only": "404",
+        "type_mismatch": "405",
+        "out_of_range": "405",
+        "not_initialized": None,
+    },
+    "SCORM_2004": {
+        "general": "351",
+        "undefined": "401",
+        "get_failure": "301",
+        "invalid_index": "351",
+        "dependency": "408",
+        "no_children": "301",
+        "no_count": "301",
+        "keyword": "404",
+        "read_only": "404",
+        "write_only": "405",
+        "type_mismatch": "406",
+        "out_of_range": "407",
+        "not_initialized": "403",
+    },
+}
+NO_ERROR = "0"
+
+VERSIONS = {
+    "SCORM_12": "3.4",
+    "SCORM_2004": "1.0",
+}
+
+INDEX_RE = re.compile(r'\.(\d+)(?=\.)')
+REAL_RE = re.compile(r'^[-+]?(\d+(\.\d*)?|\.\d+)$')
+INTEGER_RE = re.compile(r'^[-+]?\d+$')
+IDENTIFIER_RE = re.compile(r'^\S+$')
+# CMITimespan and CMITime of SCORM 1.2
+TIMESPAN_12_RE = re.compile(r'^\d{2,4}:\d{2}:\d{2}(\.\d{1,2})?$')
+TIME_12_RE = re.compile(r'^\d{2}:\d{2}:\d{2}(\.\d{1,2})?$')
+# timeinterval (second,10,2) and time (second,10,0) of SCORM 2004
+TIME_INTERVAL_RE = re.compile(
+    r'^P(?=\d|T\d)(\d+Y)?(\d+M)?(\d+D)?(T(?=\d)(\d+H)?(\d+M)?(\d+(\.\d{1,2})?S)?)?$'
+)
+TIMESTAMP_RE = re.compile(
+    r'^\d{4}(-\d{2}(-\d{2}(T\d{2}(:\d{2}(:\d{2}(\.\d{1,2})?)?)?(Z|[-+]\d{2}(:\d{2})?)?)?)?)?$'
+)
+
+
+class DataModelError(ScormError):
+    """
+    Failure of a GetValue or SetValue call, with its SCORM error code.
+    """
+    def __init__(self, message, code):
+        super(DataModelError, self).__init__(message)
+        self.code = code
+
+
+def vocabulary(*words):
+    words = frozenset(words)
+
+    def check(value):
+        return None if value in words else "type_mismatch"
+    check.spec = {"vocabulary": sorted(words)}
+    return check
+
+
+def real(minimum=None, maximum=None, blank=False):
+    def check(value):
+        if blank and value == "":
+            return None
+        if not REAL_RE.match(value):
+            return "type_mismatch"
+        number = float(value)
+        if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+            return "out_of_range"
+        return None
+    check.spec = {"real": [minimum, maximum], "blank": blank}
+    return check
+
+
+def integer(minimum, maximum):
+    def check(value):
+        if not INTEGER_RE.match(value):
+            return "type_mismatch"
+        return None if minimum <= int(value) <= maximum else "out_of_range"
+    check.spec = {"integer": [minimum, maximum]}
+    return check
+
+
+def pattern(regex):
+    def check(value):
+        return None if regex.match(value) else "type_mismatch"
+    check.spec = {"pattern": regex.pattern}
+    return check
+
+
+def any_of(*checks):
+    def check(value):
+        errors = [check(value) for check in checks]
+        return None if None in errors else errors[-1]
+    check.spec = {"any_of": [check.spec for check in checks]}
+    return check
+
+
+IDENTIFIER = pattern(IDENTIFIER_RE)
+SCORE_12 = real(0, 100, blank=True)
+STATUS_12 = ("passed", "completed", "failed", "incomplete", "browsed")
+COMPLETION_STATUS = vocabulary("completed", "incomplete", "not attempted", "unknown")
+SUCCESS_STATUS = vocabulary("passed", "failed", "unknown")
+
+# Elements of each version, by generic name, as (access, check of the values)
+ELEMENTS = {
+    "SCORM_12": {
+        "cmi.core.student_id": (READ, None),
+        "cmi.core.student_name": (READ, None),
+        "cmi.core.lesson_location": (READ_WRITE, None),
+        "cmi.core.credit": (READ, None),
+        "cmi.core.lesson_status": (READ_WRITE, vocabulary(*STATUS_12)),
+        "cmi.core.entry": (READ, None),
+        "cmi.core.score.raw": (READ_WRITE, SCORE_12),
+        "cmi.core.score.min": (READ_WRITE, SCORE_12),
+        "cmi.core.score.max": (READ_WRITE, SCORE_12),
+        "cmi.core.total_time": (READ, None),
+        "cmi.core.lesson_mode": (READ, None),
+        "cmi.core.exit": (WRITE, vocabulary("time-out", "suspend", "logout", "")),
+        "cmi.core.session_time": (WRITE, pattern(TIMESPAN_12_RE)),
+        "cmi.suspend_data": (READ_WRITE, None),
+        "cmi.launch_data": (READ, None),
+        "cmi.comments": (READ_WRITE, None),
+        "cmi.comments_from_lms": (READ, None),
+        "cmi.objectives.n.id": (READ_WRITE, IDENTIFIER),
+        "cmi.objectives.n.score.raw": (READ_WRITE, SCORE_12),
+        "cmi.objectives.n.score.min": (READ_WRITE, SCORE_12),
+        "cmi.objectives.n.score.max": (READ_WRITE, SCORE_12),
+        "cmi.objectives.n.status": (READ_WRITE, vocabulary("not attempted", *STATUS_12)),
+        "cmi.student_data.mastery_score": (READ, None),
+        "cmi.student_data.max_time_allowed": (READ, None),
+        "cmi.student_data.time_limit_action": (READ, None),
+        "cmi.student_preference.audio": (READ_WRITE, integer(-1, 100)),
+        "cmi.student_preference.language": (READ_WRITE, None),
+        "cmi.student_preference.speed": (READ_WRITE, integer(-100, 100)),
+        "cmi.student_preference.text": (READ_WRITE, integer(-1, 1)),
+        "cmi.interactions.n.id": (WRITE, IDENTIFIER),
+        "cmi.interactions.n.objectives.n.id": (WRITE, IDENTIFIER),
+        "cmi.interactions.n.time": (WRITE, pattern(TIME_12_RE)),
+        "cmi.interactions.n.type": (WRITE, vocabulary(
+            "true-false", "choice", "fill-in", "matching", "performance", "sequencing", "likert", "numeric"
+        )),
+        "cmi.interactions.n.correct_responses.n.pattern": (WRITE, None),
+        "cmi.interactions.n.weighting": (WRITE, real()),
+        "cmi.interactions.n.student_response": (WRITE, None),
+        "cmi.interactions.n.result": (WRITE, any_of(
+            vocabulary("correct", "wrong", "unanticipated", "neutral"), real()
+        )),
+        "cmi.interactions.n.latency": (WRITE, pattern(TIMESPAN_12_RE)),
+    },
+    "SCORM_2004": {
+        "cmi.comments_from_learner.n.comment": (READ_WRITE, None),
+        "cmi.comments_from_learner.n.location": (READ_WRITE, None),
+        "cmi.comments_from_learner.n.timestamp": (READ_WRITE, pattern(TIMESTAMP_RE)),
+        "cmi.comments_from_lms.n.comment": (READ, None),
+        "cmi.comments_from_lms.n.location": (READ, None),
+        "cmi.comments_from_lms.n.timestamp": (READ, None),
+        "cmi.completion_status": (READ_WRITE, COMPLETION_STATUS),
+        "cmi.completion_threshold": (READ, None),
+        "cmi.credit": (READ, None),
+        "cmi.entry": (READ, None),
+        "cmi.exit": (WRITE, vocabulary("time-out", "suspend", "logout", "normal", "")),
+        "cmi.interactions.n.id": (READ_WRITE, IDENTIFIER),
+        "cmi.interactions.n.type": (READ_WRITE, vocabulary(
+            "true-false", "choice", "fill-in", "long-fill-in", "matching", "performance", "sequencing",
+            "likert", "numeric", "other"
+        )),
+        "cmi.interactions.n.objectives.n.id": (READ_WRITE, IDENTIFIER),
+        "cmi.interactions.n.timestamp": (READ_WRITE, pattern(TIMESTAMP_RE)),
+        "cmi.interactions.n.correct_responses.n.pattern": (READ_WRITE, None),
+        "cmi.interactions.n.weighting": (READ_WRITE, real()),
+        "cmi.interactions.n.learner_response": (READ_WRITE, None),
+        "cmi.interactions.n.result": (READ_WRITE, any_of(
+            vocabulary("correct", "incorrect", "unanticipated", "neutral"), real()
+        )),
+        "cmi.interactions.n.latency": (READ_WRITE, pattern(TIME_INTERVAL_RE)),
+        "cmi.interactions.n.description": (READ_WRITE, None),
+        "cmi.launch_data": (READ, None),
+        "cmi.learner_id": (READ, None),
+        "cmi.learner_name": (READ, None),
+        "cmi.learner_preference.audio_level": (READ_WRITE, real(0)),
+        "cmi.learner_preference.language": (READ_WRITE, None),
+        "cmi.learner_preference.delivery_speed": (READ_WRITE, real(0)),
+        "cmi.learner_preference.audio_captioning": (READ_WRITE, integer(-1, 1)),
+        "cmi.location": (READ_WRITE, None),
+        "cmi.max_time_allowed": (READ, None),
+        "cmi.mode": (READ, None),
+        "cmi.objectives.n.id": (READ_WRITE, IDENTIFIER),
+        "cmi.objectives.n.score.scaled": (READ_WRITE, real(-1, 1)),
+        "cmi.objectives.n.score.raw": (READ_WRITE, real()),
+        "cmi.objectives.n.score.min": (READ_WRITE, real()),
+        "cmi.objectives.n.score.max": (READ_WRITE, real()),
+        "cmi.objectives.n.success_status": (READ_WRITE, SUCCESS_STATUS),
+        "cmi.objectives.n.completion_status": (READ_WRITE, COMPLETION_STATUS),
+        "cmi.objectives.n.progress_measure": (READ_WRITE, real(0, 1)),
+        "cmi.objectives.n.description": (READ_WRITE, None),
+        "cmi.progress_measure": (READ_WRITE, real(0, 1)),
+        "cmi.scaled_passing_score": (READ, None),
+        "cmi.score.scaled": (READ_WRITE, real(-1, 1)),
+        "cmi.score.raw": (READ_WRITE, real()),
+        "cmi.score.min": (READ_WRITE, real()),
+        "cmi.score.max": (READ_WRITE, real()),
+        "cmi.session_time": (WRITE, pattern(TIME_INTERVAL_RE)),
+        "cmi.success_status": (READ_WRITE, SUCCESS_STATUS),
+        "cmi.suspend_data": (READ_WRITE, None),
+        "cmi.time_limit_action": (READ, None),
+        "cmi.total_time": (READ, None),
+        "adl.nav.request": (READ_WRITE, None),
+    },
+}
+
+# Answers to <element>._children
+CHILDREN = {
+    "SCORM_12": {
+        "cmi.core": "student_id,student_name,lesson_location,credit,lesson_status,entry,score,total_time,"
+                    "lesson_mode,exit,session_time",
+        "cmi.core.score": "raw,min,max",
+        "cmi.objectives": "id,score,status",
+        "cmi.objectives.n.score": "raw,min,max",
+        "cmi.student_data": "mastery_score,max_time_allowed,time_limit_action",
+        "cmi.student_preference": "audio,language,speed,text",
+        "cmi.interactions": "id,objectives,time,type,correct_responses,weighting,student_response,result,latency",
+    },
+    "SCORM_2004": {
+        "cmi.comments_from_learner": "comment,location,timestamp",
+        "cmi.comments_from_lms": "comment,location,timestamp",
+        "cmi.interactions": "id,type,objectives,timestamp,correct_responses,weighting,learner_response,result,"
+                            "latency,description",
+        "cmi.learner_preference": "audio_level,language,delivery_speed,audio_captioning",
+        "cmi.objectives": "id,score,success_status,completion_status,progress_measure,description",
+        "cmi.objectives.n.score": "scaled,raw,min,max",
+        "cmi.score": "scaled,raw,min,max",
+    },
+}
+
+# Collections that answer <collection>._count
+COLLECTIONS = {
+    "SCORM_12": frozenset([
+        "cmi.objectives", "cmi.interactions", "cmi.interactions.n.objectives", "cmi.interactions.n.correct_responses",
+    ]),
+    "SCORM_2004": frozenset([
+        "cmi.comments_from_learner", "cmi.comments_from_lms", "cmi.objectives", "cmi.interactions",
+        "cmi.interactions.n.objectives", "cmi.interactions.n.correct_responses",
+    ]),
+}
+
+# Collections whose new items must be created by setting their id first
+IDENTIFIED_COLLECTIONS = frozenset(["cmi.objectives", "cmi.interactions"])
+
+# Values of the read only elements the LMS does not track
+DEFAULTS = {
+    "SCORM_12": {
+        "cmi.core.student_id": "",
+        "cmi.core.student_name": "",
+        "cmi.core.credit": "credit",
+        "cmi.core.lesson_mode": "normal",
+        "cmi.core.total_time": "0000:00:00.00",
+        "cmi.launch_data": "",
+        "cmi.comments_from_lms": "",
+    },
+    "SCORM_2004": {
+        "cmi.learner_id": "",
+        "cmi.learner_name": "",
+        "cmi.credit": "credit",
+        "cmi.mode": "normal",
+        "cmi.total_time": "PT0H0M0S",
+    },
+}
+# cmi.entry, and the exit element that tells whether the learner resumes
+ENTRY_ELEMENTS = {
+    "SCORM_12": ("cmi.core.entry", "cmi.core.exit"),
+    "SCORM_2004": ("cmi.entry", "cmi.exit"),
+}
+
+
+RUNTIME_DATA_MODELS = {
+    version: {
+        "elements": {
+            name: [access, check.spec if check is not None else None]
+            for name, (access, check) in elements.items()
+        },
+        "errors": ERROR_CODES[version],
+        "identified": sorted(IDENTIFIED_COLLECTIONS),
+    }
+    for version, elements in ELEMENTS.items()
+}
+
+
+def get_version(version):
+    return version if version in ELEMENTS else "SCORM_12"
+
+
+def get_generic_name(name):
+    """
+    Name of an element with the indexes of its collections replaced by "n".
+    """
+    return INDEX_RE.sub(".n", name)
+
+
+def raise_error(kind, version, message):
+    raise DataModelError(message, ERROR_CODES[version][kind])
+
+
+def get_error_code(kind, version):
+    return ERROR_CODES[get_version(version)][kind]
+
+
+def get_element(name, version):
+    """
+    (access, check) of an element, raising a DataModelError if the version
+    does not define it.
+    """
+    element = None if ".n." in name else ELEMENTS[version].get(get_generic_name(name))
+    if element is None:
+        raise_error("undefined", version, "{} is not an element of the data model".format(name))
+    return element
+
+
+def is_readable(name, version):
+    """
+    Whether GetValue answers the stored value of an element, i.e. whether it
+    is an element of the version that is not write only.
+    """
+    element = None if ".n." in name else ELEMENTS[get_version(version)].get(get_generic_name(name))
+    return element is not None and element[0] != WRITE
+
+
+def get_keyword_value(data, name, version):
+    """
+    Value of a keyword of the data model, or None if the name is no keyword.
+    """
+    if name == "cmi._version":
+        return VERSIONS[version]
+    if name.endswith("._children"):
+        parent = name[:-len("._children")]
+        children = CHILDREN[version].get(get_generic_name(parent))
+        if children is None:
+            raise_error("no_children", version, "{} has no children".format(parent))
+        return children
+    if name.endswith("._count"):
+        collection = name[:-len("._count")]
+        if get_generic_name(collection) not in COLLECTIONS[version]:
+            raise_error("no_count", version, "{} is not a collection".format(collection))
+        return str(get_count(data, collection))
+    return None
+
+
+def get_value(data, name, version, overrides=None):
+    """
+    Answer of GetValue(name) for the learner store `data`. Elements the LMS
+    tracks in other fields, such as the status, are taken from `overrides`.
+    """
+    version = get_version(version)
+    if not name:
+        raise_error("get_failure", version, "GetValue needs an element")
+    value = get_keyword_value(data, name, version)
+    if value is not None:
+        return value
+    access, _ = get_element(name, version)
+    if access == WRITE:
+        raise_error("write_only", version, "{} is write only".format(name))
+    if overrides and name in overrides:
+        return overrides[name]
+    value = get_stored_value(data, name)
+    if value is not None:
+        return value
+
+    entry, exit_element = ENTRY_ELEMENTS[version]
+    if name == entry:
+        return get_entry(data, exit_element)
+    if name in DEFAULTS[version]:
+        return DEFAULTS[version][name]
+    for collection, index, _ in iter_indexes(name):
+        if index >= get_count(data, collection):
+            raise_error("get_failure", version, "{} has no item {}".format(collection, index))
+    if ERROR_CODES[version]["not_initialized"] is None:
+        return ""
+    raise_error("not_initialized", version, "{} is not initialized".format(name))
+
+
+def check_value(data, name, value, version):
+    """
+    Raise a DataModelError if SetValue(name, value) is not allowed for the
+    learner store `data`. The value is a characterstring.
+    """
+    version = get_version(version)
+    if not name:
+        raise_error("general", version, "SetValue needs an element")
+    if name == "cmi._version" or name.endswith("._children") or name.endswith("._count"):
+        raise_error("keyword", version, "{} is a keyword of the data model".format(name))
+    access, check = get_element(name, version)
+    if access == READ:
+        raise_error("read_only", version, "{} is read only".format(name))
+    for collection, index, sub_element in iter_indexes(name):
+        count = get_count(data, collection)
+        if index > count:
+            raise_error("invalid_index", version, "{} is not the next item of {}".format(name, collection))
+        if (index == count and version == "SCORM_2004" and sub_element != "id"
+                and get_generic_name(collection) in IDENTIFIED_COLLECTIONS):
+            raise_error("dependency", version, "{}.{}.id must be set first".format(collection, index))
+    kind = check(value) if check is not None else None
+    if kind is not None:
+        raise_error(kind, version, '"{}" is not a valid value of {}'.format(value, name))
+
+
+def iter_indexes(name):
+    """
+    Yield the (collection, index, sub-element) of each index of a name, e.g.
+    ("cmi.interactions", 0, "objectives.1.id") then
+    ("cmi.interactions.0.objectives", 1, "id") for cmi.interactions.0.objectives.1.id.
+    """
+    for match in INDEX_RE.finditer(name):
+        yield name[:match.start()], int(match.group(1)), name[match.end() + 1:]
+
+
+def get_entry(data, exit_element):
+    """
+    cmi.entry: ab-initio on the first attempt, resume after a suspended one.
+    """
+    if is_empty(data):
+        return "ab-initio"
+    return "resume" if get_stored_value(data, exit_element) == "suspend" else ""
+
+
+def expand(name, data):
+    """
+    Names of the items of an indexed name such as cmi.interactions.n.objectives,
+    for the items of the collection in the store.
+    """
+    if ".n." not in name:
+        return [name]
+    collection, rest = name.split(".n.", 1)
+    return ["{}.{}.{}".format(collection, index, rest) for index in range(get_count(data, collection))]
+
+
+def get_runtime_data_model(version):
+    """
+    Definitions of the elements of a version for the runtime API to check
+    SetValue calls without a request: their access, the spec of the check of
+    their values (e.g. {"vocabulary": [...]} or {"real": [min, max]}), the
+    error codes and the collections whose items are created by their id.
+    """
+    version = get_version(version)
+    return RUNTIME_DATA_MODELS[version]
+
+
+def get_lms_values(data, version):
+    """
+    Values of the keywords and of the read only elements the LMS provides,
+    for the runtime API to answer GetValue without a request.
+    """
+    version = get_version(version)
+    values = {"cmi._version": VERSIONS[version]}
+    for parent, children in CHILDREN[version].items():
+        for name in expand(parent, data):
+            values[name + "._children"] = children
+    for collection in COLLECTIONS[version]:
+        for name in expand(collection, data):
+            values[name + "._count"] = str(get_count(data, name))
+    values.update(DEFAULTS[version])
+    entry, exit_element = ENTRY_ELEMENTS[version]
+    values[entry] = get_entry(data, exit_element)
+    return values
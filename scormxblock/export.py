@@ -0,0 +1,148 @@
+"""
+Streaming export of the learner progress of SCORM blocks.
+
+Learner states are read in pages of bounded size from a state source, and
+turned into CSV or JSONL lines by generators, so that exporting a whole course
+never holds more than a page of states in memory.
+"""
+import csv
+import io
+import json
+
+from .cmi import get_values as get_cmi_values
+
+FORMATS = ("csv", "jsonl")
+# Learner states read at once from the state source
+DEFAULT_BATCH_SIZE = 500
+PROGRESS_FIELDS = ["username", "block_id", "lesson_status", "success_status", "lesson_score"]
+
+
+class StudentModuleSource(object):
+    """
+    Learner states of the courseware StudentModule table, read in pages of
+    `batch_size` rows ordered by primary key.
+    """
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def iter_states(self, usage_keys):
+        """
+        Yield (username, usage key, state dict) for every learner state of the blocks.
+        """
+        try:
+            from lms.djangoapps.courseware.models import StudentModule
+        except ImportError:
+            from courseware.models import StudentModule
+
+        last_id = 0
+        while True:
+            rows = list(
+                StudentModule.objects.filter(module_state_key__in=usage_keys, id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "student__username", "module_state_key", "state")[:self.batch_size]
+            )
+            for _, username, usage_key, state in rows:
+                yield username, str(usage_key), json.loads(state or "{}")
+            if len(rows) < self.batch_size:
+                return
+            last_id = rows[-1][0]
+
+
+class MemorySource(object):
+    """
+    Stand-in state source for tests and scripts: learner states kept in a
+    {(username, usage key): state dict} dict, read in pages like the
+    StudentModule source.
+    """
+    def __init__(self, states, batch_size=DEFAULT_BATCH_SIZE):
+        self.states = states
+        self.batch_size = batch_size
+        self.pages_read = 0
+
+    def iter_states(self, usage_keys):
+        usage_keys = set(str(usage_key) for usage_key in usage_keys)
+        rows = [
+            (username, usage_key, state)
+            for (username, usage_key), state in sorted(self.states.items())
+            if usage_key in usage_keys
+        ]
+        for start in range(0, len(rows), self.batch_size):
+            self.pages_read += 1
+            for row in rows[start:start + self.batch_size]:
+                yield row
+
+
+def iter_progress(usage_keys, columns=None, source=None):
+    """
+    Yield the progress record of every learner state of the blocks. Only the
+    given CMI elements of data_scorm are kept, if any.
+    """
+    source = source or StudentModuleSource()
+    for username, usage_key, state in source.iter_states(usage_keys):
+        data_scorm = get_cmi_values(state.get("data_scorm") or {})
+        if columns:
+            data_scorm = {name: data_scorm[name] for name in columns if name in data_scorm}
+        yield {
+            "username": username,
+            "block_id": usage_key,
+            "lesson_status": state.get("lesson_status", "not attempted"),
+            "success_status": state.get("success_status", "unknown"),
+            "lesson_score": state.get("lesson_score", 0),
+            "data_scorm": data_scorm,
+        }
+
+
+def iter_csv(records, columns=None):
+    """
+    Yield the CSV lines of progress records, header first. Selected CMI
+    elements get a column each; otherwise data_scorm is a single JSON column.
+    """
+    header = PROGRESS_FIELDS + (list(columns) if columns else ["data_scorm"])
+    yield format_csv_row(header)
+    for record in records:
+        row = [record[field] for field in PROGRESS_FIELDS]
+        if columns:
+            row += [record["data_scorm"].get(name, "") for name in columns]
+        else:
+            row.append(json.dumps(record["data_scorm"], sort_keys=True))
+        yield format_csv_row(row)
+
+
+def iter_jsonl(records):
+    """
+    Yield a JSON line per progress record.
+    """
+    for record in records:
+        yield json.dumps(record, sort_keys=True) + "\n"
+
+
+def format_csv_row(row):
+    line = io.StringIO()
+    csv.writer(line).writerow(row)
+    return line.getvalue()
+
+
+def export_progress(usage_keys, export_format="csv", columns=None, source=None):
+    """
+    Generator of the lines of the progress export of the blocks, in CSV or JSONL.
+    """
+    records = iter_progress(usage_keys, columns, source)
+    if export_format == "jsonl":
+        return iter_jsonl(records)
+    return iter_csv(records, columns)
+
+
+def get_usage_keys(key):
+    """
+    Usage keys of the SCORM block with the given usage key, or of every SCORM
+    block of the course with the given course key.
+    """
+    from opaque_keys import InvalidKeyError
+    from opaque_keys.edx.keys import CourseKey, UsageKey
+    from xmodule.modulestore.django import modulestore
+
+    try:
+        return [UsageKey.from_string(key)]
+    except InvalidKeyError:
+        course_key = CourseKey.from_string(key)
+    return [block.location for block in modulestore().get_items(course_key, qualifiers={"category": "scormxblock"})]
@@ -0,0 +1,432 @@
+"""
+Extraction of SCORM packages to the SCORM storage.
+"""
+import functools
+import logging
+import os.path
+import shutil
+import tempfile
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.base import File
+from django.utils._os import safe_join
+
+from .metrics import increment, timed
+from .utils import ScormError, guess_content_type, is_local_storage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Errors that are worth retrying when saving a file in the storage
+TRANSIENT_ERRORS = (IOError, OSError)
+try:
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    pass
+else:
+    TRANSIENT_ERRORS += (BotoCoreError, ClientError)
+
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 2
+# Seconds to wait before the first retry, doubled on each attempt
+RETRY_DELAY = 0.5
+# Maximum number of failed files listed in the error message
+MAX_REPORTED_ERRORS = 10
+# Bytes of a member read at once, so that large members are never held in memory
+CHUNK_SIZE = 64 * 1024
+# Precompressed siblings are kept in memory up to this size, and spooled to disk beyond
+SPOOL_MAX_SIZE = 2 ** 20
+
+DEFAULT_LIMITS = {
+    # Total uncompressed size of the members, in bytes
+    'max_size': 2 * 2 ** 30,
+    'max_files': 20000,
+    # Uncompressed to compressed size ratio of a member, checked for members of at least ratio_min_size bytes
+    'max_ratio': 100,
+    'ratio_min_size': 2 ** 20,
+}
+
+# Suffix of the precompressed siblings of a file, by content coding
+ENCODING_SUFFIXES = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+DEFAULT_COMPRESSION = {
+    # Content codings to generate, brotli is skipped if the module is missing
+    'encodings': ['br', 'gzip'],
+    # Smaller files are not worth a compressed sibling
+    'min_size': 1024,
+    # A sibling is only kept if it is at most this fraction of the original
+    'max_ratio': 0.9,
+    'content_types': [
+        'application/javascript',
+        'application/json',
+        'application/x-javascript',
+        'application/xml',
+        'image/svg+xml',
+        'text/css',
+        'text/html',
+        'text/javascript',
+        'text/plain',
+        'text/xml',
+    ],
+}
+
+
+class PackageLimitError(ScormError):
+    """
+    The package is over the limits of SCORM_PACKAGE_LIMITS.
+    """
+
+
+def get_compression_settings():
+    """
+    Precompression settings, see SCORM_COMPRESSION in settings/common.py.
+    """
+    compression = dict(DEFAULT_COMPRESSION)
+    compression.update(getattr(settings, 'SCORM_COMPRESSION', {}))
+    return compression
+
+
+def get_package_limits():
+    """
+    Package limits, see SCORM_PACKAGE_LIMITS in settings/common.py.
+    """
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(getattr(settings, 'SCORM_PACKAGE_LIMITS', {}))
+    return limits
+
+
+def check_package_limits(members, limits=None):
+    """
+    Raise a PackageLimitError if the members of a package, as listed by the
+    central directory of the zip file, are over the limits.
+
+    The sizes of the central directory can be trusted: members are never
+    extracted beyond their declared size, and a member whose content does not
+    match its CRC-32 fails to extract.
+    """
+    limits = limits or get_package_limits()
+    if len(members) > limits['max_files']:
+        raise PackageLimitError("The package has {} files, more than the limit of {}".format(
+            len(members), limits['max_files']
+        ))
+    total_size = sum(zipinfo.file_size for zipinfo in members)
+    if total_size > limits['max_size']:
+        raise PackageLimitError("The package takes {:.1f} MB once uncompressed, more than the limit of {:.1f} MB".format(
+            total_size / 2.0 ** 20, limits['max_size'] / 2.0 ** 20
+        ))
+    for zipinfo in members:
+        if zipinfo.file_size < limits['ratio_min_size']:
+            continue
+        if zipinfo.file_size > zipinfo.compress_size * limits['max_ratio']:
+            raise PackageLimitError(
+                'The file "{}" of the package is compressed more than {} times, it may be a zip bomb'.format(
+                    zipinfo.filename, limits['max_ratio']
+                )
+            )
+
+
+@timed('extraction.package')
+def extract_package(
+        scorm_zipfile, storage, destination, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, compression=None,
+        progress=None, limits=None
+):
+    """
+    Save every member of the zip file under the destination folder of the storage.
+    Members are streamed in chunks, so memory use does not depend on their size.
+    Packages over the `limits` (by default SCORM_PACKAGE_LIMITS) are rejected
+    with a PackageLimitError before anything is saved.
+
+    Members are saved concurrently by at most `workers` threads, so that the
+    extraction time depends on the bandwidth to the storage rather than on the
+    number of files. Each save is retried `retries` times on transient errors;
+    files that still fail are reported together in a ScormError.
+
+    Compressible members also get precompressed siblings, as configured by the
+    `compression` settings.
+
+    On a local filesystem storage, the storage API is bypassed: members are
+    written to a temporary folder next to the destination, which is renamed
+    into place once the whole package is extracted.
+
+    Return the index of the extracted files, which lets them be served without
+    storage lookups: {filename: [content type, size, CRC-32, {encoding: size}]}.
+    Directories are not part of it.
+
+    If given, `progress` is called, from the calling thread, each time a member
+    has been processed.
+    """
+    members = scorm_zipfile.infolist()
+    check_package_limits(members, limits)
+    if is_local_storage(storage):
+        target = make_local_folder(storage.path(destination))
+        save = functools.partial(write_member, target=target, compression=compression)
+    else:
+        target = None
+        save = functools.partial(
+            save_member, storage=storage, destination=destination, retries=retries, compression=compression
+        )
+    try:
+        files = save_members(scorm_zipfile, members, save, workers, progress)
+        if target is not None:
+            apply_permissions(storage, target)
+            move_into_place(target, storage.path(destination))
+    except BaseException:
+        if target is not None:
+            shutil.rmtree(target, ignore_errors=True)
+        raise
+    increment('extraction.files', len(files))
+    increment('extraction.bytes', sum(entry[1] for entry in files.values()))
+    return files
+
+
+def save_members(scorm_zipfile, members, save, workers=DEFAULT_WORKERS, progress=None):
+    """
+    Save the members with `save(scorm_zipfile, zipinfo)`, by at most `workers`
+    threads, and return the index of the saved files. Failed files are
+    reported together in a ScormError.
+    """
+    errors = []
+    files = {}
+    if workers > 1 and len(members) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(save, scorm_zipfile, zipinfo): zipinfo for zipinfo in members}
+            for future in as_completed(futures):
+                zipinfo = futures[future]
+                error = future.exception()
+                if error is not None:
+                    errors.append((zipinfo.filename, error))
+                elif future.result() is not None:
+                    files[zipinfo.filename] = future.result()
+                if progress is not None:
+                    progress()
+    else:
+        for zipinfo in members:
+            try:
+                entry = save(scorm_zipfile, zipinfo)
+            except Exception as error:  # pylint: disable=broad-except
+                errors.append((zipinfo.filename, error))
+            else:
+                if entry is not None:
+                    files[zipinfo.filename] = entry
+            if progress is not None:
+                progress()
+
+    if errors:
+        errors.sort(key=lambda item: item[0])
+        for filename, error in errors:
+            logger.error('Could not store SCORM file "%s": %s', filename, error)
+        raise ScormError(
+            "Could not store {} of {} files of the package: {}".format(
+                len(errors),
+                len(members),
+                ", ".join(
+                    '"{}" ({})'.format(filename, error) for filename, error in errors[:MAX_REPORTED_ERRORS]
+                ),
+            )
+        )
+    return files
+
+
+def save_member(scorm_zipfile, zipinfo, storage, destination, retries=DEFAULT_RETRIES, compression=None):
+    """
+    Save a single zip member in the storage, with its precompressed siblings.
+    Return its entry in the file index, or None for directories.
+    """
+    path = os.path.join(destination, zipinfo.filename)
+    save_with_retries(storage, path, lambda: open_member(scorm_zipfile, zipinfo), retries)
+    if zipinfo.filename.endswith('/'):
+        return None
+
+    def save_sibling(suffix, compressed):
+        save_with_retries(storage, path + suffix, lambda: rewind(compressed), retries)
+
+    encodings = save_siblings(scorm_zipfile, zipinfo, compression, save_sibling)
+    return [guess_content_type(zipinfo.filename), zipinfo.file_size, "{:08x}".format(zipinfo.CRC), encodings]
+
+
+def write_member(scorm_zipfile, zipinfo, target, compression=None):
+    """
+    Write a single zip member, with its precompressed siblings, under a local
+    folder. Return its entry in the file index, or None for directories.
+    """
+    path = safe_join(target, zipinfo.filename)
+    if zipinfo.filename.endswith('/'):
+        os.makedirs(path, exist_ok=True)
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with scorm_zipfile.open(zipinfo) as member, open(path, 'wb') as local_file:
+        shutil.copyfileobj(member, local_file, CHUNK_SIZE)
+
+    def write_sibling(suffix, compressed):
+        compressed.seek(0)
+        with open(path + suffix, 'wb') as local_file:
+            shutil.copyfileobj(compressed, local_file, CHUNK_SIZE)
+
+    encodings = save_siblings(scorm_zipfile, zipinfo, compression, write_sibling)
+    return [guess_content_type(zipinfo.filename), zipinfo.file_size, "{:08x}".format(zipinfo.CRC), encodings]
+
+
+def save_siblings(scorm_zipfile, zipinfo, compression, save):
+    """
+    Precompress a member as configured by the `compression` settings, and hand
+    every sibling small enough to be worth keeping to `save(suffix, temporary
+    file)`. Return the sizes of the saved siblings, by encoding.
+    """
+    encodings = {}
+    if not compression or not is_compressible(zipinfo, compression):
+        return encodings
+    compressed_files = compress_member(scorm_zipfile, zipinfo, compression['encodings'])
+    try:
+        for encoding, compressed in compressed_files.items():
+            size = compressed.tell()
+            if size > zipinfo.file_size * compression['max_ratio']:
+                continue
+            save(ENCODING_SUFFIXES[encoding], compressed)
+            encodings[encoding] = size
+    finally:
+        for compressed in compressed_files.values():
+            compressed.close()
+    return encodings
+
+
+def make_local_folder(destination):
+    """
+    Create an empty temporary folder next to a local destination folder, on
+    the same filesystem, so that it can be renamed to the destination.
+    """
+    parent, name = os.path.split(destination.rstrip(os.sep))
+    os.makedirs(parent, exist_ok=True)
+    folder = os.path.join(parent, ".{}.{}.tmp".format(name, uuid.uuid4().hex))
+    os.mkdir(folder)
+    return folder
+
+
+def move_into_place(folder, destination):
+    """
+    Rename an extracted folder to its destination, replacing the files of an
+    earlier, maybe partial, extraction of the same package.
+    """
+    try:
+        os.rename(folder, destination)
+    except OSError:
+        if not os.path.isdir(destination):
+            raise
+        previous = folder + ".old"
+        os.rename(destination, previous)
+        os.rename(folder, destination)
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def apply_permissions(storage, folder):
+    """
+    Give the files and folders written in a local folder the permissions the
+    filesystem storage would have given them.
+    """
+    file_mode, directory_mode = storage.file_permissions_mode, storage.directory_permissions_mode
+    if file_mode is None and directory_mode is None:
+        return
+    for root, _, names in os.walk(folder):
+        if directory_mode is not None:
+            os.chmod(root, directory_mode)
+        if file_mode is not None:
+            for name in names:
+                os.chmod(os.path.join(root, name), file_mode)
+
+
+def open_member(scorm_zipfile, zipinfo):
+    """
+    Stream of the content of a zip member, read in chunks by the storage.
+    """
+    member = File(scorm_zipfile.open(zipinfo), name=zipinfo.filename)
+    member.size = zipinfo.file_size
+    return member
+
+
+@contextmanager
+def rewind(content):
+    """
+    Read a temporary file again from the start, without closing it afterwards.
+    """
+    content.seek(0)
+    yield File(content)
+
+
+def save_with_retries(storage, path, open_content, retries=DEFAULT_RETRIES):
+    """
+    Save a file in the storage, retrying on transient errors. `open_content`
+    returns the content to save as a context manager, and is called again on
+    every attempt since streams can't always be read twice.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with open_content() as content_file:
+                if os.path.splitext(path)[-1] in ["js", ".js"]:
+                    content_file.content_type = 'text/javascript' # fix b'text/javascript'
+                storage.save(path, content_file)
+            return
+        except TRANSIENT_ERRORS as error:
+            if attempt == retries:
+                raise
+            logger.warning(
+                'Error storing SCORM file "%s" (attempt %d of %d): %s', path, attempt + 1, retries + 1, error
+            )
+            # Do not let a partial write push the retry to an alternative file name
+            if storage.exists(path):
+                storage.delete(path)
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+def is_compressible(zipinfo, compression):
+    """
+    Whether a member deserves precompressed siblings, by size and content type.
+    """
+    if zipinfo.filename.endswith('/') or zipinfo.file_size < compression['min_size']:
+        return False
+    return guess_content_type(zipinfo.filename) in compression['content_types']
+
+
+def compress_member(scorm_zipfile, zipinfo, encodings):
+    """
+    Compress a zip member with each available content coding, in a single
+    pass over its chunks. Return {encoding: temporary file of the compressed
+    content}, each positioned at its end.
+    """
+    compressors = {}
+    for encoding in encodings:
+        compressor = get_compressor(encoding)
+        if compressor is not None:
+            compressors[encoding] = (compressor, tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE))
+    if compressors:
+        with scorm_zipfile.open(zipinfo) as member:
+            for chunk in iter(lambda: member.read(CHUNK_SIZE), b''):
+                for (process, _), compressed in compressors.values():
+                    compressed.write(process(chunk))
+        for (_, finish), compressed in compressors.values():
+            compressed.write(finish())
+    return {encoding: compressed for encoding, (_, compressed) in compressors.items()}
+
+
+def get_compressor(encoding):
+    """
+    Incremental compressor of a content coding, as a pair of functions that
+    compress a chunk and flush the end of the stream, or None if the coding is
+    not available.
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress, compressor.flush
+    if encoding == 'br' and brotli is not None:
+        compressor = brotli.Compressor()
+        return getattr(compressor, 'process', None) or compressor.compress, compressor.finish
+    return None
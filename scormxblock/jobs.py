@@ -0,0 +1,405 @@
+"""
+Background processing of uploaded SCORM packages.
+
+Studio only spools the upload to a local temporary file and enqueues a job.
+Hashing, storage and extraction of the package run on the configured executor,
+and the state of the job is kept in the Django cache, where the block polls it
+to switch to the new package once it has been processed. The result of a
+successful job is also saved in the storage, so that the block still switches
+to its package if nobody polls the job before it expires from the cache.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.base import ContentFile
+
+from .cleanup import get_marker_path
+from .extraction import check_package_limits, extract_package
+from .manifest import validate_package
+from .metrics import increment, timed
+from .utils import (
+    CHUNK_SIZE, JOBS_FOLDER, UPLOADS_FOLDER, ScormError, copy_and_hash, get_package_folder, get_scorm_location,
+    get_scorm_storage, hash_file
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Seconds a job is kept in the cache
+JOB_TIMEOUT = 24 * 60 * 60
+# Minimum seconds between two writes of the progress of a job
+PROGRESS_INTERVAL = 0.5
+INVALID_ZIP_ERROR = "Invalid package: the file is not a zip file"
+
+DEFAULT_PROCESSING = {
+    # 'thread' or 'process' pool of this process, 'celery' task or 'sync'
+    'executor': 'thread',
+    'workers': 2,
+    # Cache alias where the state of the jobs is kept
+    'cache': 'default',
+    # Folder of the local copies of the uploads, None for the system default
+    'tmp_dir': None,
+    # Maximum size of the chunks of the uploads from Studio
+    'chunk_size': 5 * 2 ** 20,
+}
+
+# Pool executors of this process, by kind and number of workers
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_processing_settings():
+    """
+    Package processing settings, see SCORM_PROCESSING in the README.
+    """
+    processing = dict(DEFAULT_PROCESSING)
+    processing.update(getattr(settings, 'SCORM_PROCESSING', {}))
+    return processing
+
+
+def get_job(job_id):
+    """
+    State of a job, or None if it is unknown or expired. Successful jobs are
+    read from their result in the storage once expired from the cache.
+
+    The cache only holds the progress of the jobs: the meta and index of the
+    package of a successful job, which can be large, are only in its result.
+    """
+    if not job_id:
+        return None
+    job = get_job_cache().get(get_job_cache_key(job_id))
+    if job is None:
+        job = read_job_result(job_id)
+    return job
+
+
+def save_job(job):
+    get_job_cache().set(get_job_cache_key(job["id"]), job, JOB_TIMEOUT)
+
+
+def update_job(job_id, **changes):
+    """
+    Update the state of a job. Only the worker that processes a job writes it
+    once it has been submitted.
+    """
+    job = get_job_cache().get(get_job_cache_key(job_id))
+    if job is None:
+        return None
+    job.update(changes)
+    save_job(job)
+    return job
+
+
+def get_job_cache():
+    return caches[get_processing_settings()['cache']]
+
+
+def get_job_cache_key(job_id):
+    return "scormxblock.package_job.{}".format(job_id)
+
+
+def get_job_result_path(job_id, location):
+    return "{}/{}/{}.json".format(location, JOBS_FOLDER, job_id)
+
+
+def save_job_result(storage, job, location):
+    """
+    Keep the state of a successful job in the storage, with the meta and
+    index of its package, beyond the cache TTL.
+    """
+    storage.save(get_job_result_path(job["id"], location), ContentFile(json.dumps(job).encode("utf8")))
+
+
+def read_job_result(job_id):
+    storage = get_scorm_storage()
+    try:
+        with storage.open(get_job_result_path(job_id, get_scorm_location())) as result_file:
+            return json.loads(result_file.read().decode("utf8"))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def delete_job_result(job_id):
+    """
+    Delete the result of a job once the block has switched to its package.
+    """
+    path = get_job_result_path(job_id, get_scorm_location())
+    storage = get_scorm_storage()
+    if storage.exists(path):
+        storage.delete(path)
+
+
+def get_job_progress(job):
+    """
+    Public view of the state of a job, as reported to Studio.
+    """
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "bytes_hashed": job["bytes_hashed"],
+        "bytes_total": job["bytes_total"],
+        "files_extracted": job["files_extracted"],
+        "files_total": job["files_total"],
+        "errors": job["errors"],
+    }
+
+
+def start_job(upload, name, options):
+    """
+    Copy the uploaded file object to a local temporary file, and submit a job
+    that processes it on the configured executor. Return the id of the job.
+
+    `options` holds the settings of the block needed by the job: location,
+    workers, retries and compression. The SHA-1 of the upload is computed
+    while it is copied, so the job does not read the package again to hash it.
+    """
+    processing = get_processing_settings()
+    with tempfile.NamedTemporaryFile(dir=processing['tmp_dir'], suffix=".zip", delete=False) as package_copy:
+        sha1, _ = copy_and_hash(upload, package_copy)
+    return enqueue_job(package_copy.name, name, dict(options, sha1=sha1))
+
+
+def enqueue_job(path, name, options):
+    """
+    Submit a job that processes the package at the given local path, which
+    then belongs to the job. Return the id of the job.
+
+    Invalid packages are rejected right away, without reaching the executor
+    nor the storage: the job is saved as failed. The manifest is only parsed
+    there, and its index handed over to the job.
+    """
+    processing = get_processing_settings()
+    package_index, errors = check_package(path)
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": JOB_FAILED if errors else JOB_PENDING,
+        "bytes_hashed": 0,
+        "bytes_total": os.path.getsize(path),
+        "files_extracted": 0,
+        "files_total": 0,
+        "errors": errors,
+    }
+    save_job(job)
+    if errors:
+        increment('jobs.rejected')
+        os.remove(path)
+        return job["id"]
+
+    options = dict(options, name=name, source=path, staging_path=None, index=package_index)
+    try:
+        submit_job(job["id"], options, processing)
+    except Exception:
+        os.remove(path)
+        raise
+    return job["id"]
+
+
+def check_package(path):
+    """
+    Validate the package at a local path from its zip central directory and
+    its manifest. Return the index of the manifest, and the errors that make
+    the package invalid.
+    """
+    try:
+        with zipfile.ZipFile(path, "r") as scorm_zipfile:
+            check_package_limits(scorm_zipfile.infolist())
+            return validate_package(scorm_zipfile), []
+    except zipfile.BadZipfile:
+        return None, [INVALID_ZIP_ERROR]
+    except ScormError as e:
+        return None, [e.args[0]]
+
+
+def submit_job(job_id, options, processing):
+    """
+    Run process_package for the job on the configured executor.
+    """
+    executor = processing['executor']
+    if executor == 'sync':
+        process_package(job_id, options)
+    elif executor in ('thread', 'process'):
+        get_pool_executor(executor, processing['workers']).submit(process_package, job_id, options)
+    elif executor == 'celery':
+        from .tasks import process_package_task
+        # Workers may run on other hosts: hand the upload over through the storage
+        storage = get_scorm_storage()
+        staging_path = "{}/{}/{}.zip".format(options["location"], UPLOADS_FOLDER, job_id)
+        with open(options["source"], "rb") as package_file:
+            staging_path = storage.save(staging_path, File(package_file))
+        os.remove(options["source"])
+        process_package_task.delay(job_id, dict(options, source=None, staging_path=staging_path))
+    else:
+        raise ImproperlyConfigured("Unknown SCORM processing executor: {}".format(executor))
+
+
+def get_pool_executor(kind, workers):
+    """
+    Pool executor of this process, built on first use.
+    """
+    key = (kind, workers)
+    with _executors_lock:
+        if key not in _executors:
+            executor_class = ThreadPoolExecutor if kind == 'thread' else ProcessPoolExecutor
+            _executors[key] = executor_class(max_workers=workers)
+        return _executors[key]
+
+
+@timed('jobs.process_package')
+def process_package(job_id, options):
+    """
+    Hash, store and extract the uploaded package of a job, checked by
+    enqueue_job. On success the result of the job holds the meta and index of
+    the package that the block switches to; on failure, the job holds the
+    errors to report.
+    """
+    update_job(job_id, status=JOB_RUNNING)
+    storage = get_scorm_storage()
+    source = options["source"]
+    try:
+        if source is None:
+            source = download_package(storage, options["staging_path"])
+        with open(source, "rb") as package_file:
+            if options.get("sha1"):
+                sha1 = options["sha1"]
+                size = os.path.getsize(source)
+            else:
+                sha1, size = hash_file(package_file, progress=ProgressWriter(job_id, "bytes_hashed"))
+                package_file.seek(0)
+            # The package counts as used by the garbage collection from now on
+            update_job(job_id, bytes_hashed=size, sha1=sha1)
+            meta = {
+                "sha1": sha1,
+                "name": options["name"],
+                "last_updated": options["last_updated"],
+                "size": size,
+                "shared": True,
+            }
+            package_folder = get_package_folder(sha1, options["location"])
+
+            # The package was checked, and its manifest parsed, by enqueue_job
+            package_index = options["index"]
+            with zipfile.ZipFile(package_file, "r") as scorm_zipfile:
+                if is_package_extracted(storage, package_folder, options["location"], sha1):
+                    # The same package was already uploaded, maybe by another block or
+                    # course run: its extracted files can be shared.
+                    logger.info('Scorm "%s" already extracted at "%s"', meta["name"], package_folder)
+                else:
+                    # First, save scorm file in the storage for mobile clients
+                    package_file.seek(0)
+                    storage.save(package_folder + ".zip", File(package_file))
+                    logger.info('Scorm "%s" file stored at "%s"', meta["name"], package_folder + ".zip")
+
+                    # Then, extract zip file
+                    files_total = len(scorm_zipfile.infolist())
+                    update_job(job_id, files_total=files_total)
+                    files = extract_package(
+                        scorm_zipfile,
+                        storage,
+                        package_folder,
+                        workers=options["workers"],
+                        retries=options["retries"],
+                        compression=options["compression"],
+                        progress=ProgressWriter(job_id, "files_extracted", step=1),
+                    )
+                    update_job(job_id, files_extracted=files_total)
+                    save_package_record(storage, package_folder + ".json", meta, files)
+
+        # The result is saved before the job is done, for the block to switch to it
+        job = get_job_cache().get(get_job_cache_key(job_id)) or {
+            "id": job_id, "bytes_hashed": size, "bytes_total": size, "files_extracted": 0, "files_total": 0,
+            "errors": [],
+        }
+        save_job_result(storage, dict(job, status=JOB_DONE, meta=meta, index=package_index), options["location"])
+    except zipfile.BadZipfile:
+        update_job(job_id, status=JOB_FAILED, errors=[INVALID_ZIP_ERROR])
+    except ScormError as e:
+        update_job(job_id, status=JOB_FAILED, errors=[e.args[0]])
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Could not process the SCORM package of job "%s"', job_id)
+        update_job(job_id, status=JOB_FAILED, errors=["Unexpected error while processing the package"])
+    else:
+        update_job(job_id, status=JOB_DONE)
+    finally:
+        if source is not None and os.path.exists(source):
+            os.remove(source)
+        if options["staging_path"] and storage.exists(options["staging_path"]):
+            storage.delete(options["staging_path"])
+
+
+def is_package_extracted(storage, package_folder, location, sha1):
+    """
+    Whether a package is completely extracted in the shared store, and kept
+    from the garbage collection. Its marker is removed first, then its record
+    checked again: a run that checked the marker before deletes the record
+    first, so a package being deleted is extracted again.
+    """
+    if not storage.exists(package_folder + ".json"):
+        return False
+    storage.delete(get_marker_path(location, sha1))
+    return storage.exists(package_folder + ".json")
+
+
+def download_package(storage, path):
+    """
+    Copy a package from the storage to a local temporary file, and return its path.
+    """
+    processing = get_processing_settings()
+    with storage.open(path) as staged_file, tempfile.NamedTemporaryFile(
+            dir=processing['tmp_dir'], suffix=".zip", delete=False
+    ) as package_copy:
+        shutil.copyfileobj(staged_file, package_copy, CHUNK_SIZE)
+    return package_copy.name
+
+
+def save_package_record(storage, path, meta, files):
+    """
+    Mark a package as completely extracted, so that later uploads of the same
+    package can skip extraction. The record also holds the index of the
+    extracted files used by the LMS to serve them.
+    """
+    record = {
+        "sha1": meta["sha1"],
+        "size": meta["size"],
+        "created": meta["last_updated"],
+        "files": files,
+    }
+    storage.save(path, ContentFile(json.dumps(record).encode("utf8")))
+
+
+class ProgressWriter(object):
+    """
+    Write a progress counter of a job to the cache, at most once every
+    PROGRESS_INTERVAL seconds.
+
+    Called with the new value of the counter, or without arguments to add
+    `step` to it.
+    """
+    def __init__(self, job_id, counter, step=0):
+        self.job_id = job_id
+        self.counter = counter
+        self.step = step
+        self.value = 0
+        self.written_at = time.time()
+
+    def __call__(self, value=None):
+        self.value = self.value + self.step if value is None else value
+        now = time.time()
+        if now - self.written_at >= PROGRESS_INTERVAL:
+            self.written_at = now
+            update_job(self.job_id, **{self.counter: self.value})
@@ -0,0 +1,37 @@
+"""
+Export the learner progress of a SCORM block, or of every SCORM block of a course.
+
+    ./manage.py lms export_scorm_progress course-v1:org+course+run --format csv --output progress.csv
+"""
+import io
+
+from django.core.management.base import BaseCommand
+
+from scormxblock.export import DEFAULT_BATCH_SIZE, FORMATS, StudentModuleSource, export_progress, get_usage_keys
+
+
+class Command(BaseCommand):
+    help = "Export the learner progress of a SCORM block, or of every SCORM block of a course, as CSV or JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("key", help="Course key, or usage key of a SCORM block")
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument(
+            "--columns", default="",
+            help="Comma-separated CMI elements exported as columns, e.g. cmi.location,cmi.suspend_data",
+        )
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--output", default="-", help="Output file, standard output by default")
+
+    def handle(self, *args, **options):
+        usage_keys = get_usage_keys(options["key"])
+        columns = [column.strip() for column in options["columns"].split(",") if column.strip()]
+        lines = export_progress(
+            usage_keys, options["format"], columns, StudentModuleSource(options["batch_size"])
+        )
+        if options["output"] == "-":
+            for line in lines:
+                self.stdout.write(line, ending="")
+        else:
+            with io.open(options["output"], "w", encoding="utf8", newline="") as output:
+                output.writelines(lines)
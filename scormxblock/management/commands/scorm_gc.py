@@ -0,0 +1,45 @@
+"""
+Delete the extracted SCORM packages that no block uses anymore.
+
+    ./manage.py cms scorm_gc --dry-run
+    ./manage.py cms scorm_gc --grace-days 7 --workers 8
+
+Unreferenced packages are marked by a first run, and deleted by a later run
+once they have been unreferenced for longer than the grace period.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from scormxblock.cleanup import (
+    DEFAULT_GRACE_PERIOD, DEFAULT_WORKERS, collect_garbage, get_referenced_packages, iter_scorm_blocks
+)
+from scormxblock.utils import get_scorm_location, get_scorm_storage
+
+
+class Command(BaseCommand):
+    help = "Delete the extracted SCORM packages that no block has used for longer than the grace period."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be marked and deleted")
+        parser.add_argument("--grace-days", type=float, default=DEFAULT_GRACE_PERIOD.days)
+        parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Files deleted in parallel")
+        parser.add_argument("--location", help="Folder of the packages in the storage, LOCATION by default")
+
+    def handle(self, *args, **options):
+        location = options["location"] or get_scorm_location()
+        report = collect_garbage(
+            get_scorm_storage(),
+            location,
+            get_referenced_packages(iter_scorm_blocks()),
+            grace_period=timedelta(days=options["grace_days"]),
+            workers=max(1, options["workers"]),
+            dry_run=options["dry_run"],
+        )
+        summary = "Would have marked" if options["dry_run"] else "Marked"
+        for action in ("marked", "unmarked", "deleted"):
+            for key in report[action]:
+                self.stdout.write("{} {}".format(action, "/".join(key) if isinstance(key, tuple) else key))
+        self.stdout.write("{} {}, unmarked {} and deleted {} packages ({} files).".format(
+            summary, len(report["marked"]), len(report["unmarked"]), len(report["deleted"]), report["files_deleted"]
+        ))
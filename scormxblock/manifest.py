@@ -0,0 +1,257 @@
+"""
+Parsing of the imsmanifest.xml file of SCORM packages.
+"""
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote, urlsplit
+
+from .metrics import timed
+from .utils import ScormError
+
+MANIFEST_PATH = "imsmanifest.xml"
+# Page launched when the manifest does not point to any
+DEFAULT_LAUNCH = "index.html"
+XML_BASE = "{http://www.w3.org/XML/1998/namespace}base"
+# Maximum number of offending paths listed in an error message
+MAX_REPORTED_PATHS = 5
+# Absolute paths, Windows drive letters included
+ABSOLUTE_PATH_RE = re.compile(r'^(/|[A-Za-z]:)')
+
+
+def read_package_index(scorm_zipfile):
+    """
+    Parse the manifest at the root of an open zip file into a package index.
+    """
+    try:
+        manifest_file = scorm_zipfile.open(MANIFEST_PATH)
+    except KeyError:
+        raise ScormError(
+            "Invalid package: could not find 'imsmanifest.xml' file at the root of the zip file"
+        )
+    with manifest_file:
+        return parse_manifest(manifest_file)
+
+
+def validate_package(scorm_zipfile):
+    """
+    Check a package from the central directory of its zip file and its
+    manifest only, so that invalid packages are rejected before anything is
+    stored, and return its package index. Raise a ScormError if:
+
+    * a member has an absolute path, or a path out of the package with "..";
+    * a member is present more than once;
+    * the manifest is missing at the root of the zip file;
+    * a launch page of the manifest is not a member of the package.
+    """
+    names = [zipinfo.filename for zipinfo in scorm_zipfile.infolist()]
+    unsafe = [name for name in names if not is_safe_path(name)]
+    if unsafe:
+        raise ScormError("Invalid package: unsafe file paths {}".format(format_paths(unsafe)))
+    members = set()
+    duplicates = []
+    for name in names:
+        member = normalize_path(name)
+        if member in members and name not in duplicates:
+            duplicates.append(name)
+        members.add(member)
+    if duplicates:
+        raise ScormError("Invalid package: files present more than once {}".format(format_paths(duplicates)))
+
+    index = read_package_index(scorm_zipfile)
+    missing = [href for href in get_launch_hrefs(index) if href_to_path(href) not in members]
+    if missing:
+        raise ScormError("Invalid package: launch pages not found in the zip file {}".format(format_paths(missing)))
+    return index
+
+
+def is_safe_path(name):
+    """
+    Whether a member path stays inside the folder the package is extracted to.
+    """
+    name = name.replace("\\", "/")
+    return "\0" not in name and not ABSOLUTE_PATH_RE.match(name) and ".." not in name.split("/")
+
+
+def normalize_path(name):
+    return posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+
+
+def href_to_path(href):
+    """
+    Member path of a relative href of the manifest, without its query string
+    and fragment. None for urls out of the package.
+    """
+    parts = urlsplit(href)
+    if parts.scheme or parts.netloc:
+        return None
+    return normalize_path(unquote(parts.path))
+
+
+def get_launch_hrefs(index):
+    """
+    Hrefs of the pages that can be launched: the launch page, and the
+    resources of the items of the default organization. Urls out of the
+    package are left out.
+    """
+    hrefs = [index["launch"]]
+    organizations = index["organizations"]
+    default = [o for o in organizations if o["identifier"] == index["default_organization"]] or organizations[:1]
+    for organization in default:
+        for item in organization["items"]:
+            resource = index["resources"].get(item["resource"])
+            if resource and resource["href"] and resource["href"] not in hrefs:
+                hrefs.append(resource["href"])
+    return [href for href in hrefs if href_to_path(href) is not None]
+
+
+def format_paths(paths):
+    listed = ", ".join('"{}"'.format(path) for path in paths[:MAX_REPORTED_PATHS])
+    if len(paths) > MAX_REPORTED_PATHS:
+        listed += " and {} more".format(len(paths) - MAX_REPORTED_PATHS)
+    return listed
+
+
+@timed('manifest.parse')
+def parse_manifest(manifest_file):
+    """
+    Parse a manifest, in a single streaming pass, into a compact package index:
+
+        {
+            "version": "SCORM_12" or "SCORM_2004",
+            "schemaversion": "1.2",
+            "default_organization": "ORG-1",
+            "organizations": [
+                {"identifier": "ORG-1", "title": "...", "items": [
+                    {"identifier": "ITEM-1", "title": "...", "resource": "RES-1", "parameters": None, "level": 1},
+                ]},
+            ],
+            "resources": {
+                "RES-1": {"href": "index.html", "type": "webcontent", "scormtype": "sco",
+                          "files": ["index.html", ...], "dependencies": [...]},
+            },
+            "scos": ["RES-1"],
+            "launch": "index.html",
+        }
+    """
+    index = {
+        "version": "SCORM_12",
+        "schemaversion": None,
+        "default_organization": None,
+        "organizations": [],
+        "resources": {},
+        "scos": [],
+        "launch": DEFAULT_LAUNCH,
+    }
+    path = []
+    organization = None
+    items = []
+    resources_base = ""
+    resource = None
+    try:
+        for event, element in ET.iterparse(manifest_file, events=("start", "end")):
+            name = local_name(element.tag)
+            if event == "start":
+                path.append(name)
+                parent = path[-2] if len(path) > 1 else None
+                if path == ["manifest", "organizations"]:
+                    index["default_organization"] = element.get("default")
+                elif path == ["manifest", "organizations", "organization"]:
+                    organization = {"identifier": element.get("identifier"), "title": None, "items": []}
+                    index["organizations"].append(organization)
+                elif name == "item" and organization is not None:
+                    item = {
+                        "identifier": element.get("identifier"),
+                        "title": None,
+                        "resource": element.get("identifierref"),
+                        "parameters": element.get("parameters"),
+                        "level": len(items) + 1,
+                    }
+                    organization["items"].append(item)
+                    items.append(item)
+                elif path == ["manifest", "resources"]:
+                    resources_base = element.get(XML_BASE, "")
+                elif path == ["manifest", "resources", "resource"]:
+                    base = resources_base + element.get(XML_BASE, "")
+                    href = element.get("href")
+                    resource = {
+                        "href": base + href if href else None,
+                        "type": element.get("type"),
+                        "scormtype": (get_attribute(element, "scormtype") or "").lower() or None,
+                        "files": [],
+                        "dependencies": [],
+                    }
+                    identifier = element.get("identifier")
+                    index["resources"][identifier] = resource
+                    if resource["scormtype"] == "sco":
+                        index["scos"].append(identifier)
+                elif resource is not None and parent == "resource":
+                    if name == "file" and element.get("href"):
+                        resource["files"].append(element.get("href"))
+                    elif name == "dependency" and element.get("identifierref"):
+                        resource["dependencies"].append(element.get("identifierref"))
+            else:
+                parent = path[-2] if len(path) > 1 else None
+                if name == "title":
+                    title = (element.text or "").strip()
+                    if parent == "item" and items:
+                        items[-1]["title"] = title
+                    elif parent == "organization" and organization is not None:
+                        organization["title"] = title
+                elif name == "item" and items:
+                    items.pop()
+                elif name == "organization":
+                    organization = None
+                elif name == "resource":
+                    resource = None
+                elif path == ["manifest", "metadata", "schemaversion"]:
+                    index["schemaversion"] = (element.text or "").strip()
+                path.pop()
+                # Elements are not needed once parsed, free them as we go
+                element.clear()
+    except ET.ParseError as e:
+        raise ScormError("Invalid package: 'imsmanifest.xml' is not a valid XML file ({})".format(e))
+
+    if index["schemaversion"] is not None and re.match("^1.2$", index["schemaversion"]) is None:
+        index["version"] = "SCORM_2004"
+    index["launch"] = get_launch_href(index)
+    return index
+
+
+def get_launch_href(index):
+    """
+    Page to launch: the resource of the first item of the default
+    organization, or else the first SCO, or else the first resource with a page.
+    """
+    organizations = index["organizations"]
+    default = [o for o in organizations if o["identifier"] == index["default_organization"]]
+    for organization in default + organizations:
+        for item in organization["items"]:
+            resource = index["resources"].get(item["resource"])
+            if resource and resource["href"]:
+                return resource["href"]
+    for identifier in index["scos"]:
+        if index["resources"][identifier]["href"]:
+            return index["resources"][identifier]["href"]
+    for resource in index["resources"].values():
+        if resource["href"]:
+            return resource["href"]
+    return DEFAULT_LAUNCH
+
+
+def local_name(tag):
+    """
+    Tag or attribute name without its namespace.
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def get_attribute(element, name):
+    """
+    Value of an attribute by case-insensitive local name, whatever its
+    namespace prefix (e.g. adlcp:scormtype in SCORM 1.2, adlcp:scormType in 2004).
+    """
+    for key, value in element.attrib.items():
+        if local_name(key).lower() == name:
+            return value
+    return None
@@ -0,0 +1,175 @@
+"""
+Timers and counters of the SCORM xblock operations.
+
+Metrics are sent to the backend configured by SCORM_METRICS:
+
+* 'null' (default): metrics are dropped;
+* 'memory': metrics are kept in the process, e.g. for tests;
+* 'statsd': metrics are sent over UDP with the statsd line protocol;
+* or the dotted path of a class with the same methods as NullMetrics.
+
+Metric names are prefixed with SCORM_METRICS['prefix'] by the statsd backend.
+"""
+import functools
+import json
+import logging
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS = {
+    'backend': 'null',
+    'options': {},
+}
+
+# Backend shared by the whole process, with the settings it was built from
+_metrics_entry = (None, None)
+_metrics_lock = threading.Lock()
+
+
+class NullMetrics(object):
+    """
+    Backend that drops every metric.
+    """
+    def increment(self, name, value=1):
+        pass
+
+    def timing(self, name, milliseconds):
+        pass
+
+
+class MemoryMetrics(NullMetrics):
+    """
+    Backend that keeps the metrics in the process: counters by name, and the
+    list of the timings of each name, in milliseconds.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = defaultdict(int)
+            self.timings = defaultdict(list)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def timing(self, name, milliseconds):
+        with self.lock:
+            self.timings[name].append(milliseconds)
+
+
+class StatsdMetrics(NullMetrics):
+    """
+    Backend that sends each metric as a statsd UDP datagram. Sending never
+    blocks nor fails the measured operation.
+    """
+    def __init__(self, host='localhost', port=8125, prefix='scormxblock'):
+        self.address = (host, int(port))
+        self.prefix = prefix + '.' if prefix else ''
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def send(self, line):
+        try:
+            self.socket.sendto(line.encode('utf8'), self.address)
+        except (IOError, OSError) as error:
+            logger.debug('Could not send SCORM metric "%s": %s', line, error)
+
+    def increment(self, name, value=1):
+        self.send('{}{}:{}|c'.format(self.prefix, name, value))
+
+    def timing(self, name, milliseconds):
+        self.send('{}{}:{:.3f}|ms'.format(self.prefix, name, milliseconds))
+
+
+BACKENDS = {
+    'null': NullMetrics,
+    'memory': MemoryMetrics,
+    'statsd': StatsdMetrics,
+}
+
+
+def get_metrics():
+    """
+    Metrics backend of the process, built again when SCORM_METRICS changes.
+    """
+    global _metrics_entry
+    config = dict(DEFAULT_METRICS)
+    config.update(getattr(settings, 'SCORM_METRICS', {}))
+    key = json.dumps(config, sort_keys=True, default=repr)
+    metrics_key, metrics = _metrics_entry
+    if metrics_key == key:
+        return metrics
+    with _metrics_lock:
+        metrics_key, metrics = _metrics_entry
+        if metrics_key != key:
+            backend = BACKENDS.get(config['backend']) or import_string(config['backend'])
+            metrics = backend(**config['options'])
+            _metrics_entry = (key, metrics)
+        return metrics
+
+
+@receiver(setting_changed)
+def reset_metrics(setting=None, **kwargs):
+    """
+    Drop the metrics backend, so that the next call builds a new one.
+    """
+    global _metrics_entry
+    if setting in (None, 'SCORM_METRICS'):
+        with _metrics_lock:
+            _metrics_entry = (None, None)
+
+
+def increment(name, value=1):
+    get_metrics().increment(name, value)
+
+
+@contextmanager
+def timer(name):
+    """
+    Time the block, in milliseconds. Failures are timed too, and counted
+    as <name>.errors.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment(name + '.errors')
+        raise
+    finally:
+        get_metrics().timing(name, (time.perf_counter() - start) * 1000)
+
+
+def timed(name):
+    """
+    Decorator that times each call of the function.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_storage(storage):
+    """
+    Time every save and open of a storage backend. The instance keeps its
+    class, so that checks such as isinstance(storage, FileSystemStorage) hold.
+    """
+    storage.save = timed('storage.save')(storage.save)
+    storage.open = timed('storage.open')(storage.open)
+    return storage
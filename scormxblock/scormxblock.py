@@ -1,17 +1,14 @@
 import json
-import hashlib
-import re
 import os
 import logging
 import pkg_resources
-import xml.etree.ElementTree as ET
-import zipfile
 import os.path
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlencode
 
-from django.core.files import File
 from django.core.files.base import ContentFile
 from django.urls import reverse
-from django.core.files.uploadedfile import SimpleUploadedFile, InMemoryUploadedFile, TemporaryUploadedFile
 from django.conf import settings
 from django.template import Context, Template
 from django.utils import timezone
@@ -21,7 +18,22 @@ from xblock.core import XBlock
 from xblock.fields import Scope, String, Float, Boolean, Dict, DateTime, Integer
 from xblock.fragment import Fragment
 
-from .utils import get_scorm_storage
+from .cmi import CmiLimitError, get_values as get_cmi_values, set_value as set_cmi_value, to_cmi_string
+from .datamodel import (
+    DataModelError, check_value, get_error_code, get_lms_values, get_runtime_data_model, get_value as get_cmi_value,
+    is_readable,
+)
+from .extraction import DEFAULT_RETRIES, DEFAULT_WORKERS, get_compression_settings, get_package_limits
+from .jobs import (
+    JOB_DONE, JOB_FAILED, delete_job_result, enqueue_job, get_job, get_job_progress, get_processing_settings,
+    read_job_result, start_job,
+)
+from .manifest import MANIFEST_PATH, parse_manifest
+from .metrics import increment, timed, timer
+from .uploads import create_upload, finish_upload, get_upload_offset, is_valid_upload_id, write_chunk
+from .utils import (
+    PACKAGES_FOLDER, REFERENCES_FOLDER, ScormError, get_package_folder, get_scorm_location, get_scorm_storage
+)
 
 from xmodule.util.duedate import get_extended_due_date
 from datetime import datetime
@@ -32,6 +44,23 @@ logger = logging.getLogger(__name__)
 # Make '_' a no-op so we can scrape strings
 _ = lambda text: text
 
+
+@lru_cache(maxsize=None)
+def load_resource(path):
+    """
+    Content of a file of the package, read once per process.
+    """
+    return pkg_resources.resource_string(__name__, path).decode("utf8")
+
+
+@lru_cache(maxsize=None)
+def load_template(path):
+    """
+    Template of the package, compiled once per process.
+    """
+    return Template(load_resource(path))
+
+
 @XBlock.wants("settings")
 class ScormXBlock(XBlock):
 
@@ -52,6 +81,10 @@ class ScormXBlock(XBlock):
     scorm_file_meta = Dict(
         scope=Scope.content
     )
+    # id of the job processing the last uploaded package, until it ends
+    package_job = String(
+        scope=Scope.content
+    )
     version_scorm = String(
         default="SCORM_12",
         scope=Scope.settings,
@@ -73,6 +106,11 @@ class ScormXBlock(XBlock):
         scope=Scope.user_state,
         default=0
     )
+    # last grade sent to the runtime, to skip publishing the same one again
+    published_grade = Dict(
+        scope=Scope.user_state,
+        default={}
+    )
     weight = Integer(
         display_name=_('Puntaje Máximo'),
         help=_("Puntaje máximo del Scorm. Por defecto el valor es 1."),
@@ -104,16 +142,35 @@ class ScormXBlock(XBlock):
 
     has_author_view = True
     show_in_read_only_mode = True
+    # Serve the static folder through runtime.local_resource_url
+    public_dir = "static"
+
+    # Number of grade publications skipped by this process because they would
+    # not change the learner's grade
+    suppressed_grade_publishes = 0
+    _grade_publishing_deferred = False
+    _grade_publish_pending = False
 
     def render_template(self, template_path, context):
-        template_str = self.resource_string(template_path)
-        template = Template(template_str)
+        template = load_template(template_path)
         return template.render(Context(context))
 
     def resource_string(self, path):
         """Handy helper for getting resources from our kit."""
-        data = pkg_resources.resource_string(__name__, path)
-        return data.decode("utf8")
+        return load_resource(path)
+
+    def add_static_resources(self, frag, css_path, js_path):
+        """
+        Add the CSS and JS of a view to the fragment: inlined by default, or as
+        urls of the runtime's local resources when the INLINE_ASSETS xblock
+        setting is False, so that browsers download and cache them only once.
+        """
+        if self.get_xblock_settings().get("INLINE_ASSETS", True):
+            frag.add_css(self.resource_string(css_path))
+            frag.add_javascript(self.resource_string(js_path))
+        else:
+            frag.add_css_url(self.runtime.local_resource_url(self, css_path))
+            frag.add_javascript_url(self.runtime.local_resource_url(self, js_path))
 
     def student_view(self, context=None):
         student_context = {
@@ -125,10 +182,13 @@ class ScormXBlock(XBlock):
         student_context.update(context or {})
         template = self.render_template("static/html/scormxblock.html", student_context)
         frag = Fragment(template)
-        frag.add_css(self.resource_string("static/css/scormxblock.css"))
-        frag.add_javascript(self.resource_string("static/js/src/scormxblock.js"))
+        self.add_static_resources(frag, "static/css/scormxblock.css", "static/js/src/scormxblock.js")
         frag.initialize_js(
-            "ScormXBlock", json_args={"version_scorm": self.version_scorm}
+            "ScormXBlock", json_args={
+                "version_scorm": self.version_scorm,
+                "cmi_data": self.get_cmi_data(),
+                "data_model": get_runtime_data_model(self.version_scorm),
+            }
         )
         return frag
     
@@ -147,14 +207,18 @@ class ScormXBlock(XBlock):
         studio_context.update(context or {})
         template = self.render_template("static/html/studio.html", studio_context)
         frag = Fragment(template)
-        frag.add_css(self.resource_string("static/css/scormxblock.css"))
-        frag.add_javascript(self.resource_string("static/js/src/studio.js"))
-        frag.initialize_js("ScormStudioXBlock")
+        self.add_static_resources(frag, "static/css/scormxblock.css", "static/js/src/studio.js")
+        frag.initialize_js("ScormStudioXBlock", json_args={
+            "package_job": self.package_job,
+            "chunk_size": get_processing_settings()["chunk_size"],
+        })
         return frag
 
     def author_view(self, context=None):
         context = context or {}
-        if not self.path_index_page:
+        if self.package_job:
+            context["message"] = "El paquete SCORM se está procesando. Edite el componente para ver su avance."
+        elif not self.path_index_page:
             context["message"] = "Aún no se sube ningún archivo SCORM. Edite el componente para configurar."
         else:
             context["message"] = "El componente SCORM solo estará visible en el LMS."
@@ -168,8 +232,20 @@ class ScormXBlock(XBlock):
             json.dumps(data), content_type="application/json", charset="utf8"
         )
 
+    def can_upload_package(self):
+        """
+        Whether the user may upload packages: course staff in the LMS, or any
+        user of Studio, which only lets course authors edit blocks.
+        """
+        if getattr(self.runtime, "user_is_staff", False):
+            return True
+        return getattr(settings, "ROOT_URLCONF", "").split(".")[0] == "cms"
+
     @XBlock.handler
+    @timed('handler.studio_submit')
     def studio_submit(self, request, suffix=''):
+        if not self.can_upload_package():
+            return Response(status=403)
         self.display_name = request.params['display_name']
         self.width = request.params['width']
         self.height = request.params['height']
@@ -178,56 +254,128 @@ class ScormXBlock(XBlock):
         self.icon_class = 'problem' if self.has_score == 'True' else 'video'
 
         response = {"result": "success", "errors": []}
-        if not hasattr(request.params["file"], "file"):
+        # The editor posts the settings without any file, and then uploads the
+        # package in chunks with upload_chunk
+        if not hasattr(request.params.get("file"), "file"):
             # File not uploaded
             return self.json_response(response)
 
         package_file = request.params["file"].file
-        package_data = package_file.read()
-        self.update_package_meta(package_file)
-
-        # Clone zip file before django closes it when uploaded
-        if isinstance(package_file, InMemoryUploadedFile) or isinstance(package_file, TemporaryUploadedFile):
-            package_file = SimpleUploadedFile(
-                package_file.name,
-                package_data,
-                package_file.content_type
-            )
-
-        # First, save scorm file in the storage for mobile clients
-        storage = get_scorm_storage()
-        storage.save(self.package_path, File(package_file))
-        logger.info('Scorm "%s" file stored at "%s"', package_file, self.package_path)
-
-        # Then, extract zip file
-        if isinstance(package_file, InMemoryUploadedFile) or isinstance(package_file, TemporaryUploadedFile):
-            package_file = SimpleUploadedFile(
-                package_file.name,
-                package_data,
-                package_file.content_type
-            )
-
-        with zipfile.ZipFile(package_file, "r") as scorm_zipfile:
-            for zipinfo in scorm_zipfile.infolist():
-                content_file = ContentFile(scorm_zipfile.open(zipinfo.filename).read())
-                if os.path.splitext(zipinfo.filename)[-1] in ["js", ".js"]:
-                    content_file.content_type = 'text/javascript' # fix b'text/javascript'
-                storage.save(
-                    os.path.join(self.extract_folder_path, zipinfo.filename),
-                    content_file
-                    )
-        try:
-            self.update_package_fields()
-        except ScormError as e:
-            response["errors"].append(e.args[0])
 
+        # The package is hashed, stored and extracted by a background job: the
+        # block switches to it when package_status reports that it succeeded.
+        self.package_job = start_job(package_file, package_file.name, self.get_package_job_options())
+        response.update(self.refresh_package_job(self.package_job))
         return self.json_response(response)
 
+    @XBlock.handler
+    @timed('handler.upload_chunk')
+    def upload_chunk(self, request, suffix=''):
+        """
+        Receive a chunk of a package upload, see uploads.py.
+
+        Without an upload_id, a new upload is started. A chunk is only written
+        if its offset is the number of bytes received so far: the response
+        always holds that number, so that the editor resumes from there. Once
+        the whole package has been received, it is processed as in
+        studio_submit.
+        """
+        if not self.can_upload_package():
+            return Response(status=403)
+        params = request.params
+        # The part file is never let grow over the size limit of the packages
+        max_size = get_package_limits()["max_size"]
+        too_large = "The package is larger than the limit of {:.1f} MB".format(max_size / 2.0 ** 20)
+        if int(params.get("size", 0)) > max_size:
+            return self.json_response({"result": "error", "errors": [too_large]})
+
+        upload_id = params.get("upload_id") or create_upload()
+        response = {"result": "success", "errors": [], "upload_id": upload_id}
+        offset = get_upload_offset(upload_id) if is_valid_upload_id(upload_id) else None
+        if offset is None:
+            response.update({"result": "error", "errors": ["Unknown upload"]})
+            return self.json_response(response)
+
+        chunk = params.get("chunk")
+        if hasattr(chunk, "file") and int(params.get("offset", -1)) == offset:
+            chunk_size = chunk.file.seek(0, os.SEEK_END)
+            if chunk_size > get_processing_settings()["chunk_size"]:
+                response.update({"result": "error", "errors": ["The chunk is too large"], "offset": offset})
+                return self.json_response(response)
+            if offset + chunk_size > max_size:
+                response.update({"result": "error", "errors": [too_large], "offset": offset})
+                return self.json_response(response)
+            chunk.file.seek(0)
+            offset = write_chunk(upload_id, offset, chunk.file)
+        response["offset"] = offset
+
+        if hasattr(chunk, "file") and offset >= int(params.get("size", 0)):
+            path, sha1 = finish_upload(upload_id)
+            self.package_job = enqueue_job(path, params.get("name", "package.zip"), self.get_package_job_options(sha1))
+            response.update(self.refresh_package_job(self.package_job))
+        return self.json_response(response)
+
+    def get_package_job_options(self, sha1=None):
+        """
+        Settings of this block needed to process a package.
+        """
+        return {
+            "last_updated": timezone.now().strftime(DateTime.DATETIME_FORMAT),
+            "location": self.scorm_location(),
+            "workers": self.extraction_workers(),
+            "retries": self.extraction_retries(),
+            "compression": get_compression_settings(),
+            "sha1": sha1,
+        }
+
+    @XBlock.json_handler
+    @timed('handler.package_status')
+    def package_status(self, data, suffix=''):
+        """
+        Report the progress of the processing job of an uploaded package.
+        """
+        return self.refresh_package_job(data.get("job_id") or self.package_job)
+
+    def refresh_package_job(self, job_id):
+        """
+        Get the progress of a package job, and switch the block to its package
+        if it is the pending job of the block and it succeeded.
+        """
+        job = get_job(job_id)
+        if job is None:
+            if job_id == self.package_job:
+                self.package_job = None
+            return {"job_id": job_id, "status": JOB_FAILED, "errors": ["Unknown or expired package job"]}
+        if job_id == self.package_job and job["status"] in (JOB_DONE, JOB_FAILED):
+            self.package_job = None
+            if job["status"] == JOB_DONE:
+                # Jobs read from the cache have no package, which is in their result
+                result = job if "index" in job else read_job_result(job_id)
+                if result is None:
+                    return {
+                        "job_id": job_id, "status": JOB_FAILED, "errors": ["The result of the package job is missing"]
+                    }
+                self.apply_package_job(result)
+                delete_job_result(job_id)
+        return get_job_progress(job)
+
+    def apply_package_job(self, job):
+        """
+        Switch all the package fields at once to the package of the result of
+        a successful job.
+        """
+        previous_sha1 = self.scorm_file_meta.get("sha1") if self.scorm_file_meta.get("shared") else None
+        self.scorm_file_meta = dict(job["meta"])
+        self.update_package_fields(job["index"])
+        self.update_package_reference(get_scorm_storage(), previous_sha1)
+
     @property
     def package_path(self):
         """
         Get file path of storage.
         """
+        if self.scorm_file_meta.get("shared"):
+            return os.path.join(self.packages_folder_path, "{}.zip".format(self.scorm_file_meta["sha1"]))
         return (
             "{loc.org}/{loc.course}/{loc.block_type}/{loc.block_id}/{sha1}{ext}"
         ).format(
@@ -242,6 +390,8 @@ class ScormXBlock(XBlock):
         This path needs to depend on the content of the scorm package. Otherwise,
         served media files might become stale when the package is update.
         """
+        if self.scorm_file_meta.get("shared"):
+            return get_package_folder(self.scorm_file_meta["sha1"], self.scorm_location())
         return os.path.join(self.extract_folder_base_path, self.scorm_file_meta["sha1"])
 
     @property
@@ -251,47 +401,184 @@ class ScormXBlock(XBlock):
         """
         return os.path.join(self.scorm_location(), self.location.block_id)
 
+    @property
+    def packages_folder_path(self):
+        """
+        Path to the folder shared by all blocks, where packages are stored and
+        extracted by content (sha1) only.
+        """
+        return os.path.join(self.scorm_location(), PACKAGES_FOLDER)
+
+    @property
+    def package_record_path(self):
+        """
+        Path to the record written once a package is completely extracted.
+        """
+        return self.extract_folder_path + ".json"
+
+    def package_reference_path(self, sha1):
+        """
+        Path to the entry of the reference index that states that this block
+        uses the package with the given sha1.
+        """
+        return os.path.join(
+            self.scorm_location(),
+            REFERENCES_FOLDER,
+            sha1,
+            "{loc.org}+{loc.course}+{loc.run}+{loc.block_id}.json".format(loc=self.location),
+        )
+
+    def update_package_reference(self, storage, previous_sha1=None):
+        """
+        Add this block to the references of its current package, and remove it
+        from the references of the package it used before.
+        """
+        reference_path = self.package_reference_path(self.scorm_file_meta["sha1"])
+        if previous_sha1 == self.scorm_file_meta["sha1"] and storage.exists(reference_path):
+            return
+        if previous_sha1:
+            previous_reference_path = self.package_reference_path(previous_sha1)
+            if storage.exists(previous_reference_path):
+                storage.delete(previous_reference_path)
+        if storage.exists(reference_path):
+            storage.delete(reference_path)
+        reference = {
+            "block_id": self.location.block_id,
+            "last_updated": self.scorm_file_meta["last_updated"],
+        }
+        storage.save(reference_path, ContentFile(json.dumps(reference).encode("utf8")))
+
     @XBlock.json_handler
+    @timed('handler.scorm_get_value')
     def scorm_get_value(self, data, suffix=''):
-        name = data.get('name')
-        if name in ['cmi.core.lesson_status', 'cmi.completion_status']:
-            return {'value': self.lesson_status}
-        elif name == 'cmi.success_status':
-            return {'value': self.success_status}
-        elif name in ['cmi.core.score.raw', 'cmi.score.raw']:
-            return {'value': self.lesson_score * 100}
-        else:
-            return {'value': self.data_scorm.get(name, '')}
+        """
+        Answer GetValue for an element of the data model, with the SCORM error
+        code of the failure, if any.
+        """
+        try:
+            return {'value': get_cmi_value(
+                self.data_scorm, data.get('name'), self.version_scorm, self.get_cmi_fields()
+            )}
+        except DataModelError as e:
+            return {'value': '', 'error_code': e.code, 'error': e.args[0]}
+
+    def get_cmi_fields(self):
+        """
+        Elements of the data model kept in fields of the block.
+        """
+        return {
+            'cmi.core.lesson_status': self.lesson_status,
+            'cmi.completion_status': self.lesson_status,
+            'cmi.success_status': self.success_status,
+            'cmi.core.score.raw': self.lesson_score * 100,
+            'cmi.score.raw': self.lesson_score * 100,
+        }
+
+    def get_cmi_data(self):
+        """
+        Snapshot of the learner's CMI data model, with the same values that
+        scorm_get_value answers, keywords included, so that the runtime API
+        can serve GetValue calls without requests to the LMS. Write only
+        elements are left out, as GetValue reports an error for them.
+        """
+        cmi_data = get_lms_values(self.data_scorm, self.version_scorm)
+        cmi_data.update(
+            (name, value) for name, value in get_cmi_values(self.data_scorm).items()
+            if is_readable(name, self.version_scorm)
+        )
+        cmi_data.update(self.get_cmi_fields())
+        return cmi_data
 
     @XBlock.json_handler
+    @timed('handler.scorm_set_value')
     def scorm_set_value(self, data, suffix=''):
         context = {'result': 'success'}
-        name = data.get('name')
 
         if not self.is_past_due():
-            if name in ['cmi.core.lesson_status', 'cmi.completion_status']:
-                self.lesson_status = data.get('value')
-                if self.has_score and data.get('value') in ['completed', 'failed', 'passed']:
-                    self.publish_grade()
-                    context.update({"lesson_score": self.lesson_score})
-
-            elif name == 'cmi.success_status':
-                self.success_status = data.get('value')
-                if self.has_score:
-                    if self.success_status == 'unknown':
-                        self.lesson_score = 0
-                    self.publish_grade()
-                    context.update({"lesson_score": self.lesson_score})
-            elif name in ['cmi.core.score.raw', 'cmi.score.raw'] and self.has_score:
-                self.lesson_score = float(data.get('value', 0))/100.0 * self.weight
-                self.publish_grade()
-                context.update({"lesson_score": self.lesson_score})
-            else:
-                self.data_scorm[name] = data.get('value', '')
+            self.set_cmi_value(data, context)
 
         context.update({"completion_status": self.get_completion_status()})
         return context
 
+    @XBlock.json_handler
+    @timed('handler.scorm_set_values')
+    def scorm_set_values(self, data, suffix=''):
+        """
+        Apply, in order, the values buffered by the runtime API since its last
+        commit, as a list of {"name": ..., "value": ...} items. The names of
+        the values that were not set are returned as "rejected", for the
+        runtime API to restore their previous values.
+        """
+        context = {'result': 'success'}
+
+        if not self.is_past_due():
+            with self.coalesced_grade_publishing():
+                for item in data.get('values', []):
+                    self.set_cmi_value(item, context)
+
+        if self.has_score:
+            context.update({"lesson_score": self.lesson_score})
+        context.update({"completion_status": self.get_completion_status()})
+        return context
+
+    def set_cmi_value(self, data, context):
+        """
+        Set a single element of the CMI data model, publishing the grade when
+        the status or score changes. Values the data model does not allow are
+        not set, and their SCORM error code is reported in the context.
+        """
+        name = data.get('name')
+        try:
+            check_value(self.data_scorm, name, to_cmi_string(data.get('value')), self.version_scorm)
+        except DataModelError as e:
+            context.update({'result': 'error', 'error': e.args[0], 'error_code': e.code})
+            context.setdefault('rejected', []).append(name)
+            return
+
+        if name in ['cmi.core.lesson_status', 'cmi.completion_status']:
+            self.lesson_status = data.get('value')
+            if self.has_score and data.get('value') in ['completed', 'failed', 'passed']:
+                self.publish_grade()
+                context.update({"lesson_score": self.lesson_score})
+
+        elif name == 'cmi.success_status':
+            self.success_status = data.get('value')
+            if self.has_score:
+                if self.success_status == 'unknown':
+                    self.lesson_score = 0
+                self.publish_grade()
+                context.update({"lesson_score": self.lesson_score})
+        elif name in ['cmi.core.score.raw', 'cmi.score.raw'] and self.has_score and data.get('value') != '':
+            self.lesson_score = float(data.get('value', 0))/100.0 * self.weight
+            self.publish_grade()
+            context.update({"lesson_score": self.lesson_score})
+        else:
+            try:
+                self.data_scorm = set_cmi_value(self.data_scorm, name, data.get('value', ''), self.version_scorm)
+            except CmiLimitError as e:
+                logger.warning('SCORM value "%s" of block %s not saved: %s', name, self.location, e)
+                context.update({
+                    'result': 'error', 'error': e.args[0], 'error_code': get_error_code('general', self.version_scorm)
+                })
+                context.setdefault('rejected', []).append(name)
+
+    @XBlock.handler
+    @timed('handler.export_progress')
+    def export_progress(self, request, suffix=''):
+        """
+        Export the progress of the learners of this block, for course staff.
+        The LMS buffers the responses of the handlers, so the export is
+        streamed by the export_scorm_progress view, which this redirects to
+        with the same `format` and `columns` parameters.
+        """
+        if not getattr(self.runtime, "user_is_staff", False):
+            return Response(status=403)
+        url = reverse('scormxblock:scorm-export-progress', kwargs={'usage_key': str(self.location)})
+        params = {name: request.params[name] for name in ("format", "columns") if name in request.params}
+        if params:
+            url += "?" + urlencode(sorted(params.items()))
+        return Response(status=302, location=url)
+
     def get_grade(self):
         lesson_score = self.lesson_score
         if self.lesson_status == "failed" or (
@@ -306,6 +593,8 @@ class ScormXBlock(XBlock):
         Utility method used to rescore a problem.
         """
         self.lesson_score = score.raw_earned / self.weight
+        # The runtime publishes the new score itself
+        self.published_grade = {}
     
     def is_past_due(self):
         """
@@ -329,13 +618,39 @@ class ScormXBlock(XBlock):
         return False
     
     def publish_grade(self):
-        self.runtime.publish(
-            self,
-            'grade',
-            {
-                'value': self.lesson_score,
-                'max_value': self.weight,
-            })
+        if self._grade_publishing_deferred:
+            if self._grade_publish_pending:
+                ScormXBlock.suppressed_grade_publishes += 1
+                increment('grade.suppressed')
+            self._grade_publish_pending = True
+            return
+        grade = {
+            'value': self.lesson_score,
+            'max_value': self.weight,
+        }
+        if grade == self.published_grade:
+            ScormXBlock.suppressed_grade_publishes += 1
+            increment('grade.suppressed')
+            return
+        with timer('grade.publish'):
+            self.runtime.publish(self, 'grade', grade)
+        self.published_grade = grade
+
+    @contextmanager
+    def coalesced_grade_publishing(self):
+        """
+        Publish a single grade, on exit, for all the publish_grade calls made
+        inside this context.
+        """
+        self._grade_publishing_deferred = True
+        self._grade_publish_pending = False
+        try:
+            yield
+        finally:
+            self._grade_publishing_deferred = False
+        if self._grade_publish_pending:
+            self._grade_publish_pending = False
+            self.publish_grade()
     
     def max_score(self):
         """
@@ -343,58 +658,28 @@ class ScormXBlock(XBlock):
         """
         return self.weight if self.has_score else None
     
-    def update_package_meta(self, package_file):
-        self.scorm_file_meta["sha1"] = self.get_sha1(package_file)
-        self.scorm_file_meta["name"] = package_file.name
-        self.scorm_file_meta["last_updated"] = timezone.now().strftime(
-            DateTime.DATETIME_FORMAT
-        )
-        self.scorm_file_meta["size"] = package_file.seek(0, 2)
-        package_file.seek(0)
-
-    def update_package_fields(self):
+    @timed('manifest.update_package_fields')
+    def update_package_fields(self, package_index=None):
         """
-        Update version and index page path fields.
+        Update version and index page path fields, and keep the package index
+        parsed from the manifest in scorm_file_meta. Without a package index,
+        the manifest is read from the extracted files in the storage.
         """
         self.path_index_page = ""
-        imsmanifest_path = os.path.join(self.extract_folder_path, "imsmanifest.xml")
-        try:
-            imsmanifest_file = get_scorm_storage().open(imsmanifest_path)
-        except IOError:
-            raise ScormError(
-                "Invalid package: could not find 'imsmanifest.xml' file at the root of the zip file"
-            )
-        else:
-            tree = ET.parse(imsmanifest_file)
-            imsmanifest_file.seek(0)
-            self.path_index_page = "index.html"
-            namespace = ""
-            for _, node in ET.iterparse(imsmanifest_file, events=["start-ns"]):
-                if node[0] == "":
-                    namespace = node[1]
-                    break
-            root = tree.getroot()
-
-            if namespace:
-                resource = root.find(
-                    "{{{0}}}resources/{{{0}}}resource".format(namespace)
+        if package_index is None:
+            imsmanifest_path = os.path.join(self.extract_folder_path, MANIFEST_PATH)
+            try:
+                imsmanifest_file = get_scorm_storage().open(imsmanifest_path)
+            except IOError:
+                raise ScormError(
+                    "Invalid package: could not find 'imsmanifest.xml' file at the root of the zip file"
                 )
-                schemaversion = root.find(
-                    "{{{0}}}metadata/{{{0}}}schemaversion".format(namespace)
-                )
-            else:
-                resource = root.find("resources/resource")
-                schemaversion = root.find("metadata/schemaversion")
-
-            if resource:
-                self.path_index_page = resource.get("href")
-            if (schemaversion is not None) and (
-                re.match("^1.2$", schemaversion.text) is None
-            ):
-                self.version_scorm = "SCORM_2004"
-            else:
-                self.version_scorm = "SCORM_12"
+            with imsmanifest_file:
+                package_index = parse_manifest(imsmanifest_file)
 
+        self.scorm_file_meta["index"] = package_index
+        self.path_index_page = package_index["launch"]
+        self.version_scorm = package_index["version"]
 
     def get_completion_status(self):
         completion_status = self.lesson_status
@@ -407,12 +692,30 @@ class ScormXBlock(XBlock):
         Unzipped files will be stored in a media folder with this name, and thus
         accessible at a url with that also includes this name.
         """
-        default_scorm_location = "scorm"
+        return get_scorm_location()
+
+    def extraction_workers(self):
+        """
+        Number of files of a package that are saved in parallel to the storage.
+        """
+        default_workers = settings.SCORM_STORAGE_CLASS.get("workers", DEFAULT_WORKERS)
+        return max(1, int(self.get_xblock_settings().get("EXTRACTION_WORKERS", default_workers)))
+
+    def extraction_retries(self):
+        """
+        Number of times a file is saved again after a transient storage error.
+        """
+        default_retries = settings.SCORM_STORAGE_CLASS.get("retries", DEFAULT_RETRIES)
+        return max(0, int(self.get_xblock_settings().get("EXTRACTION_RETRIES", default_retries)))
+
+    def get_xblock_settings(self):
+        """
+        Settings bucket of this xblock, as configured in XBLOCK_SETTINGS.
+        """
         settings_service = self.runtime.service(self, "settings")
         if not settings_service:
-            return default_scorm_location
-        xblock_settings = settings_service.get_settings_bucket(self)
-        return xblock_settings.get("LOCATION", default_scorm_location)
+            return {}
+        return settings_service.get_settings_bucket(self)
 
     def get_live_url(self):
         """
@@ -420,26 +723,13 @@ class ScormXBlock(XBlock):
         """
         if not self.scorm_file_meta:
             return ''
+        if self.scorm_file_meta.get("shared"):
+            return reverse('scormxblock:scorm-proxy-package', kwargs={'sha1': self.scorm_file_meta["sha1"], 'file': self.path_index_page})
         if self.scorm_file:
             # old files - deprecated
             return reverse('scormxblock:scorm-proxy-deprecated', kwargs={'block_id': self.location.block_id, 'file': self.path_index_page})
         return reverse('scormxblock:scorm-proxy', kwargs={'block_id': self.location.block_id, 'sha1': self.scorm_file_meta["sha1"], 'file': self.path_index_page})
     
-    @staticmethod
-    def get_sha1(file_descriptor):
-        """
-        Get file hex digest (fingerprint).
-        """
-        block_size = 8 * 1024
-        sha1 = hashlib.sha1()
-        while True:
-            block = file_descriptor.read(block_size)
-            if not block:
-                break
-            sha1.update(block)
-        file_descriptor.seek(0)
-        return sha1.hexdigest()
-    
     @staticmethod
     def workbench_scenarios():
         """A canned scenario for display in the workbench."""
@@ -450,5 +740,3 @@ class ScormXBlock(XBlock):
                 </vertical_demo>
              """),
         ]
-class ScormError(Exception):
-    pass
\ No newline at end of file
@@ -7,5 +7,45 @@ def plugin_settings(settings):
       'class': '',
       'options': {
         'location': 'scorm',
-      }
-    }
\ No newline at end of file
+      },
+      # Files of a package saved in parallel, and retries on transient errors
+      'workers': 8,
+      'retries': 2,
+      # With a FileSystemStorage, extract and serve files without the storage API
+      'local_fast_path': True,
+    }
+    settings.SCORM_DELIVERY = {
+      # 'proxy': files are streamed by Django
+      # 'x-accel-redirect': nginx serves "<internal_prefix><storage path>"
+      # 'x-sendfile': the web server serves the path of the filesystem storage
+      # 'redirect': redirect to a signed url of the object storage
+      'mode': 'proxy',
+      'internal_prefix': '/scorm-internal/',
+      # Lifetime in seconds of the signed urls
+      'expires': 60,
+      # Same-origin prefix proxied to the object storage by the web server,
+      # required by 'redirect': files are streamed by Django without it
+      'redirect_base': '',
+      # File entries of the package records cached by each process, whatever
+      # the number of packages they belong to
+      'record_cache_files': 50000,
+    }
+    settings.SCORM_COMPRESSION = {
+      # Precompressed siblings generated for text files when packages are extracted
+      'encodings': ['br', 'gzip'],
+      'min_size': 1024,
+      'max_ratio': 0.9,
+    }
+    settings.SCORM_PACKAGE_LIMITS = {
+      # Packages over these limits are rejected before anything is stored
+      'max_size': 2 * 2 ** 30,
+      'max_files': 20000,
+      # Maximum compression ratio of the members of at least ratio_min_size bytes
+      'max_ratio': 100,
+      'ratio_min_size': 2 ** 20,
+    }
+    settings.SCORM_METRICS = {
+      # 'null', 'memory', 'statsd' or the dotted path of a backend class
+      'backend': 'null',
+      'options': {},
+    }
@@ -1,5 +1,74 @@
 function ScormXBlock(runtime, element, settings) {
 
+  // Values set by the package and not sent to the LMS yet, in the order they
+  // were set. They are flushed on commit, on finish and periodically.
+  var pendingValues = [];
+  var FLUSH_INTERVAL = 15000;
+  // Values of the commit being sent. Commits are sent one at a time, so that
+  // two requests never save the learner state over each other.
+  var inFlightValues = null;
+  var inFlightRequest = null;
+  var commitQueued = false;
+  // Whether the values were flushed as the page goes away, which pagehide
+  // and beforeunload both announce
+  var unloadFlushed = false;
+  // Largest body of a keepalive request that browsers accept, roughly
+  var KEEPALIVE_MAX_SIZE = 60000;
+
+  // Learner's CMI data model, preloaded by student_view and kept up to date
+  // with the values set by the package
+  var cmiData = settings.cmi_data;
+  // Values of the elements before the package set the values not confirmed
+  // by the LMS yet, to restore them if the LMS rejects the new ones
+  var previousValues = {};
+  // Values of the write only elements set by the package, which GetValue
+  // does not answer, kept apart to know the collection items they create
+  var writeOnlyValues = {};
+  // _count of the collections before the package added items to them
+  var initialCounts = {};
+
+  // Access and checks of the elements of the data model, so that SetValue
+  // rejects the values the LMS would not set before buffering them
+  var dataModel = settings.data_model;
+  var INDEX_RE = /\.(\d+)(?=\.)/g;
+  var REAL_RE = /^[-+]?(\d+(\.\d*)?|\.\d+)$/;
+  var INTEGER_RE = /^[-+]?\d+$/;
+
+  // Error of the last API call, as reported by GetLastError
+  var lastError = "0";
+  var lastDiagnostic = "";
+  var ERROR_STRINGS = {
+    "SCORM_12": {
+      "0": "No error",
+      "101": "General exception",
+      "201": "Invalid argument error",
+      "202": "Element cannot have children",
+      "203": "Element not an array. Cannot have count",
+      "301": "Not initialized",
+      "401": "Not implemented error",
+      "402": "Invalid set value, element is a keyword",
+      "403": "Element is read only",
+      "404": "Element is write only",
+      "405": "Incorrect data type"
+    },
+    "SCORM_2004": {
+      "0": "No error",
+      "101": "General exception",
+      "301": "General get failure",
+      "351": "General set failure",
+      "391": "General commit failure",
+      "401": "Undefined data model element",
+      "402": "Unimplemented data model element",
+      "403": "Data model element value not initialized",
+      "404": "Data model element is read only",
+      "405": "Data model element is write only",
+      "406": "Data model element type mismatch",
+      "407": "Data model element value out of range",
+      "408": "Data model dependency not established"
+    }
+  };
+  var KEYWORD_RE = /\._(children|count|version)$/;
+
   function SCORM_12_API(){
 
     this.LMSInitialize = function(){
@@ -7,6 +76,7 @@ function ScormXBlock(runtime, element, settings) {
     };
 
     this.LMSFinish = function() {
+      Commit(false);
       return "true";
     };
 
@@ -14,20 +84,13 @@ function ScormXBlock(runtime, element, settings) {
     this.LMSSetValue = SetValue;
 
     this.LMSCommit = function() {
+        Commit(false);
         return "true";
     };
 
-    this.LMSGetLastError = function() {
-      return "0";
-    };
-
-    this.LMSGetErrorString = function(errorCode) {
-      return "Some Error";
-    };
-
-    this.LMSGetDiagnostic = function(errorCode) {
-      return "Some Diagnostice";
-    }
+    this.LMSGetLastError = GetLastError;
+    this.LMSGetErrorString = GetErrorString;
+    this.LMSGetDiagnostic = GetDiagnostic;
   }
 
   function SCORM_2004_API(){
@@ -36,6 +99,7 @@ function ScormXBlock(runtime, element, settings) {
     };
 
     this.Terminate = function() {
+      Commit(false);
       return "true";
     };
 
@@ -43,23 +107,214 @@ function ScormXBlock(runtime, element, settings) {
     this.SetValue = SetValue;
 
     this.Commit = function() {
+        Commit(false);
         return "true";
     };
 
-    this.GetLastError = function() {
-      return "0";
-    };
+    this.GetLastError = GetLastError;
+    this.GetErrorString = GetErrorString;
+    this.GetDiagnostic = GetDiagnostic;
+  }
 
-    this.GetErrorString = function(errorCode) {
-      return "Some Error";
-    };
+  var findPendingValue = function (cmi_element) {
+    for (var i = 0; i < pendingValues.length; i++) {
+      if (pendingValues[i].name === cmi_element) {
+        return i;
+      }
+    }
+    return -1;
+  };
+
+  var GetLastError = function () {
+    return lastError;
+  };
+
+  var GetErrorString = function (errorCode) {
+    var strings = ERROR_STRINGS[settings.version_scorm] || ERROR_STRINGS["SCORM_12"];
+    return strings[errorCode] || "";
+  };
+
+  var GetDiagnostic = function (errorCode) {
+    return lastDiagnostic;
+  };
+
+  var setError = function (errorCode, diagnostic) {
+    lastError = errorCode || "0";
+    lastDiagnostic = diagnostic || "";
+  };
 
-    this.GetDiagnostic = function(errorCode) {
-      return "Some Diagnostice";
+  // Keep the _count of the collections up to date with the items the
+  // package adds, e.g. cmi.interactions._count after cmi.interactions.3.id
+  var updateCounts = function (cmi_element) {
+    var indexRe = /\.(\d+)\./g;
+    var match;
+    while ((match = indexRe.exec(cmi_element)) !== null) {
+      var count = cmi_element.slice(0, match.index) + "._count";
+      var index = parseInt(match[1], 10);
+      if (!(count in cmiData) || parseInt(cmiData[count], 10) <= index) {
+        if (!(count in initialCounts)) {
+          initialCounts[count] = cmiData[count];
+        }
+        cmiData[count] = String(index + 1);
+      }
+      indexRe.lastIndex = match.index + match[0].length - 1;
     }
-  }
+  };
+
+  // Kind of error of a value for the spec of the check of its element, or
+  // null if it is valid
+  var checkSpec = function (spec, value) {
+    if (spec.vocabulary) {
+      return spec.vocabulary.indexOf(value) !== -1 ? null : "type_mismatch";
+    }
+    if (spec.pattern) {
+      spec.regex = spec.regex || new RegExp(spec.pattern);
+      return spec.regex.test(value) ? null : "type_mismatch";
+    }
+    if (spec.real || spec.integer) {
+      if (spec.blank && value === "") {
+        return null;
+      }
+      if (!(spec.real ? REAL_RE : INTEGER_RE).test(value)) {
+        return "type_mismatch";
+      }
+      var range = spec.real || spec.integer;
+      var number = parseFloat(value);
+      if ((range[0] !== null && number < range[0]) || (range[1] !== null && number > range[1])) {
+        return "out_of_range";
+      }
+      return null;
+    }
+    if (spec.any_of) {
+      var error = null;
+      for (var i = 0; i < spec.any_of.length; i++) {
+        error = checkSpec(spec.any_of[i], value);
+        if (error === null) {
+          return null;
+        }
+      }
+      return error;
+    }
+    return null;
+  };
+
+  // [access, spec of the check] of an element, undefined if there is none
+  var getDefinition = function (cmi_element) {
+    if (cmi_element.indexOf(".n.") !== -1) {
+      return undefined;
+    }
+    return dataModel.elements[cmi_element.replace(INDEX_RE, ".n")];
+  };
+
+  var isWriteOnly = function (cmi_element) {
+    var definition = getDefinition(cmi_element);
+    return typeof definition != "undefined" && definition[0] === "w";
+  };
+
+  var getStore = function (cmi_element) {
+    return isWriteOnly(cmi_element) ? writeOnlyValues : cmiData;
+  };
+
+  // [kind of error, diagnostic] of SetValue(cmi_element, value), as
+  // check_value of the datamodel module tells, or null if it is allowed
+  var checkValue = function (cmi_element, value) {
+    if (!cmi_element) {
+      return ["general", "SetValue needs an element"];
+    }
+    if (KEYWORD_RE.test(cmi_element)) {
+      return ["keyword", cmi_element + " is a keyword of the data model"];
+    }
+    var definition = getDefinition(cmi_element);
+    if (typeof definition == "undefined") {
+      return ["undefined", cmi_element + " is not an element of the data model"];
+    }
+    if (definition[0] === "r") {
+      return ["read_only", cmi_element + " is read only"];
+    }
+    if (typeof cmiData != "undefined") {
+      var match;
+      INDEX_RE.lastIndex = 0;
+      while ((match = INDEX_RE.exec(cmi_element)) !== null) {
+        var collection = cmi_element.slice(0, match.index);
+        var index = parseInt(match[1], 10);
+        var count = parseInt(cmiData[collection + "._count"] || "0", 10);
+        var subElement = cmi_element.slice(match.index + match[0].length + 1);
+        if (index > count) {
+          return ["invalid_index", cmi_element + " is not the next item of " + collection];
+        }
+        if (index === count && settings.version_scorm === "SCORM_2004" && subElement !== "id" &&
+            dataModel.identified.indexOf(collection.replace(INDEX_RE, ".n")) !== -1) {
+          return ["dependency", collection + "." + index + ".id must be set first"];
+        }
+      }
+    }
+    var kind = definition[1] ? checkSpec(definition[1], String(value)) : null;
+    if (kind !== null) {
+      return [kind, '"' + value + '" is not a valid value of ' + cmi_element];
+    }
+    return null;
+  };
+
+  // Restore the value of an element the LMS rejected, and the _count of the
+  // collections that only have an item because of it
+  var restoreValue = function (cmi_element) {
+    var store = getStore(cmi_element);
+    if (previousValues[cmi_element] === undefined) {
+      delete store[cmi_element];
+    } else {
+      store[cmi_element] = previousValues[cmi_element];
+    }
+    delete previousValues[cmi_element];
+
+    var matches = [];
+    var match;
+    INDEX_RE.lastIndex = 0;
+    while ((match = INDEX_RE.exec(cmi_element)) !== null) {
+      matches.unshift(match);
+    }
+    // Innermost collections first, as their _count is no item of the outer ones
+    matches.forEach(function (match) {
+      var collection = cmi_element.slice(0, match.index);
+      var index = parseInt(match[1], 10);
+      var count = collection + "._count";
+      // Items of the LMS are not known here, only those the package added
+      if (parseInt(cmiData[count], 10) !== index + 1 || !(count in initialCounts) ||
+          parseInt(initialCounts[count] || "0", 10) > index) {
+        return;
+      }
+      var prefix = collection + "." + index + ".";
+      var hasItem = function (store) {
+        for (var name in store) {
+          if (name.indexOf(prefix) === 0 && !KEYWORD_RE.test(name)) {
+            return true;
+          }
+        }
+        return false;
+      };
+      if (!hasItem(cmiData) && !hasItem(writeOnlyValues)) {
+        cmiData[count] = String(index);
+      }
+    });
+  };
 
   var GetValue = function (cmi_element) {
+    if (isWriteOnly(cmi_element)) {
+      setError(dataModel.errors.write_only, cmi_element + " is write only");
+      return "";
+    }
+    if (typeof cmiData != "undefined") {
+      if (cmi_element in cmiData) {
+        setError("0");
+        return cmiData[cmi_element];
+      }
+    } else {
+      var pending = findPendingValue(cmi_element);
+      if (pending !== -1) {
+        setError("0");
+        return pendingValues[pending].value;
+      }
+    }
+
     var handlerUrl = runtime.handlerUrl(element, 'scorm_get_value');
 
     var response = $.ajax({
@@ -69,30 +324,145 @@ function ScormXBlock(runtime, element, settings) {
       async: false
     });
     response = JSON.parse(response.responseText);
+    setError(response.error_code, response.error);
+    if (typeof cmiData != "undefined" && lastError === "0") {
+      cmiData[cmi_element] = response.value;
+    }
     return response.value
   };
 
   var SetValue = function (cmi_element, value) {
+    var error = checkValue(cmi_element, value);
+    if (error !== null) {
+      setError(dataModel.errors[error[0]], error[1]);
+      return "false";
+    }
+    setError("0");
     if (cmi_element === 'cmi.core.exit' || cmi_element === 'cmi.exit') {
       $(".js-scorm-block", element).removeClass('full-screen-scorm');
     }
 
-    var handlerUrl = runtime.handlerUrl( element, 'scorm_set_value');
+    // Only the last value of an element is sent, after the ones set before it
+    var pending = findPendingValue(cmi_element);
+    if (pending !== -1) {
+      pendingValues.splice(pending, 1);
+    }
+    pendingValues.push({'name': cmi_element, 'value': value});
+    if (typeof cmiData != "undefined") {
+      var store = getStore(cmi_element);
+      if (!(cmi_element in previousValues)) {
+        previousValues[cmi_element] = store[cmi_element];
+      }
+      store[cmi_element] = value;
+      updateCounts(cmi_element);
+    }
+
+    return "true";
+  };
+
+  var Commit = function (async) {
+    if (inFlightValues !== null) {
+      // Sent once the commit in flight completes
+      commitQueued = true;
+      return;
+    }
+    if (pendingValues.length === 0) {
+      return;
+    }
+    var values = pendingValues;
+    pendingValues = [];
+    inFlightValues = values;
+
+    var handlerUrl = runtime.handlerUrl(element, 'scorm_set_values');
 
     $.ajax({
       type: "POST",
       url: handlerUrl,
-      data: JSON.stringify({'name': cmi_element, 'value': value}),
-      async: false,
+      data: JSON.stringify({'values': values}),
+      async: async,
+      beforeSend: function(xhr){
+        inFlightRequest = xhr;
+      },
       success: function(response){
+        if (typeof response.error_code != "undefined") {
+          setError(response.error_code, response.error);
+        }
+        if (typeof cmiData != "undefined") {
+          var rejected = response.rejected || [];
+          values.forEach(function(value) {
+            var setAgain = findPendingValue(value.name) !== -1;
+            if (rejected.indexOf(value.name) === -1) {
+              // Confirmed: the value to restore if a later one is rejected
+              if (setAgain) {
+                previousValues[value.name] = value.value;
+              } else {
+                delete previousValues[value.name];
+              }
+            } else if (!setAgain && value.name in previousValues) {
+              restoreValue(value.name);
+            }
+          });
+        }
         if (typeof response.lesson_score != "undefined"){
           $(".lesson_score", element).html(response.lesson_score);
         }
         $(".completion_status", element).html(response.completion_status);
+      },
+      error: function(){
+        // Keep the values that were not set again meanwhile for the next commit
+        var failed = values.filter(function(value) {
+          return findPendingValue(value.name) === -1;
+        });
+        pendingValues = failed.concat(pendingValues);
+      },
+      complete: function(){
+        inFlightValues = null;
+        inFlightRequest = null;
+        if (commitQueued) {
+          commitQueued = false;
+          Commit(true);
+        }
       }
     });
+  };
 
-    return "true";
+  var getCsrfToken = function () {
+    var match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+    return match ? decodeURIComponent(match[1]) : "";
+  };
+
+  // Send the buffered values as the page goes away. Browsers drop the
+  // synchronous requests made during page dismissal, but finish keepalive
+  // ones. A commit still in flight is abandoned, and its values are sent
+  // along with the pending ones, in a single request, so that no older value
+  // can be saved after a newer one.
+  var flushOnUnload = function () {
+    if (unloadFlushed) {
+      return;
+    }
+    unloadFlushed = true;
+    if (inFlightRequest !== null) {
+      // Its error callback puts back the values not set again meanwhile
+      // before the pending ones
+      commitQueued = false;
+      inFlightRequest.abort();
+    }
+    if (pendingValues.length === 0) {
+      return;
+    }
+    var body = JSON.stringify({'values': pendingValues});
+    if (typeof fetch == "undefined" || new Blob([body]).size > KEEPALIVE_MAX_SIZE) {
+      Commit(false);
+      return;
+    }
+    pendingValues = [];
+    fetch(runtime.handlerUrl(element, 'scorm_set_values'), {
+      method: "POST",
+      keepalive: true,
+      credentials: "same-origin",
+      headers: {"Content-Type": "application/json", "X-CSRFToken": getCsrfToken()},
+      body: body
+    });
   };
 
   $(function ($) {
@@ -102,6 +472,15 @@ function ScormXBlock(runtime, element, settings) {
       API_1484_11 = new SCORM_2004_API();
     }
 
+    setInterval(function() {
+      Commit(true);
+    }, FLUSH_INTERVAL);
+    $(window).on('pagehide beforeunload', flushOnUnload);
+    $(window).on('pageshow', function() {
+      // Back from the back-forward cache
+      unloadFlushed = false;
+    });
+
     var $scormBlock = $(".js-scorm-block", element);
     $('.js-button-full-screen', element).on( "click", function() {
       $scormBlock.toggleClass("full-screen-scorm");
@@ -1,6 +1,136 @@
-function ScormStudioXBlock(runtime, element) {
+function ScormStudioXBlock(runtime, element, settings) {
 
   var handlerUrl = runtime.handlerUrl(element, 'studio_submit');
+  var statusUrl = runtime.handlerUrl(element, 'package_status');
+  var chunkUrl = runtime.handlerUrl(element, 'upload_chunk');
+  // Milliseconds between two polls of the package processing job
+  var POLL_INTERVAL = 1000;
+  var CHUNK_SIZE = (settings && settings.chunk_size) || 5 * 1024 * 1024;
+  // Attempts to send a chunk before giving up, the upload can then be resumed by saving again
+  var CHUNK_RETRIES = 5;
+
+  function notifyErrors(errors) {
+      errors.forEach(function(error) {
+          runtime.notify("error", {
+              "message": error,
+              "title": "Scorm component save error"
+          });
+      });
+  }
+
+  function showProgress(job) {
+      var message;
+      if (job.status === 'done') {
+          message = 'Paquete procesado';
+      } else if (job.status === 'failed') {
+          message = 'Error al procesar el paquete';
+      } else if (job.files_total > 0) {
+          message = 'Extrayendo archivos: ' + job.files_extracted + ' de ' + job.files_total;
+      } else if (job.bytes_total > 0) {
+          message = 'Verificando paquete: ' + Math.floor(100 * job.bytes_hashed / job.bytes_total) + '%';
+      } else {
+          message = 'Procesando paquete';
+      }
+      $(element).find('.scorm-package-status').text(message).show();
+  }
+
+  // Poll the processing job of an uploaded package until it ends
+  function pollPackageJob(jobId, onEnd) {
+      $.ajax({
+          url: statusUrl,
+          type: "POST",
+          data: JSON.stringify({'job_id': jobId}),
+          success: function(job) {
+              showProgress(job);
+              if (job.status === 'done' || job.status === 'failed') {
+                  onEnd(job);
+              } else {
+                  setTimeout(function() { pollPackageJob(jobId, onEnd); }, POLL_INTERVAL);
+              }
+          },
+          error: function() {
+              setTimeout(function() { pollPackageJob(jobId, onEnd); }, POLL_INTERVAL);
+          }
+      });
+  }
+
+  // Key of the upload of a file in the local storage, to resume it after a failure
+  function uploadKey(file) {
+      return 'scormxblock-upload:' + chunkUrl + ':' + file.name + ':' + file.size + ':' + file.lastModified;
+  }
+
+  // Send the file in chunks, resuming a previous upload of the same file if any
+  function uploadPackage(file, onEnd) {
+      var key = uploadKey(file);
+      var uploadId = window.localStorage.getItem(key) || '';
+      var failures = 0;
+
+      function sendChunk(offset) {
+          var form_data = new FormData();
+          form_data.append('upload_id', uploadId);
+          form_data.append('name', file.name);
+          form_data.append('size', file.size);
+          if (offset !== null) {
+              form_data.append('offset', offset);
+              form_data.append('chunk', file.slice(offset, offset + CHUNK_SIZE), file.name);
+          }
+          $.ajax({
+              url: chunkUrl,
+              dataType: 'json',
+              cache: false,
+              contentType: false,
+              processData: false,
+              data: form_data,
+              type: "POST",
+              success: function(response) {
+                  if (response.result !== 'success') {
+                      window.localStorage.removeItem(key);
+                      onEnd(response);
+                      return;
+                  }
+                  failures = 0;
+                  uploadId = response.upload_id;
+                  if (response.job_id) {
+                      window.localStorage.removeItem(key);
+                      if (response.status === 'done' || response.status === 'failed') {
+                          onEnd(response);
+                      } else {
+                          showProgress(response);
+                          pollPackageJob(response.job_id, onEnd);
+                      }
+                      return;
+                  }
+                  window.localStorage.setItem(key, uploadId);
+                  $(element).find('.scorm-package-status').text(
+                      'Subiendo paquete: ' + Math.floor(100 * response.offset / file.size) + '%'
+                  ).show();
+                  sendChunk(response.offset);
+              },
+              error: function() {
+                  failures += 1;
+                  if (failures > CHUNK_RETRIES) {
+                      onEnd({'errors': ['La subida del paquete se interrumpió, guarde nuevamente para continuarla']});
+                      return;
+                  }
+                  // Ask for the offset received by the server, then resume from there
+                  setTimeout(function() { sendChunk(uploadId ? null : 0); }, POLL_INTERVAL * failures);
+              }
+          });
+      }
+
+      // An upload to resume first asks for its offset
+      sendChunk(uploadId ? null : 0);
+  }
+
+  function saveEnded(response) {
+      if (response.errors.length > 0) {
+          notifyErrors(response.errors);
+      } else {
+          runtime.notify('save', {
+              state: 'end'
+          });
+      }
+  }
 
   $(element).find('.save-button').bind('click', function() {
       var form_data = new FormData();
@@ -11,7 +141,6 @@ function ScormStudioXBlock(runtime, element) {
       var width = $(element).find('input[name=width]').val();
       var height = $(element).find('input[name=height]').val();
 
-      form_data.append('file', file_data);
       form_data.append('display_name', display_name);
       form_data.append('has_score', has_score);
       form_data.append('weight', weight);
@@ -30,17 +159,10 @@ function ScormStudioXBlock(runtime, element) {
           data: form_data,
           type: "POST",
           success: function(response) {
-              if (response.errors.length > 0) {
-                  response.errors.forEach(function(error) {
-                      runtime.notify("error", {
-                          "message": error,
-                          "title": "Scorm component save error"
-                      });
-                  });
+              if (response.errors.length > 0 || !file_data) {
+                  saveEnded(response);
               } else {
-                  runtime.notify('save', {
-                      state: 'end'
-                  });
+                  uploadPackage(file_data, saveEnded);
               }
           }
       });
@@ -61,6 +183,15 @@ function ScormStudioXBlock(runtime, element) {
         show_or_hide_warning();
     });
     show_or_hide_warning(); // on init
+
+    // Keep reporting the progress of a package uploaded before the editor was opened
+    if (settings && settings.package_job) {
+        pollPackageJob(settings.package_job, function(job) {
+            if (job.errors.length > 0) {
+                notifyErrors(job.errors);
+            }
+        });
+    }
   });
 
 }
\ No newline at end of file
@@ -0,0 +1,11 @@
+"""
+Celery tasks of the SCORM xblock, used when SCORM_PROCESSING['executor'] is 'celery'.
+"""
+from celery import shared_task
+
+from .jobs import process_package
+
+
+@shared_task(name='scormxblock.tasks.process_package')
+def process_package_task(job_id, options):
+    process_package(job_id, options)
@@ -1,14 +1,97 @@
 # -*- coding: utf-8 -*-
+import base64
+import csv
+import gzip
+import hashlib
+import io
 import json
+import os
+import shutil
+import socket
+import tempfile
+import tracemalloc
 import unittest
+import warnings
+import zipfile
+from datetime import datetime, timedelta
 
 
-from ddt import ddt, data
+from ddt import ddt, data, unpack
 from freezegun import freeze_time
 import mock
+import pytz
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import FileResponse, Http404
+from django.test import RequestFactory, override_settings
+from webob.multidict import MultiDict
 from xblock.field_data import DictFieldData
 
-from .scormxblock import ScormXBlock
+from .cleanup import collect_garbage, get_markers, get_referenced_packages
+from .cmi import CmiLimitError, get_count, get_values, set_value
+from .datamodel import CHILDREN, DataModelError, check_value, get_runtime_data_model, get_value
+from .export import MemorySource, export_progress
+from .extraction import DEFAULT_COMPRESSION, DEFAULT_LIMITS, PackageLimitError, check_package_limits, extract_package
+from . import uploads
+from .jobs import get_job_cache, get_job_cache_key, process_package, save_job
+from .manifest import parse_manifest, read_package_index, validate_package
+from .metrics import MemoryMetrics, NullMetrics, get_metrics, increment, timer
+from .scormxblock import ScormXBlock, load_template
+from .utils import (
+    ScormError,
+    copy_and_hash,
+    get_scorm_storage,
+    get_storage_backends_count,
+    reset_scorm_storage,
+)
+from .views import clear_package_records, export_scorm_progress, get_etag, get_package_record, proxy_scorm_media
+
+
+SCORM_12_MANIFEST = b"""<?xml version="1.0" encoding="UTF-8"?>
+<manifest identifier="MANIFEST-1" version="1.0"
+    xmlns="http://www.imsproject.org/xsd/imscp_rootv1p1p2"
+    xmlns:adlcp="http://www.adlnet.org/xsd/adlcp_rootv1p2">
+  <metadata>
+    <schema>ADL SCORM</schema>
+    <schemaversion>1.2</schemaversion>
+  </metadata>
+  <organizations default="ORG-2">
+    <organization identifier="ORG-1">
+      <title>Unused</title>
+      <item identifier="ITEM-1" identifierref="RES-ASSETS"><title>Assets</title></item>
+    </organization>
+    <organization identifier="ORG-2">
+      <title>Course</title>
+      <item identifier="ITEM-2">
+        <title>Module</title>
+        <item identifier="ITEM-3" identifierref="RES-SCO" parameters="?page=1"><title>Lesson</title></item>
+      </item>
+    </organization>
+  </organizations>
+  <resources xml:base="content/">
+    <resource identifier="RES-ASSETS" type="webcontent" adlcp:scormtype="asset" href="assets.html">
+      <file href="assets.html"/>
+    </resource>
+    <resource identifier="RES-SCO" type="webcontent" adlcp:scormtype="sco" href="index.html">
+      <file href="index.html"/>
+      <file href="app.js"/>
+      <dependency identifierref="RES-ASSETS"/>
+    </resource>
+  </resources>
+</manifest>
+"""
+
+
+def make_package(files):
+    """
+    Build an in-memory zip archive from a {path: content} dict.
+    """
+    package = io.BytesIO()
+    with zipfile.ZipFile(package, "w", zipfile.ZIP_DEFLATED) as package_zipfile:
+        for path, content in files.items():
+            package_zipfile.writestr(path, content)
+    return package.getvalue()
 
 
 @ddt
@@ -21,10 +104,18 @@ class ScormXBlockTests(unittest.TestCase):
         field_data = DictFieldData(kw)
         block = ScormXBlock(mock.Mock(), field_data, mock.Mock())
         block.location = mock.Mock(
-            block_id="block_id", org="org", course="course", block_type="block_type"
+            block_id="block_id", org="org", course="course", run="run", block_type="block_type"
         )
         return block
 
+    def make_storage_dir(self):
+        """
+        Creates a temporary directory, removed after the test, to back a storage.
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        return path
+
     def test_fields_xblock(self):
         block = self.make_one()
         self.assertEqual(block.display_name, "Scorm")
@@ -34,6 +125,7 @@ class ScormXBlockTests(unittest.TestCase):
         self.assertEqual(block.success_status, "unknown")
         self.assertEqual(block.data_scorm, {})
         self.assertEqual(block.lesson_score, 0)
+        self.assertEqual(block.published_grade, {})
         self.assertEqual(block.weight, 1)
         self.assertEqual(block.has_score, True)
         self.assertEqual(block.icon_class, "video")
@@ -59,59 +151,429 @@ class ScormXBlockTests(unittest.TestCase):
         self.assertEqual(block.width, 800)
         self.assertEqual(block.height, 450)
 
-
-    @freeze_time("2018-05-01")
-    @mock.patch("scormxblock.ScormXBlock.update_package_fields")
-    @mock.patch("scormxblock.scormxblock.os")
-    @mock.patch("scormxblock.scormxblock.zipfile")
-    @mock.patch("scormxblock.scormxblock.File", return_value="call_file")
-    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
-    @mock.patch(
-        "scormxblock.ScormXBlock.package_path", return_value="package_path"
-    )
-    @mock.patch("scormxblock.ScormXBlock.get_sha1", return_value="sha1")
-    def test_save_scorm_zipfile(
-        self,
-        get_sha1,
-        package_path,
-        default_storage,
-        mock_file,
-        zipfile,
-        mock_os,
-        update_package_fields,
-    ):
+    def test_save_settings_without_file_field(self):
         block = self.make_one()
-        mock_file_object = mock.Mock()
-        mock_file_object.configure_mock(name="scorm_file_name")
-        default_storage.configure_mock(size=mock.Mock(return_value="1234"))
-        mock_os.configure_mock(path=mock.Mock(join=mock.Mock(return_value="path_join")))
+        params = MultiDict({"display_name": "Test Block", "has_score": "False", "width": "", "height": "450", "weight": "1"})
+
+        response = block.studio_submit(mock.Mock(method="POST", params=params))
+
+        self.assertEqual(json.loads(response.body.decode("utf8")), {"result": "success", "errors": []})
+        self.assertEqual(block.display_name, "Test Block")
+        self.assertEqual(block.icon_class, "video")
+        self.assertIsNone(block.package_job)
 
+    @staticmethod
+    def submit_package(block, package_data, name="scorm_file_name.zip"):
+        """
+        Uploads a package to the block through the studio_submit handler.
+        """
         fields = {
             "display_name": "Test Block",
             "has_score": "True",
-            "file": mock.Mock(file=mock_file_object),
+            "file": mock.Mock(file=SimpleUploadedFile(name, package_data, "application/zip")),
             "width": None,
             "height": 450,
             "weight": 3.0,
         }
+        return block.studio_submit(mock.Mock(method="POST", params=fields))
 
-        block.studio_submit(mock.Mock(method="POST", params=fields))
+    @freeze_time("2018-05-01")
+    @override_settings(SCORM_PROCESSING={"executor": "sync"})
+    @mock.patch("scormxblock.jobs.hash_file")
+    @mock.patch("scormxblock.ScormXBlock.update_package_fields")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_save_scorm_zipfile(self, get_scorm_storage, jobs_get_scorm_storage, update_package_fields, hash_file):
+        block = self.make_one()
+        block.runtime.service.return_value = None
+        package_data = make_package({"imsmanifest.xml": b"<manifest/>", "index.html": b"<html></html>"})
+        storage = FileSystemStorage(location=self.make_storage_dir())
+        get_scorm_storage.return_value = jobs_get_scorm_storage.return_value = storage
 
-        get_sha1.assert_called_once_with(mock_file_object)
-        default_storage().save.assert_called_once_with(package_path, "call_file")
-        mock_file.assert_called_once_with(mock_file_object)
+        response = self.submit_package(block, package_data)
 
+        sha1 = hashlib.sha1(package_data).hexdigest()
         expected_scorm_file_meta = {
-            "sha1": "sha1",
-            "name": "scorm_file_name",
+            "sha1": sha1,
+            "name": "scorm_file_name.zip",
             "last_updated": "2018-05-01T00:00:00.000000",
-            "size": block.scorm_file_meta['size'], # can't patch seek() function
+            "size": len(package_data),
+            "shared": True,
         }
 
+        self.assertEqual(json.loads(response.body.decode("utf8"))["status"], "done")
+        self.assertIsNone(block.package_job)
         self.assertEqual(block.scorm_file_meta, expected_scorm_file_meta)
+        # The upload is hashed while it is copied, not read again by the job
+        hash_file.assert_not_called()
+        self.assertEqual(block.package_path, "scorm/packages/{}.zip".format(sha1))
+        self.assertEqual(block.extract_folder_path, "scorm/packages/{}".format(sha1))
+        with storage.open(block.package_path) as stored_package:
+            self.assertEqual(stored_package.read(), package_data)
+        with storage.open(os.path.join(block.extract_folder_path, "index.html")) as index_file:
+            self.assertEqual(index_file.read(), b"<html></html>")
+        self.assertTrue(storage.exists(block.package_record_path))
+        self.assertEqual(
+            storage.listdir("scorm/refs/{}".format(sha1)), ([], ["org+course+run+block_id.json"])
+        )
+        update_package_fields.assert_called_once_with(mock.ANY)
+        self.assertEqual(update_package_fields.call_args[0][0]["launch"], "index.html")
+
+    @override_settings(SCORM_PROCESSING={"executor": "sync"})
+    @mock.patch("scormxblock.ScormXBlock.update_package_fields")
+    @mock.patch("scormxblock.jobs.extract_package")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_save_shared_scorm_zipfile(
+            self, get_scorm_storage, jobs_get_scorm_storage, extract_package, update_package_fields
+    ):
+        extract_package.return_value = {}
+        storage = FileSystemStorage(location=self.make_storage_dir())
+        get_scorm_storage.return_value = jobs_get_scorm_storage.return_value = storage
+        package_data = make_package({"imsmanifest.xml": b"<manifest/>", "index.html": b"index"})
+        sha1 = hashlib.sha1(package_data).hexdigest()
+        storage.save("scorm/packages/{}.json".format(sha1), io.BytesIO(b"{}"))
+        storage.save("scorm/gc/{}.json".format(sha1), io.BytesIO(b"{}"))
+        block = self.make_one()
+        block.runtime.service.return_value = None
+
+        self.submit_package(block, package_data)
+
+        extract_package.assert_not_called()
+        self.assertFalse(storage.exists("scorm/gc/{}.json".format(sha1)))
+        self.assertFalse(storage.exists(block.package_path))
+        self.assertTrue(storage.exists("scorm/refs/{}/org+course+run+block_id.json".format(sha1)))
+
+        other_package_data = make_package({"imsmanifest.xml": b"<manifest></manifest>", "index.html": b"index"})
+        self.submit_package(block, other_package_data)
+
+        self.assertFalse(storage.exists("scorm/refs/{}/org+course+run+block_id.json".format(sha1)))
+        self.assertEqual(extract_package.call_count, 1)
+
+    @override_settings(SCORM_PROCESSING={"executor": "sync"})
+    @mock.patch("scormxblock.jobs.validate_package", wraps=validate_package)
+    @mock.patch("scormxblock.ScormXBlock.update_package_fields")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_manifest_is_parsed_once(
+            self, get_scorm_storage, jobs_get_scorm_storage, update_package_fields, jobs_validate_package
+    ):
+        get_scorm_storage.return_value = jobs_get_scorm_storage.return_value = FileSystemStorage(
+            location=self.make_storage_dir()
+        )
+        block = self.make_one()
+        block.runtime.service.return_value = None
+        package_data = make_package({"imsmanifest.xml": SCORM_12_MANIFEST, "content/index.html": b""})
+
+        response = json.loads(self.submit_package(block, package_data).body.decode("utf8"))
+
+        self.assertEqual(response["status"], "done")
+        jobs_validate_package.assert_called_once()
+        self.assertEqual(update_package_fields.call_args[0][0]["launch"], "content/index.html")
+
+    @override_settings(SCORM_PROCESSING={"executor": "sync"})
+    @mock.patch("scormxblock.ScormXBlock.update_package_fields")
+    @mock.patch("scormxblock.jobs.extract_package")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_shared_package_deleted_during_upload_is_extracted_again(
+            self, get_scorm_storage, jobs_get_scorm_storage, extract_package, update_package_fields
+    ):
+        extract_package.return_value = {}
+        storage = FileSystemStorage(location=self.make_storage_dir())
+        get_scorm_storage.return_value = jobs_get_scorm_storage.return_value = storage
+        package_data = make_package({"imsmanifest.xml": b"<manifest/>", "index.html": b"index"})
+        sha1 = hashlib.sha1(package_data).hexdigest()
+        record_path = "scorm/packages/{}.json".format(sha1)
+        storage.save(record_path, io.BytesIO(b"{}"))
+        storage.save("scorm/gc/{}.json".format(sha1), io.BytesIO(b"{}"))
+        block = self.make_one()
+        block.runtime.service.return_value = None
+        delete = storage.delete
+
+        def delete_marker(path):
+            # A garbage collection run deletes the record meanwhile
+            delete(path)
+            if path.startswith("scorm/gc/") and storage.exists(record_path):
+                delete(record_path)
+
+        with mock.patch.object(storage, "delete", side_effect=delete_marker):
+            response = json.loads(self.submit_package(block, package_data).body.decode("utf8"))
+
+        self.assertEqual(response["status"], "done")
+        extract_package.assert_called_once()
+        self.assertTrue(storage.exists(record_path))
+
+    @mock.patch("scormxblock.jobs.submit_job")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_save_scorm_zipfile_in_background(self, get_scorm_storage, jobs_get_scorm_storage, submit_job):
+        storage = FileSystemStorage(location=self.make_storage_dir())
+        get_scorm_storage.return_value = jobs_get_scorm_storage.return_value = storage
+        block = self.make_one(scorm_file_meta={"sha1": "a" * 40, "name": "old.zip", "shared": True})
+        block.runtime.service.return_value = None
+        package_data = make_package({"imsmanifest.xml": SCORM_12_MANIFEST, "content/index.html": b""})
+
+        response = json.loads(self.submit_package(block, package_data).body.decode("utf8"))
+
+        job_id, options = submit_job.call_args[0][:2]
+        self.assertEqual(response["job_id"], job_id)
+        self.assertEqual(response["status"], "pending")
+        self.assertEqual(response["bytes_total"], len(package_data))
+        self.assertEqual(block.package_job, job_id)
+        self.assertEqual(block.scorm_file_meta["sha1"], "a" * 40)
+
+        process_package(job_id, options)
+
+        # The cache only holds the progress, the package is in the result
+        cached_job = get_job_cache().get(get_job_cache_key(job_id))
+        self.assertEqual(cached_job["status"], "done")
+        self.assertNotIn("index", cached_job)
+        self.assertNotIn("meta", cached_job)
+        self.assertFalse(os.path.exists(options["source"]))
+        status = block.package_status(mock.Mock(method="POST", body=json.dumps({"job_id": job_id}).encode("utf8")))
+        status = json.loads(status.body.decode("utf8"))
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["bytes_hashed"], len(package_data))
+        self.assertEqual(status["files_extracted"], 2)
+        self.assertEqual(status["files_total"], 2)
+        self.assertIsNone(block.package_job)
+        self.assertEqual(block.scorm_file_meta["sha1"], hashlib.sha1(package_data).hexdigest())
+        self.assertEqual(block.path_index_page, "content/index.html")
+
+    @mock.patch("scormxblock.jobs.submit_job")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_expired_package_job_is_applied(self, get_scorm_storage, jobs_get_scorm_storage, submit_job):
+        storage = FileSystemStorage(location=self.make_storage_dir())
+        get_scorm_storage.return_value = jobs_get_scorm_storage.return_value = storage
+        block = self.make_one()
+        block.runtime.service.return_value = None
+        package_data = make_package({"imsmanifest.xml": SCORM_12_MANIFEST, "content/index.html": b""})
+        self.submit_package(block, package_data)
+        job_id, options = submit_job.call_args[0][:2]
+        process_package(job_id, options)
+
+        get_job_cache().delete(get_job_cache_key(job_id))
+        self.assertTrue(storage.exists("scorm/jobs/{}.json".format(job_id)))
+        status = block.package_status(mock.Mock(method="POST", body=json.dumps({}).encode("utf8")))
+
+        self.assertEqual(json.loads(status.body.decode("utf8"))["status"], "done")
+        self.assertIsNone(block.package_job)
+        self.assertEqual(block.scorm_file_meta["sha1"], hashlib.sha1(package_data).hexdigest())
+        self.assertEqual(block.path_index_page, "content/index.html")
+        self.assertFalse(storage.exists("scorm/jobs/{}.json".format(job_id)))
+
+    @mock.patch("scormxblock.scormxblock.read_job_result", return_value=None)
+    @mock.patch("scormxblock.ScormXBlock.apply_package_job")
+    def test_package_job_without_result(self, apply_package_job, read_job_result):
+        block = self.make_one(package_job="job_id")
+        save_job({
+            "id": "job_id", "status": "done", "bytes_hashed": 1, "bytes_total": 1,
+            "files_extracted": 1, "files_total": 1, "errors": [],
+        })
 
-        zipfile.ZipFile.assert_called_once_with(mock_file_object, "r")
-        update_package_fields.assert_called_once_with()
+        status = block.refresh_package_job("job_id")
+
+        self.assertEqual(status["status"], "failed")
+        self.assertIsNone(block.package_job)
+        apply_package_job.assert_not_called()
+
+    @override_settings(SCORM_PROCESSING={"executor": "sync"})
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    def test_save_invalid_scorm_zipfile(self, get_scorm_storage):
+        get_scorm_storage.return_value = FileSystemStorage(location=self.make_storage_dir())
+        block = self.make_one(scorm_file_meta={"sha1": "a" * 40, "name": "old.zip", "shared": True})
+        block.runtime.service.return_value = None
+
+        response = json.loads(self.submit_package(block, b"not a zip file").body.decode("utf8"))
+
+        self.assertEqual(response["status"], "failed")
+        self.assertEqual(response["errors"], ["Invalid package: the file is not a zip file"])
+        self.assertIsNone(block.package_job)
+        self.assertEqual(block.scorm_file_meta, {"sha1": "a" * 40, "name": "old.zip", "shared": True})
+
+    @override_settings(SCORM_PROCESSING={"executor": "sync"}, SCORM_PACKAGE_LIMITS={"max_files": 1})
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    def test_save_scorm_zipfile_over_limits(self, get_scorm_storage):
+        block = self.make_one()
+        block.runtime.service.return_value = None
+        package_data = make_package({"imsmanifest.xml": SCORM_12_MANIFEST, "content/index.html": b"index"})
+
+        response = json.loads(self.submit_package(block, package_data).body.decode("utf8"))
+
+        self.assertEqual(response["status"], "failed")
+        self.assertEqual(response["errors"], ["The package has 2 files, more than the limit of 1"])
+        get_scorm_storage().save.assert_not_called()
+
+    @override_settings(SCORM_PROCESSING={"executor": "thread"})
+    @mock.patch("scormxblock.jobs.get_pool_executor")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    def test_invalid_scorm_zipfile_is_rejected_before_processing(self, get_scorm_storage, get_pool_executor):
+        block = self.make_one()
+        block.runtime.service.return_value = None
+        package_data = make_package({"imsmanifest.xml": SCORM_12_MANIFEST, "index.html": b"index"})
+
+        response = json.loads(self.submit_package(block, package_data).body.decode("utf8"))
+
+        self.assertEqual(response["status"], "failed")
+        self.assertEqual(response["errors"], ['Invalid package: launch pages not found in the zip file "content/index.html"'])
+        get_pool_executor.assert_not_called()
+        get_scorm_storage.assert_not_called()
+
+    @staticmethod
+    def upload_chunk(block, upload_id, offset, chunk=None, size=0):
+        """
+        Sends a chunk of a package to the block through the upload_chunk handler.
+        """
+        params = {"upload_id": upload_id, "offset": offset, "size": size, "name": "scorm_file_name.zip"}
+        if chunk is not None:
+            params["chunk"] = mock.Mock(file=io.BytesIO(chunk))
+        response = block.upload_chunk(mock.Mock(method="POST", params=params))
+        return json.loads(response.body.decode("utf8"))
+
+    @mock.patch("scormxblock.ScormXBlock.update_package_fields")
+    @mock.patch("scormxblock.jobs.hash_file")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_upload_chunks(self, get_scorm_storage, jobs_get_scorm_storage, hash_file, update_package_fields):
+        storage = FileSystemStorage(location=self.make_storage_dir())
+        get_scorm_storage.return_value = jobs_get_scorm_storage.return_value = storage
+        block = self.make_one()
+        block.runtime.service.return_value = None
+        package_data = make_package({"imsmanifest.xml": b"<manifest/>", "index.html": b"x" * 100})
+        size = len(package_data)
+        tmp_dir = self.make_storage_dir()
+
+        with override_settings(SCORM_PROCESSING={"executor": "sync", "tmp_dir": tmp_dir, "chunk_size": 100}):
+            response = self.upload_chunk(block, "", 0, package_data[:100], size)
+            upload_id = response["upload_id"]
+            self.assertEqual(response["offset"], 100)
+            self.assertNotIn("job_id", response)
+
+            # A chunk sent again, or out of order, is ignored
+            response = self.upload_chunk(block, upload_id, 0, package_data[:100], size)
+            self.assertEqual(response["offset"], 100)
+            response = self.upload_chunk(block, upload_id, 200, package_data[200:300], size)
+            self.assertEqual(response["offset"], 100)
+
+            # Resuming asks for the offset first
+            self.assertEqual(self.upload_chunk(block, upload_id, None, size=size)["offset"], 100)
+            response = self.upload_chunk(block, upload_id, 100, b"x" * 101, size)
+            self.assertEqual(response["errors"], ["The chunk is too large"])
+
+            offset = 100
+            while offset < size:
+                response = self.upload_chunk(block, upload_id, offset, package_data[offset:offset + 100], size)
+                offset = response["offset"]
+
+        self.assertEqual(response["status"], "done")
+        hash_file.assert_not_called()
+        self.assertEqual(block.scorm_file_meta["sha1"], hashlib.sha1(package_data).hexdigest())
+        self.assertEqual(block.scorm_file_meta["size"], size)
+        self.assertTrue(storage.exists(block.package_record_path))
+        self.assertEqual(os.listdir(tmp_dir), [])
+
+    @override_settings(SCORM_PROCESSING={"executor": "sync"})
+    @mock.patch("scormxblock.ScormXBlock.update_package_fields")
+    @mock.patch("scormxblock.jobs.get_scorm_storage")
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_upload_chunks_received_by_other_processes(
+            self, get_scorm_storage, jobs_get_scorm_storage, update_package_fields
+    ):
+        storage = FileSystemStorage(location=self.make_storage_dir())
+        get_scorm_storage.return_value = jobs_get_scorm_storage.return_value = storage
+        block = self.make_one()
+        block.runtime.service.return_value = None
+        package_data = make_package({"imsmanifest.xml": b"<manifest/>", "index.html": b"index"})
+
+        upload_id = self.upload_chunk(block, "", 0, package_data[:50], len(package_data))["upload_id"]
+        uploads._hashers.clear()
+        response = self.upload_chunk(block, upload_id, 50, package_data[50:], len(package_data))
+
+        self.assertEqual(response["status"], "done")
+        self.assertEqual(block.scorm_file_meta["sha1"], hashlib.sha1(package_data).hexdigest())
+
+    @override_settings(ROOT_URLCONF="lms.urls")
+    def test_upload_needs_course_staff(self):
+        block = self.make_one()
+        block.runtime.user_is_staff = False
+
+        with mock.patch("scormxblock.scormxblock.create_upload") as create_upload:
+            response = block.upload_chunk(mock.Mock(method="POST", params={"upload_id": "", "offset": 0}))
+
+        self.assertEqual(response.status_code, 403)
+        create_upload.assert_not_called()
+        self.assertEqual(block.studio_submit(mock.Mock(method="POST", params={})).status_code, 403)
+
+    @override_settings(ROOT_URLCONF="cms.urls")
+    def test_upload_in_studio(self):
+        block = self.make_one()
+        block.runtime.user_is_staff = False
+
+        self.assertTrue(block.can_upload_package())
+
+    @override_settings(SCORM_PACKAGE_LIMITS={"max_size": 150})
+    def test_upload_over_size_limit(self):
+        block = self.make_one()
+        tmp_dir = self.make_storage_dir()
+
+        with override_settings(SCORM_PROCESSING={"tmp_dir": tmp_dir, "chunk_size": 100}):
+            response = self.upload_chunk(block, "", 0, b"x" * 100, 151)
+            self.assertEqual(response["errors"], ["The package is larger than the limit of 0.0 MB"])
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+            # A client announcing a smaller size can't write past the limit either
+            upload_id = self.upload_chunk(block, "", 0, b"x" * 100, 150)["upload_id"]
+            response = self.upload_chunk(block, upload_id, 100, b"x" * 100, 150)
+            self.assertEqual(response["errors"], ["The package is larger than the limit of 0.0 MB"])
+            self.assertEqual(response["offset"], 100)
+
+        self.assertIsNone(block.package_job)
+
+    @data("", "../../etc/passwd", "0" * 32)
+    def test_upload_unknown_chunk(self, upload_id):
+        block = self.make_one()
+
+        with mock.patch("scormxblock.scormxblock.create_upload", return_value="../x"):
+            response = self.upload_chunk(block, upload_id, 0, b"data", 4)
+
+        self.assertEqual(response["errors"], ["Unknown upload"])
+        self.assertIsNone(block.package_job)
+
+    @mock.patch("scormxblock.ScormXBlock.apply_package_job")
+    def test_package_status_of_previous_job(self, apply_package_job):
+        block = self.make_one(package_job="new")
+        save_job({
+            "id": "old", "status": "done", "bytes_hashed": 1, "bytes_total": 1,
+            "files_extracted": 1, "files_total": 1, "errors": [], "meta": {}, "index": {},
+        })
+
+        status = block.refresh_package_job("old")
+
+        self.assertEqual(status["status"], "done")
+        apply_package_job.assert_not_called()
+        self.assertEqual(block.package_job, "new")
+
+    @data(
+        ({"sha1": "a" * 40, "name": "package.zip", "shared": True}, "/eol/scormxblock/v2/{}/index.html".format("a" * 40)),
+        ({"sha1": "sha1", "name": "package.zip"}, "/eol/scormxblock/v1/block_id/sha1/index.html"),
+    )
+    def test_get_live_url(self, value):
+        scorm_file_meta, live_url = value
+        block = self.make_one(scorm_file_meta=scorm_file_meta, path_index_page="index.html")
+
+        self.assertEqual(block.get_live_url(), live_url)
+
+    def test_copy_and_hash(self):
+        source = io.BytesIO(b"x" * 1000)
+        destination = io.BytesIO()
+
+        sha1, size = copy_and_hash(source, destination, chunk_size=64)
+
+        self.assertEqual(sha1, hashlib.sha1(b"x" * 1000).hexdigest())
+        self.assertEqual(size, 1000)
+        self.assertEqual(destination.getvalue(), b"x" * 1000)
 
     def test_build_file_storage_path(self):
         block = self.make_one(
@@ -128,12 +590,13 @@ class ScormXBlockTests(unittest.TestCase):
     )
     @mock.patch("scormxblock.ScormXBlock.publish_grade")
     @data(
-        {"name": "cmi.core.lesson_status", "value": "completed"},
-        {"name": "cmi.completion_status", "value": "failed"},
-        {"name": "cmi.success_status", "value": "unknown"},
+        ({"name": "cmi.core.lesson_status", "value": "completed"}, "SCORM_12"),
+        ({"name": "cmi.completion_status", "value": "completed"}, "SCORM_2004"),
+        ({"name": "cmi.success_status", "value": "unknown"}, "SCORM_2004"),
     )
-    def test_set_status(self, value, publish_grade, get_completion_status):
-        block = self.make_one(has_score=True)
+    @unpack
+    def test_set_status(self, value, version, publish_grade, get_completion_status):
+        block = self.make_one(has_score=True, version_scorm=version)
 
         response = block.scorm_set_value(
             mock.Mock(method="POST", body=json.dumps(value).encode('utf-8'))
@@ -161,11 +624,12 @@ class ScormXBlockTests(unittest.TestCase):
         return_value="completion_status",
     )
     @data(
-        {"name": "cmi.core.score.raw", "value": "20"},
-        {"name": "cmi.score.raw", "value": "20"},
+        ({"name": "cmi.core.score.raw", "value": "20"}, "SCORM_12"),
+        ({"name": "cmi.score.raw", "value": "20"}, "SCORM_2004"),
     )
-    def test_set_lesson_score(self, value, get_completion_status):
-        block = self.make_one(has_score=True)
+    @unpack
+    def test_set_lesson_score(self, value, version, get_completion_status):
+        block = self.make_one(has_score=True, version_scorm=version)
 
         response = block.scorm_set_value(
             mock.Mock(method="POST", body=json.dumps(value).encode('utf-8'))
@@ -189,12 +653,13 @@ class ScormXBlockTests(unittest.TestCase):
         return_value="completion_status",
     )
     @data(
-        {"name": "cmi.core.lesson_location", "value": 1},
-        {"name": "cmi.location", "value": 2},
-        {"name": "cmi.suspend_data", "value": [1, 2]},
+        ({"name": "cmi.core.lesson_location", "value": 1}, "1", "SCORM_12"),
+        ({"name": "cmi.location", "value": "2"}, "2", "SCORM_2004"),
+        ({"name": "cmi.suspend_data", "value": [1, 2]}, "[1, 2]", "SCORM_12"),
     )
-    def test_set_other_scorm_values(self, value, get_completion_status):
-        block = self.make_one(has_score=True)
+    @unpack
+    def test_set_other_scorm_values(self, value, stored_value, version, get_completion_status):
+        block = self.make_one(has_score=True, version_scorm=version)
 
         response = block.scorm_set_value(
             mock.Mock(method="POST", body=json.dumps(value).encode('utf-8'))
@@ -202,20 +667,163 @@ class ScormXBlockTests(unittest.TestCase):
 
         get_completion_status.assert_called_once_with()
 
-        self.assertEqual(block.data_scorm[value["name"]], value["value"])
+        self.assertEqual(block.get_cmi_data()[value["name"]], stored_value)
 
         self.assertEqual(
             response.json,
             {"completion_status": "completion_status", "result": "success"},
         )
 
+    @mock.patch("scormxblock.ScormXBlock.publish_grade")
+    def test_set_values(self, publish_grade):
+        block = self.make_one(has_score=True, weight=2)
+        values = [
+            {"name": "cmi.core.lesson_location", "value": "page 3"},
+            {"name": "cmi.core.score.raw", "value": "50"},
+            {"name": "cmi.core.lesson_status", "value": "completed"},
+            {"name": "cmi.suspend_data", "value": "abc"},
+        ]
+
+        response = block.scorm_set_values(
+            mock.Mock(method="POST", body=json.dumps({"values": values}).encode('utf-8'))
+        )
+
+        self.assertEqual(block.lesson_score, 1)
+        self.assertEqual(block.lesson_status, "completed")
+        self.assertEqual(
+            get_values(block.data_scorm), {"cmi.core.lesson_location": "page 3", "cmi.suspend_data": "abc"}
+        )
+        self.assertEqual(
+            response.json,
+            {"completion_status": "completed", "lesson_score": 1, "result": "success"},
+        )
+
+    @mock.patch("scormxblock.ScormXBlock.is_past_due", return_value=True)
+    def test_set_values_past_due(self, is_past_due):
+        block = self.make_one(has_score=True)
+        values = [{"name": "cmi.core.lesson_status", "value": "completed"}]
+
+        response = block.scorm_set_values(
+            mock.Mock(method="POST", body=json.dumps({"values": values}).encode('utf-8'))
+        )
+
+        self.assertEqual(block.lesson_status, "not attempted")
+        self.assertEqual(response.json["completion_status"], "not attempted")
+
+    def test_publish_grade_skips_unchanged_grades(self):
+        block = self.make_one(has_score=True, weight=2)
+        suppressed = ScormXBlock.suppressed_grade_publishes
+
+        for value in ["50", "50", "80"]:
+            block.scorm_set_value(
+                mock.Mock(method="POST", body=json.dumps({"name": "cmi.core.score.raw", "value": value}).encode('utf-8'))
+            )
+
+        self.assertEqual(
+            block.runtime.publish.call_args_list,
+            [
+                mock.call(block, "grade", {"value": 1, "max_value": 2}),
+                mock.call(block, "grade", {"value": 1.6, "max_value": 2}),
+            ],
+        )
+        self.assertEqual(block.published_grade, {"value": 1.6, "max_value": 2})
+        self.assertEqual(ScormXBlock.suppressed_grade_publishes, suppressed + 1)
+
+    def test_set_values_publishes_one_grade(self):
+        block = self.make_one(has_score=True, weight=1, version_scorm="SCORM_2004")
+        values = [
+            {"name": "cmi.score.raw", "value": "50"},
+            {"name": "cmi.completion_status", "value": "completed"},
+            {"name": "cmi.success_status", "value": "passed"},
+            {"name": "cmi.score.raw", "value": "70"},
+        ]
+
+        block.scorm_set_values(
+            mock.Mock(method="POST", body=json.dumps({"values": values}).encode('utf-8'))
+        )
+
+        block.runtime.publish.assert_called_once_with(block, "grade", {"value": 0.7, "max_value": 1})
+
+    def test_set_score_resets_published_grade(self):
+        block = self.make_one(has_score=True, weight=2, published_grade={"value": 1, "max_value": 2})
+
+        block.set_score(mock.Mock(raw_earned=1))
+
+        self.assertEqual(block.published_grade, {})
+
+    def test_templates_are_compiled_once(self):
+        self.assertIs(
+            load_template("static/html/author_view.html"), load_template("static/html/author_view.html")
+        )
+
+    @mock.patch("scormxblock.ScormXBlock.render_template", return_value="")
+    def test_static_resources_as_urls(self, render_template):
+        block = self.make_one()
+        block.runtime.service().get_settings_bucket.return_value = {"INLINE_ASSETS": False}
+        block.runtime.local_resource_url.side_effect = lambda block, path: "/resource/" + path
+
+        fragment = block.studio_view()
+
+        self.assertEqual(
+            [(resource.kind, resource.data) for resource in fragment.resources],
+            [("url", "/resource/static/css/scormxblock.css"), ("url", "/resource/static/js/src/studio.js")],
+        )
+
+    def test_get_cmi_data(self):
+        block = self.make_one(
+            lesson_status="incomplete",
+            success_status="unknown",
+            lesson_score=0.5,
+            data_scorm={"cmi.core.lesson_location": "page 3"},
+        )
+
+        cmi_data = block.get_cmi_data()
+
+        self.assertEqual(
+            {name: value for name, value in cmi_data.items() if not name.endswith(("._children", "._count"))},
+            {
+                "cmi._version": "3.4",
+                "cmi.core.entry": "",
+                "cmi.core.credit": "credit",
+                "cmi.core.lesson_mode": "normal",
+                "cmi.core.total_time": "0000:00:00.00",
+                "cmi.core.student_id": "",
+                "cmi.core.student_name": "",
+                "cmi.launch_data": "",
+                "cmi.comments_from_lms": "",
+                "cmi.core.lesson_location": "page 3",
+                "cmi.core.lesson_status": "incomplete",
+                "cmi.completion_status": "incomplete",
+                "cmi.success_status": "unknown",
+                "cmi.core.score.raw": 50,
+                "cmi.score.raw": 50,
+            },
+        )
+        self.assertEqual(cmi_data["cmi.core._children"], CHILDREN["SCORM_12"]["cmi.core"])
+        self.assertEqual(cmi_data["cmi.interactions._count"], "0")
+
+    @mock.patch("scormxblock.ScormXBlock.render_template", return_value="")
+    @mock.patch("scormxblock.ScormXBlock.get_live_url", return_value="")
+    def test_student_view_preloads_cmi_data(self, get_live_url, render_template):
+        block = self.make_one(lesson_status="incomplete", data_scorm={"cmi.suspend_data": "abc"})
+
+        fragment = block.student_view()
+
+        self.assertEqual(fragment.json_init_args["cmi_data"], block.get_cmi_data())
+        self.assertEqual(fragment.json_init_args["version_scorm"], "SCORM_12")
+        self.assertEqual(
+            fragment.json_init_args["data_model"]["elements"]["cmi.core.lesson_status"],
+            ["rw", {"vocabulary": ["browsed", "completed", "failed", "incomplete", "passed"]}],
+        )
+
     @data(
-        {"name": "cmi.core.lesson_status"},
-        {"name": "cmi.completion_status"},
-        {"name": "cmi.success_status"},
+        ({"name": "cmi.core.lesson_status"}, "SCORM_12"),
+        ({"name": "cmi.completion_status"}, "SCORM_2004"),
+        ({"name": "cmi.success_status"}, "SCORM_2004"),
     )
-    def test_scorm_get_status(self, value):
-        block = self.make_one(lesson_status="status", success_status="status")
+    @unpack
+    def test_scorm_get_status(self, value, version):
+        block = self.make_one(lesson_status="status", success_status="status", version_scorm=version)
 
         response = block.scorm_get_value(
             mock.Mock(method="POST", body=json.dumps(value).encode('utf-8'))
@@ -224,10 +832,11 @@ class ScormXBlockTests(unittest.TestCase):
         self.assertEqual(response.json, {"value": "status"})
 
     @data(
-        {"name": "cmi.core.score.raw"}, {"name": "cmi.score.raw"},
+        ({"name": "cmi.core.score.raw"}, "SCORM_12"), ({"name": "cmi.score.raw"}, "SCORM_2004"),
     )
-    def test_scorm_get_lesson_score(self, value):
-        block = self.make_one(lesson_score=0.2)
+    @unpack
+    def test_scorm_get_lesson_score(self, value, version):
+        block = self.make_one(lesson_score=0.2, version_scorm=version)
 
         response = block.scorm_get_value(
             mock.Mock(method="POST", body=json.dumps(value).encode('utf-8'))
@@ -236,12 +845,14 @@ class ScormXBlockTests(unittest.TestCase):
         self.assertEqual(response.json, {"value": 20})
 
     @data(
-        {"name": "cmi.core.lesson_location"},
-        {"name": "cmi.location"},
-        {"name": "cmi.suspend_data"},
+        ({"name": "cmi.core.lesson_location"}, "SCORM_12"),
+        ({"name": "cmi.location"}, "SCORM_2004"),
+        ({"name": "cmi.suspend_data"}, "SCORM_12"),
     )
-    def test_get_other_scorm_values(self, value):
+    @unpack
+    def test_get_other_scorm_values(self, value, version):
         block = self.make_one(
+            version_scorm=version,
             data_scorm={
                 "cmi.core.lesson_location": 1,
                 "cmi.location": 2,
@@ -253,4 +864,1308 @@ class ScormXBlockTests(unittest.TestCase):
             mock.Mock(method="POST", body=json.dumps(value).encode('utf-8'))
         )
 
-        self.assertEqual(response.json, {"value": block.data_scorm[value["name"]]})
\ No newline at end of file
+        self.assertEqual(response.json, {"value": block.data_scorm[value["name"]]})
+
+    @data(
+        ("SCORM_12", "cmi.core.session_time", "404"),
+        ("SCORM_12", "cmi.location", "201"),
+        ("SCORM_12", "cmi.core.score._count", "203"),
+        ("SCORM_2004", "cmi.suspend_data", "403"),
+        ("SCORM_2004", "cmi.interactions.0.id", "301"),
+    )
+    @unpack
+    def test_scorm_get_value_error(self, version, name, error_code):
+        block = self.make_one(version_scorm=version)
+
+        response = block.scorm_get_value(
+            mock.Mock(method="POST", body=json.dumps({"name": name}).encode('utf-8'))
+        )
+
+        self.assertEqual(response.json["value"], "")
+        self.assertEqual(response.json["error_code"], error_code)
+
+    @mock.patch("scormxblock.ScormXBlock.publish_grade")
+    def test_set_values_reports_errors(self, publish_grade):
+        block = self.make_one(has_score=True, version_scorm="SCORM_2004")
+        values = [
+            {"name": "cmi.score.raw", "value": "abc"},
+            {"name": "cmi.location", "value": "page 3"},
+            {"name": "cmi.completion_status", "value": "failed"},
+        ]
+
+        response = block.scorm_set_values(
+            mock.Mock(method="POST", body=json.dumps({"values": values}).encode('utf-8'))
+        )
+
+        publish_grade.assert_not_called()
+        self.assertEqual(block.lesson_status, "not attempted")
+        self.assertEqual(get_values(block.data_scorm), {"cmi.location": "page 3"})
+        self.assertEqual(response.json["result"], "error")
+        self.assertEqual(response.json["error_code"], "406")
+        self.assertEqual(response.json["rejected"], ["cmi.score.raw", "cmi.completion_status"])
+
+    def test_get_cmi_data_counts(self):
+        block = self.make_one(version_scorm="SCORM_2004")
+        for name, value in [
+            ("cmi.interactions.0.id", "q1"),
+            ("cmi.interactions.0.objectives.0.id", "o1"),
+            ("cmi.interactions.0.objectives.1.id", "o2"),
+            ("cmi.interactions.1.id", "q2"),
+            ("cmi.exit", "suspend"),
+        ]:
+            block.scorm_set_value(
+                mock.Mock(method="POST", body=json.dumps({"name": name, "value": value}).encode('utf-8'))
+            )
+
+        cmi_data = block.get_cmi_data()
+
+        self.assertEqual(cmi_data["cmi._version"], "1.0")
+        self.assertEqual(cmi_data["cmi.interactions._count"], "2")
+        self.assertEqual(cmi_data["cmi.interactions.0.objectives._count"], "2")
+        self.assertEqual(cmi_data["cmi.interactions.1.objectives._count"], "0")
+        self.assertEqual(cmi_data["cmi.objectives._count"], "0")
+        self.assertEqual(cmi_data["cmi.entry"], "resume")
+        self.assertEqual(cmi_data["cmi.interactions.0.id"], "q1")
+        self.assertNotIn("cmi.exit", cmi_data)
+
+    def test_get_cmi_data_skips_write_only_elements(self):
+        block = self.make_one(data_scorm={
+            "cmi.core.lesson_location": "page 3",
+            "cmi.core.exit": "suspend",
+            "cmi.core.session_time": "0000:10:00",
+            "cmi.interactions.0.id": "q1",
+        })
+
+        cmi_data = block.get_cmi_data()
+
+        self.assertEqual(cmi_data["cmi.core.lesson_location"], "page 3")
+        self.assertEqual(cmi_data["cmi.interactions._count"], "1")
+        for name in ("cmi.core.exit", "cmi.core.session_time", "cmi.interactions.0.id"):
+            self.assertNotIn(name, cmi_data)
+
+
+@ddt
+class CmiStoreTests(unittest.TestCase):
+    def test_set_values(self):
+        data = {}
+        suspend_data = json.dumps({"slides": [{"visited": True, "answers": [1, 2, 3]}] * 100})
+        data = set_value(data, "cmi.suspend_data", suspend_data, "SCORM_2004")
+        data = set_value(data, "cmi.core.lesson_location", "page 3")
+        data = set_value(data, "cmi.interactions.0.id", "q1")
+        data = set_value(data, "cmi.interactions.0.result", "correct")
+        data = set_value(data, "cmi.interactions.1.id", "q2")
+        data = set_value(data, "cmi.interactions.0.correct_responses.0.pattern", "a")
+
+        self.assertEqual(data["values"], {"cmi.core.lesson_location": "page 3"})
+        self.assertEqual(list(data["zipped"]), ["cmi.suspend_data"])
+        self.assertEqual(data["arrays"], {"cmi.interactions": [
+            {"id": "q1", "result": "correct", "correct_responses.0.pattern": "a"},
+            {"id": "q2"},
+        ]})
+        self.assertEqual(get_values(data), {
+            "cmi.suspend_data": suspend_data,
+            "cmi.core.lesson_location": "page 3",
+            "cmi.interactions.0.id": "q1",
+            "cmi.interactions.0.result": "correct",
+            "cmi.interactions.0.correct_responses.0.pattern": "a",
+            "cmi.interactions.1.id": "q2",
+        })
+
+    def test_store_is_smaller_than_flat_dict(self):
+        legacy_data = {"cmi.suspend_data": json.dumps({"slides": [{"id": i, "visited": True} for i in range(200)]})}
+        for index in range(100):
+            legacy_data["cmi.interactions.{}.id".format(index)] = "question-{}".format(index)
+            legacy_data["cmi.interactions.{}.result".format(index)] = "correct"
+
+        data = set_value(legacy_data, "cmi.core.lesson_location", "page 3")
+
+        self.assertEqual(get_values(data), dict(legacy_data, **{"cmi.core.lesson_location": "page 3"}))
+        self.assertLess(len(json.dumps(data)), len(json.dumps(legacy_data)) / 2)
+
+    def test_incompressible_values_are_kept_plain(self):
+        value = base64.b64encode(os.urandom(3000)).decode("ascii")
+
+        data = set_value({}, "cmi.suspend_data", value)
+
+        self.assertEqual(data["values"], {"cmi.suspend_data": value})
+
+    @data(
+        ("SCORM_12", "cmi.suspend_data", 4096),
+        ("SCORM_2004", "cmi.suspend_data", 64000),
+        ("SCORM_12", "cmi.core.lesson_location", 255),
+        ("SCORM_2004", "cmi.interactions.0.description", 250),
+    )
+    @unpack
+    @override_settings(SCORM_CMI_LIMITS={"enforce_spm": True})
+    def test_element_limits(self, version, name, limit):
+        set_value({}, name, "x" * limit, version)
+        with self.assertRaises(CmiLimitError):
+            set_value({}, name, "x" * (limit + 1), version)
+
+    def test_element_limits_are_not_enforced_by_default(self):
+        data = set_value({}, "cmi.suspend_data", "x" * 10000, "SCORM_12")
+
+        self.assertEqual(get_values(data), {"cmi.suspend_data": "x" * 10000})
+
+    def test_overridden_element_limits(self):
+        with override_settings(SCORM_CMI_LIMITS={"elements": {"cmi.suspend_data": 10}}):
+            with self.assertRaises(CmiLimitError):
+                set_value({}, "cmi.suspend_data", "x" * 11, "SCORM_2004")
+
+    def test_collection_items_are_added_in_order(self):
+        with self.assertRaises(CmiLimitError):
+            set_value({}, "cmi.interactions.1.id", "q2")
+
+    @data(False, True)
+    def test_collection_limits(self, enforce_spm):
+        data = {}
+        for index in range(100):
+            data = set_value(data, "cmi.objectives.{}.id".format(index), "o{}".format(index))
+
+        with override_settings(SCORM_CMI_LIMITS={"enforce_spm": enforce_spm}):
+            if enforce_spm:
+                with self.assertRaises(CmiLimitError):
+                    set_value(data, "cmi.objectives.100.id", "o100")
+            else:
+                data = set_value(data, "cmi.objectives.100.id", "o100")
+                self.assertEqual(get_count(data, "cmi.objectives"), 101)
+
+    def test_store_size_limit(self):
+        data = set_value({}, "cmi.location", "x" * 1000, "SCORM_2004")
+
+        with override_settings(SCORM_CMI_LIMITS={"max_size": 1100}):
+            with self.assertRaises(CmiLimitError):
+                # Incompressible, so that it is stored as long as it is
+                set_value(data, "cmi.location", base64.b64encode(os.urandom(825)).decode("ascii"), "SCORM_2004")
+            with self.assertRaises(CmiLimitError):
+                set_value(data, "cmi.interactions.0.id", "x" * 100, "SCORM_2004")
+
+        self.assertEqual(get_values(data), {"cmi.location": "x" * 1000})
+
+    @override_settings(SCORM_CMI_LIMITS={"enforce_spm": True})
+    def test_rejected_value(self):
+        block = ScormXBlockTests.make_one(data_scorm={"cmi.suspend_data": "abc"})
+        value = {"name": "cmi.suspend_data", "value": "x" * 5000}
+
+        response = block.scorm_set_value(mock.Mock(method="POST", body=json.dumps(value).encode("utf-8")))
+
+        self.assertEqual(response.json["result"], "error")
+        self.assertEqual(block.get_cmi_data()["cmi.suspend_data"], "abc")
+
+
+@ddt
+class DataModelTests(unittest.TestCase):
+    def make_store(self, values, version="SCORM_2004"):
+        data = {}
+        for name, value in values:
+            data = set_value(data, name, value, version)
+        return data
+
+    @data(
+        ("SCORM_12", "cmi._version", "3.4"),
+        ("SCORM_2004", "cmi._version", "1.0"),
+        ("SCORM_12", "cmi.core.score._children", "raw,min,max"),
+        ("SCORM_2004", "cmi.objectives.0.score._children", "scaled,raw,min,max"),
+        ("SCORM_12", "cmi.core.credit", "credit"),
+        ("SCORM_2004", "cmi.mode", "normal"),
+        ("SCORM_2004", "cmi.entry", "ab-initio"),
+        ("SCORM_12", "cmi.suspend_data", ""),
+    )
+    @unpack
+    def test_get_value(self, version, name, value):
+        self.assertEqual(get_value({}, name, version), value)
+
+    @data(
+        ("SCORM_12", "cmi.core.exit", ["w", {"vocabulary": ["", "logout", "suspend", "time-out"]}]),
+        ("SCORM_12", "cmi.core.student_id", ["r", None]),
+        ("SCORM_2004", "cmi.score.scaled", ["rw", {"real": [-1, 1], "blank": False}]),
+        ("SCORM_2004", "cmi.learner_preference.audio_captioning", ["rw", {"integer": [-1, 1]}]),
+        ("SCORM_2004", "cmi.interactions.n.result", ["rw", {"any_of": [
+            {"vocabulary": ["correct", "incorrect", "neutral", "unanticipated"]},
+            {"real": [None, None], "blank": False},
+        ]}]),
+    )
+    @unpack
+    def test_runtime_data_model(self, version, name, element):
+        data_model = json.loads(json.dumps(get_runtime_data_model(version)))
+
+        self.assertEqual(data_model["elements"][name], element)
+        self.assertEqual(data_model["errors"]["read_only"], "403" if version == "SCORM_12" else "404")
+
+    def test_counts(self):
+        values = [
+            ("cmi.interactions.0.id", "q1"),
+            ("cmi.interactions.0.correct_responses.0.pattern", "a"),
+            ("cmi.interactions.1.id", "q2"),
+            ("cmi.interactions.1.objectives.0.id", "o1"),
+            ("cmi.interactions.1.objectives.1.id", "o2"),
+            ("cmi.comments_from_learner.0.comment", "good"),
+        ]
+        legacy_data = dict(values)
+
+        for data in (self.make_store(values), legacy_data):
+            self.assertEqual(get_value(data, "cmi.interactions._count", "SCORM_2004"), "2")
+            self.assertEqual(get_value(data, "cmi.interactions.0.correct_responses._count", "SCORM_2004"), "1")
+            self.assertEqual(get_value(data, "cmi.interactions.1.objectives._count", "SCORM_2004"), "2")
+            self.assertEqual(get_value(data, "cmi.interactions.2.objectives._count", "SCORM_2004"), "0")
+            self.assertEqual(get_value(data, "cmi.comments_from_learner._count", "SCORM_2004"), "1")
+            self.assertEqual(get_value(data, "cmi.objectives._count", "SCORM_2004"), "0")
+            self.assertEqual(get_value(data, "cmi.interactions.1.objectives.1.id", "SCORM_2004"), "o2")
+        self.assertEqual(get_count(legacy_data, "cmi.interactions.1.objectives"), 2)
+
+    @data(
+        ("SCORM_12", "cmi.location", "201"),
+        ("SCORM_12", "cmi.interactions.0.id", "404"),
+        ("SCORM_12", "cmi.suspend_data._children", "202"),
+        ("SCORM_12", "cmi.core.lesson_status._count", "203"),
+        ("SCORM_2004", "cmi.core.lesson_status", "401"),
+        ("SCORM_2004", "cmi.session_time", "405"),
+        ("SCORM_2004", "cmi.location", "403"),
+        ("SCORM_2004", "cmi.location._children", "301"),
+        ("SCORM_2004", "cmi.interactions.0.id", "301"),
+        ("SCORM_2004", "cmi.interactions.n.id", "401"),
+        ("SCORM_2004", "", "301"),
+    )
+    @unpack
+    def test_get_value_errors(self, version, name, error_code):
+        data = {} if version == "SCORM_12" else {"cmi.suspend_data": "abc"}
+        with self.assertRaises(DataModelError) as context:
+            get_value(data, name, version)
+
+        self.assertEqual(context.exception.code, error_code)
+
+    @data(
+        ("SCORM_12", "cmi.core.lesson_status", "completed"),
+        ("SCORM_12", "cmi.core.score.raw", ""),
+        ("SCORM_12", "cmi.core.session_time", "0001:30:05.25"),
+        ("SCORM_12", "cmi.interactions.0.result", "wrong"),
+        ("SCORM_12", "cmi.interactions.0.result", "0.5"),
+        ("SCORM_12", "cmi.interactions.0.time", "13:05:00"),
+        ("SCORM_12", "cmi.student_preference.speed", "-50"),
+        ("SCORM_2004", "cmi.completion_status", "not attempted"),
+        ("SCORM_2004", "cmi.score.scaled", "-0.5"),
+        ("SCORM_2004", "cmi.session_time", "PT1H30M5.25S"),
+        ("SCORM_2004", "cmi.interactions.0.id", "urn:question:1"),
+        ("SCORM_2004", "cmi.comments_from_learner.0.timestamp", "2020-04-01T10:20:30.5Z"),
+        ("SCORM_2004", "adl.nav.request", "continue"),
+    )
+    @unpack
+    def test_valid_values(self, version, name, value):
+        check_value({}, name, value, version)
+
+    @data(
+        ("SCORM_12", "cmi.core.lesson_status", "not attempted", "405"),
+        ("SCORM_12", "cmi.core.score.raw", "101", "405"),
+        ("SCORM_12", "cmi.core.session_time", "PT1H", "405"),
+        ("SCORM_12", "cmi.core.credit", "no-credit", "403"),
+        ("SCORM_12", "cmi.core._children", "raw", "402"),
+        ("SCORM_12", "cmi.interactions._count", "1", "402"),
+        ("SCORM_12", "cmi.completion_status", "completed", "201"),
+        ("SCORM_12", "cmi.interactions.1.id", "q2", "201"),
+        ("SCORM_2004", "cmi.completion_status", "failed", "406"),
+        ("SCORM_2004", "cmi.score.scaled", "2", "407"),
+        ("SCORM_2004", "cmi.score.raw", "abc", "406"),
+        ("SCORM_2004", "cmi.session_time", "01:00:00", "406"),
+        ("SCORM_2004", "cmi.entry", "resume", "404"),
+        ("SCORM_2004", "cmi._version", "1.0", "404"),
+        ("SCORM_2004", "cmi.core.lesson_status", "completed", "401"),
+        ("SCORM_2004", "cmi.interactions.1.id", "q2", "351"),
+        ("SCORM_2004", "cmi.interactions.0.result", "correct", "408"),
+        ("SCORM_2004", "cmi.objectives.0.score.raw", "1", "408"),
+    )
+    @unpack
+    def test_invalid_values(self, version, name, value, error_code):
+        with self.assertRaises(DataModelError) as context:
+            check_value({}, name, value, version)
+
+        self.assertEqual(context.exception.code, error_code)
+
+    def test_sub_elements_of_existing_items(self):
+        data = self.make_store([("cmi.interactions.0.id", "q1")])
+
+        check_value(data, "cmi.interactions.0.result", "correct", "SCORM_2004")
+        check_value(data, "cmi.interactions.0.objectives.0.id", "o1", "SCORM_2004")
+        check_value(data, "cmi.interactions.1.id", "q2", "SCORM_2004")
+        with self.assertRaises(DataModelError):
+            check_value(data, "cmi.interactions.0.objectives.1.id", "o2", "SCORM_2004")
+
+
+@ddt
+class ExportTests(unittest.TestCase):
+    def make_source(self, batch_size=2):
+        compact_data = set_value({}, "cmi.interactions.0.id", "q1")
+        return MemorySource({
+            ("ana", "block-v1:org+course+run+type@scormxblock+block@a"): {
+                "lesson_status": "completed",
+                "success_status": "passed",
+                "lesson_score": 0.8,
+                "data_scorm": {"cmi.core.lesson_location": "page 3", "cmi.suspend_data": "abc"},
+            },
+            ("bob", "block-v1:org+course+run+type@scormxblock+block@a"): {"data_scorm": compact_data},
+            ("bob", "block-v1:org+course+run+type@scormxblock+block@b"): {"lesson_status": "incomplete"},
+            ("eve", "block-v1:org+course+run+type@scormxblock+block@other"): {"lesson_status": "passed"},
+        }, batch_size=batch_size)
+
+    def test_export_csv(self):
+        source = self.make_source()
+
+        lines = export_progress([
+            "block-v1:org+course+run+type@scormxblock+block@a",
+            "block-v1:org+course+run+type@scormxblock+block@b",
+        ], source=source)
+
+        self.assertEqual(next(lines), "username,block_id,lesson_status,success_status,lesson_score,data_scorm\r\n")
+        self.assertEqual(source.pages_read, 0)
+        self.assertEqual(list(lines), [
+            'ana,block-v1:org+course+run+type@scormxblock+block@a,completed,passed,0.8,'
+            '"{""cmi.core.lesson_location"": ""page 3"", ""cmi.suspend_data"": ""abc""}"\r\n',
+            'bob,block-v1:org+course+run+type@scormxblock+block@a,not attempted,unknown,0,'
+            '"{""cmi.interactions.0.id"": ""q1""}"\r\n',
+            'bob,block-v1:org+course+run+type@scormxblock+block@b,incomplete,unknown,0,{}\r\n',
+        ])
+        self.assertEqual(source.pages_read, 2)
+
+    def test_export_csv_columns(self):
+        lines = export_progress(
+            ["block-v1:org+course+run+type@scormxblock+block@a"],
+            columns=["cmi.core.lesson_location", "cmi.interactions.0.id"],
+            source=self.make_source(),
+        )
+
+        self.assertEqual(list(csv.reader(lines)), [
+            ["username", "block_id", "lesson_status", "success_status", "lesson_score",
+             "cmi.core.lesson_location", "cmi.interactions.0.id"],
+            ["ana", "block-v1:org+course+run+type@scormxblock+block@a", "completed", "passed", "0.8", "page 3", ""],
+            ["bob", "block-v1:org+course+run+type@scormxblock+block@a", "not attempted", "unknown", "0", "", "q1"],
+        ])
+
+    def test_export_jsonl(self):
+        lines = export_progress(
+            ["block-v1:org+course+run+type@scormxblock+block@b"], "jsonl", source=self.make_source()
+        )
+
+        self.assertEqual([json.loads(line) for line in lines], [{
+            "username": "bob",
+            "block_id": "block-v1:org+course+run+type@scormxblock+block@b",
+            "lesson_status": "incomplete",
+            "success_status": "unknown",
+            "lesson_score": 0,
+            "data_scorm": {},
+        }])
+
+    def test_export_handler(self):
+        block = ScormXBlockTests.make_one()
+        block.runtime.user_is_staff = True
+        block.location = "block-v1:org+course+run+type@scormxblock+block@b"
+
+        response = block.export_progress(mock.Mock(method="GET", params={"columns": "cmi.location", "other": "x"}))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response.location,
+            "/eol/scormxblock/export/block-v1:org+course+run+type@scormxblock+block@b?columns=cmi.location",
+        )
+
+    def export_view(self, params, is_staff=True, block_type="scormxblock"):
+        usage_key = mock.Mock(block_type=block_type, block_id="b", course_key="course-v1:org+course+run")
+        request = RequestFactory().get("/", params)
+        request.user = mock.Mock(is_authenticated=True)
+        with mock.patch("scormxblock.views.get_usage_key", return_value=usage_key), \
+                mock.patch("scormxblock.views.is_course_staff", return_value=is_staff) as is_course_staff, \
+                mock.patch("scormxblock.views.export_progress", return_value=iter(["a,b\r\n", "c,d\r\n"])) as export:
+            response = export_scorm_progress(request, "block-v1:org+course+run+type@scormxblock+block@b")
+            if response.status_code == 200:
+                response.content_bytes = b"".join(response.streaming_content)
+        is_course_staff.assert_called_once_with(request.user, "course-v1:org+course+run")
+        return response, export, usage_key
+
+    def test_export_view_streams(self):
+        response, export, usage_key = self.export_view({"format": "jsonl", "columns": "cmi.location,cmi.exit"})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response.content_bytes, b"a,b\r\nc,d\r\n")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson; charset=utf8")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="b.jsonl"')
+        export.assert_called_once_with([usage_key], "jsonl", ["cmi.location", "cmi.exit"])
+
+    @data(({}, False, 403), ({"format": "xml"}, True, 400))
+    @unpack
+    def test_export_view_errors(self, params, is_staff, status_code):
+        response, export, _ = self.export_view(params, is_staff)
+
+        self.assertEqual(response.status_code, status_code)
+        export.assert_not_called()
+
+    def test_export_handler_is_for_staff(self):
+        block = ScormXBlockTests.make_one()
+        block.runtime.user_is_staff = False
+
+        response = block.export_progress(mock.Mock(method="GET", params={}))
+
+        self.assertEqual(response.status_code, 403)
+
+
+@ddt
+class ExtractionTests(unittest.TestCase):
+    def make_zipfile(self, files):
+        return zipfile.ZipFile(io.BytesIO(make_package(files)))
+
+    def test_extract_package_in_parallel(self):
+        files = {"file{}.txt".format(i): "content {}".format(i).encode() for i in range(50)}
+        storage = mock.Mock()
+        saved = {}
+        storage.save.side_effect = lambda path, content: saved.setdefault(path, b"".join(content.chunks()))
+
+        extract_package(self.make_zipfile(files), storage, "dest", workers=4)
+
+        self.assertEqual(storage.save.call_count, 50)
+        self.assertEqual(saved, {os.path.join("dest", name): content for name, content in files.items()})
+
+    @mock.patch("scormxblock.extraction.time.sleep")
+    def test_extract_package_retries_transient_errors(self, sleep):
+        storage = mock.Mock()
+        storage.save.side_effect = [IOError("timeout"), "dest/a.txt"]
+        storage.exists.return_value = False
+
+        extract_package(self.make_zipfile({"a.txt": b"a"}), storage, "dest", retries=2)
+
+        self.assertEqual(storage.save.call_count, 2)
+        sleep.assert_called_once_with(mock.ANY)
+
+    @mock.patch("scormxblock.extraction.time.sleep")
+    def test_extract_package_reports_failed_files(self, sleep):
+        storage = mock.Mock()
+        storage.exists.return_value = False
+
+        def save(path, content):
+            if path.endswith("bad.txt"):
+                raise IOError("unreachable")
+            return path
+        storage.save.side_effect = save
+
+        with self.assertRaises(ScormError) as context:
+            extract_package(
+                self.make_zipfile({"good.txt": b"a", "bad.txt": b"b"}), storage, "dest", workers=2, retries=1
+            )
+
+        self.assertIn('"bad.txt"', context.exception.args[0])
+        self.assertNotIn('"good.txt"', context.exception.args[0])
+
+    def test_extract_package_precompresses_text_files(self):
+        script = b"var x = 1;\n" * 500
+        files = {"app.js": script, "small.css": b"a {}", "video.mp4": b"\0" * 5000}
+        storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        compression = dict(DEFAULT_COMPRESSION, encodings=["gzip"])
+
+        index = extract_package(self.make_zipfile(files), storage, "dest", compression=compression)
+
+        self.assertEqual(index["app.js"][3], {"gzip": storage.size("dest/app.js.gz")})
+        self.assertEqual(index["small.css"][3], {})
+        self.assertEqual(index["video.mp4"][3], {})
+        with storage.open("dest/app.js.gz") as compressed:
+            self.assertEqual(gzip.decompress(compressed.read()), script)
+        self.assertFalse(storage.exists("dest/small.css.gz"))
+        self.assertFalse(storage.exists("dest/video.mp4.gz"))
+
+    def test_extract_package_streams_members(self):
+        video = os.urandom(8 * 2 ** 20)
+        scorm_zipfile = self.make_zipfile({"video.mp4": video, "app.js": b"var x = 1;\n" * 2 ** 16})
+        storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+
+        tracemalloc.start()
+        try:
+            extract_package(scorm_zipfile, storage, "dest", compression=dict(DEFAULT_COMPRESSION, encodings=["gzip"]))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak, 2 ** 20)
+        with storage.open("dest/video.mp4") as extracted:
+            self.assertEqual(extracted.read(), video)
+        with storage.open("dest/app.js.gz") as compressed:
+            self.assertEqual(gzip.decompress(compressed.read()), b"var x = 1;\n" * 2 ** 16)
+
+    def test_extract_package_to_local_folder(self):
+        storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        files = {"index.html": b"<html></html>", "js/app.js": b"var x = 1;\n" * 500, "media/": b""}
+
+        with mock.patch.object(storage, "save") as save:
+            index = extract_package(
+                self.make_zipfile(files), storage, "scorm/packages/sha1", workers=2,
+                compression=dict(DEFAULT_COMPRESSION, encodings=["gzip"]),
+            )
+
+        save.assert_not_called()
+        self.assertEqual(sorted(index), ["index.html", "js/app.js"])
+        self.assertEqual(os.listdir(storage.path("scorm/packages")), ["sha1"])
+        with storage.open("scorm/packages/sha1/js/app.js") as extracted:
+            self.assertEqual(extracted.read(), files["js/app.js"])
+        with storage.open("scorm/packages/sha1/js/app.js.gz") as compressed:
+            self.assertEqual(gzip.decompress(compressed.read()), files["js/app.js"])
+        self.assertEqual(index["js/app.js"][3], {"gzip": storage.size("scorm/packages/sha1/js/app.js.gz")})
+        self.assertTrue(os.path.isdir(storage.path("scorm/packages/sha1/media")))
+
+    def test_extract_package_to_local_folder_replaces_partial_extraction(self):
+        storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        storage.save("dest/stale.txt", ContentFile(b"stale"))
+
+        extract_package(self.make_zipfile({"index.html": b"index"}), storage, "dest")
+
+        self.assertEqual(os.listdir(storage.location), ["dest"])
+        self.assertEqual(storage.listdir("dest"), ([], ["index.html"]))
+
+    def test_failed_local_extraction_leaves_nothing(self):
+        storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+
+        with self.assertRaises(ScormError):
+            extract_package(self.make_zipfile({"index.html": b"index", "../evil.html": b"evil"}), storage, "dest")
+
+        self.assertEqual(os.listdir(storage.location), [])
+
+    def test_local_fast_path_can_be_disabled(self):
+        storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        storage_class = {"class": "django.core.files.storage.FileSystemStorage", "options": {}, "local_fast_path": False}
+
+        with override_settings(SCORM_STORAGE_CLASS=storage_class), mock.patch.object(
+                storage, "save", wraps=storage.save
+        ) as save:
+            extract_package(self.make_zipfile({"index.html": b"index"}), storage, "dest")
+
+        save.assert_called_once_with("dest/index.html", mock.ANY)
+        self.assertTrue(storage.exists("dest/index.html"))
+
+    @data(
+        ({"max_files": 2}, "The package has 3 files, more than the limit of 2"),
+        ({"max_size": 2 ** 20}, "The package takes 2.0 MB once uncompressed, more than the limit of 1.0 MB"),
+        ({"max_ratio": 50}, 'The file "zeros.bin" of the package is compressed more than 50 times, it may be a zip bomb'),
+    )
+    @unpack
+    def test_extract_package_over_limits(self, limits, message):
+        scorm_zipfile = self.make_zipfile({"a.txt": b"a", "b.txt": b"b", "zeros.bin": b"\0" * 2 * 2 ** 20})
+        storage = mock.Mock()
+
+        with override_settings(SCORM_PACKAGE_LIMITS=limits), self.assertRaises(PackageLimitError) as context:
+            extract_package(scorm_zipfile, storage, "dest")
+
+        self.assertEqual(context.exception.args[0], message)
+        storage.save.assert_not_called()
+
+    def test_small_members_are_not_checked_for_ratio(self):
+        scorm_zipfile = self.make_zipfile({"zeros.bin": b"\0" * 2 ** 16})
+
+        check_package_limits(scorm_zipfile.infolist(), dict(DEFAULT_LIMITS, max_ratio=2))
+
+
+@ddt
+class ManifestTests(unittest.TestCase):
+    def test_parse_manifest(self):
+        index = parse_manifest(io.BytesIO(SCORM_12_MANIFEST))
+
+        self.assertEqual(index["version"], "SCORM_12")
+        self.assertEqual(index["schemaversion"], "1.2")
+        self.assertEqual(index["default_organization"], "ORG-2")
+        self.assertEqual(index["launch"], "content/index.html")
+        self.assertEqual(index["scos"], ["RES-SCO"])
+        self.assertEqual(
+            index["resources"]["RES-SCO"],
+            {
+                "href": "content/index.html",
+                "type": "webcontent",
+                "scormtype": "sco",
+                "files": ["index.html", "app.js"],
+                "dependencies": ["RES-ASSETS"],
+            },
+        )
+        self.assertEqual(
+            index["organizations"][1],
+            {
+                "identifier": "ORG-2",
+                "title": "Course",
+                "items": [
+                    {"identifier": "ITEM-2", "title": "Module", "resource": None, "parameters": None, "level": 1},
+                    {"identifier": "ITEM-3", "title": "Lesson", "resource": "RES-SCO", "parameters": "?page=1", "level": 2},
+                ],
+            },
+        )
+
+    @data(
+        (b"<manifest><metadata><schemaversion>2004 4th Edition</schemaversion></metadata></manifest>", "SCORM_2004"),
+        (b"<manifest><metadata><schemaversion>1.2</schemaversion></metadata></manifest>", "SCORM_12"),
+        (b"<manifest></manifest>", "SCORM_12"),
+    )
+    def test_parse_manifest_version(self, value):
+        manifest, version = value
+
+        self.assertEqual(parse_manifest(io.BytesIO(manifest))["version"], version)
+
+    @data(
+        (b'<manifest><resources><resource identifier="A"/><resource identifier="B" href="b.html"/></resources></manifest>', "b.html"),
+        (b"<manifest></manifest>", "index.html"),
+    )
+    def test_parse_manifest_launch_fallback(self, value):
+        manifest, launch = value
+
+        self.assertEqual(parse_manifest(io.BytesIO(manifest))["launch"], launch)
+
+    def test_parse_invalid_manifest(self):
+        with self.assertRaises(ScormError):
+            parse_manifest(io.BytesIO(b"<manifest>"))
+
+    def test_read_package_index_without_manifest(self):
+        scorm_zipfile = zipfile.ZipFile(io.BytesIO(make_package({"index.html": b""})))
+
+        with self.assertRaises(ScormError):
+            read_package_index(scorm_zipfile)
+
+    def test_validate_package(self):
+        scorm_zipfile = zipfile.ZipFile(io.BytesIO(make_package({
+            "imsmanifest.xml": SCORM_12_MANIFEST, "content/index.html": b"index", "content/app.js": b"",
+        })))
+
+        self.assertEqual(validate_package(scorm_zipfile)["launch"], "content/index.html")
+
+    @data(
+        (
+            {"imsmanifest.xml": SCORM_12_MANIFEST, "content/index.html": b"", "../evil.js": b"", "/etc/passwd": b""},
+            'Invalid package: unsafe file paths "../evil.js", "/etc/passwd"',
+        ),
+        (
+            {"imsmanifest.xml": SCORM_12_MANIFEST, "content/index.html": b"", "C:\\evil.js": b""},
+            'Invalid package: unsafe file paths "C:\\evil.js"',
+        ),
+        (
+            {"index.html": b""},
+            "Invalid package: could not find 'imsmanifest.xml' file at the root of the zip file",
+        ),
+        (
+            {"imsmanifest.xml": SCORM_12_MANIFEST, "index.html": b""},
+            'Invalid package: launch pages not found in the zip file "content/index.html"',
+        ),
+        (
+            {"imsmanifest.xml": b"<manifest/>"},
+            'Invalid package: launch pages not found in the zip file "index.html"',
+        ),
+    )
+    @unpack
+    def test_validate_invalid_package(self, files, message):
+        scorm_zipfile = zipfile.ZipFile(io.BytesIO(make_package(files)))
+
+        with self.assertRaises(ScormError) as context:
+            validate_package(scorm_zipfile)
+
+        self.assertEqual(context.exception.args[0], message)
+
+    def test_validate_package_with_duplicate_files(self):
+        package = io.BytesIO()
+        with zipfile.ZipFile(package, "w") as package_zipfile, warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            package_zipfile.writestr("imsmanifest.xml", b"<manifest/>")
+            package_zipfile.writestr("index.html", b"index")
+            package_zipfile.writestr("index.html", b"other")
+            package_zipfile.writestr("./imsmanifest.xml", b"<manifest/>")
+
+        with self.assertRaises(ScormError) as context:
+            validate_package(zipfile.ZipFile(package))
+
+        self.assertEqual(
+            context.exception.args[0],
+            'Invalid package: files present more than once "index.html", "./imsmanifest.xml"',
+        )
+
+    @data(
+        ("content/index%20page.html?page=1#top", "content/index page.html"),
+        ("./content/../content/index.html", "content/index.html"),
+        ("https://example.com/course.html", "unused.html"),
+    )
+    @unpack
+    def test_validate_package_launch_hrefs(self, href, member):
+        manifest = SCORM_12_MANIFEST.replace(b'href="index.html">', 'href="{}">'.format(href).encode()).replace(
+            b'<resources xml:base="content/">', b"<resources>"
+        )
+        scorm_zipfile = zipfile.ZipFile(io.BytesIO(make_package({"imsmanifest.xml": manifest, member: b""})))
+
+        validate_package(scorm_zipfile)
+
+    def test_update_package_fields(self):
+        block = ScormXBlockTests.make_one(scorm_file_meta={"sha1": "sha1"})
+        package_index = parse_manifest(io.BytesIO(SCORM_12_MANIFEST))
+
+        block.update_package_fields(package_index)
+
+        self.assertEqual(block.path_index_page, "content/index.html")
+        self.assertEqual(block.version_scorm, "SCORM_12")
+        self.assertEqual(block.scorm_file_meta["index"], package_index)
+
+    @mock.patch("scormxblock.scormxblock.get_scorm_storage")
+    def test_update_package_fields_from_storage(self, get_scorm_storage):
+        get_scorm_storage().open.return_value = io.BytesIO(SCORM_12_MANIFEST)
+        block = ScormXBlockTests.make_one(scorm_file_meta={"sha1": "sha1", "shared": True})
+        block.runtime.service.return_value = None
+
+        block.update_package_fields()
+
+        get_scorm_storage().open.assert_called_once_with("scorm/packages/sha1/imsmanifest.xml")
+        self.assertEqual(block.path_index_page, "content/index.html")
+
+
+class ScormStorageTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        reset_scorm_storage()
+        self.addCleanup(reset_scorm_storage)
+
+    @staticmethod
+    def storage_settings(location):
+        return {
+            "class": "django.core.files.storage.FileSystemStorage",
+            "options": {"location": location},
+        }
+
+    def test_storage_is_reused(self):
+        with override_settings(SCORM_STORAGE_CLASS=self.storage_settings("/tmp/scorm")):
+            count = get_storage_backends_count()
+            storage = get_scorm_storage()
+
+            self.assertIs(get_scorm_storage(), storage)
+            self.assertEqual(get_storage_backends_count(), count + 1)
+
+    def test_storage_is_rebuilt_on_settings_change(self):
+        with override_settings(SCORM_STORAGE_CLASS=self.storage_settings("/tmp/scorm")):
+            storage = get_scorm_storage()
+        with override_settings(SCORM_STORAGE_CLASS=self.storage_settings("/tmp/other")):
+            other_storage = get_scorm_storage()
+
+        self.assertIsNot(other_storage, storage)
+        self.assertEqual(other_storage.location, "/tmp/other")
+
+
+class CleanupTests(unittest.TestCase):
+    SHA1_USED = "a" * 40
+    SHA1_UNUSED = "b" * 40
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.storage = FileSystemStorage(location=self.tmp_dir)
+        self.now = datetime(2020, 1, 1, tzinfo=pytz.utc)
+        for sha1 in (self.SHA1_USED, self.SHA1_UNUSED):
+            for path in ("packages/{}/index.html", "packages/{}/js/app.js", "packages/{}.json", "packages/{}.zip",
+                         "refs/{}/block.json"):
+                self.storage.save(os.path.join("scorm", path.format(sha1)), ContentFile(b"content"))
+        self.storage.save("scorm/block_id/{}/index.html".format(self.SHA1_UNUSED), ContentFile(b"content"))
+
+    def collect(self, days=0, dry_run=False, referenced=None):
+        referenced = referenced or ({self.SHA1_USED}, set())
+        return collect_garbage(
+            self.storage, "scorm", referenced, dry_run=dry_run, now=self.now + timedelta(days=days)
+        )
+
+    def test_first_pass_marks_unreferenced_packages(self):
+        report = self.collect()
+
+        self.assertEqual(report["marked"], [self.SHA1_UNUSED, ("block_id", self.SHA1_UNUSED)])
+        self.assertEqual(report["deleted"], [])
+        self.assertTrue(self.storage.exists("scorm/gc/{}.json".format(self.SHA1_UNUSED)))
+        self.assertTrue(self.storage.exists("scorm/packages/{}/index.html".format(self.SHA1_UNUSED)))
+
+    def test_packages_are_deleted_after_grace_period(self):
+        self.collect()
+        self.assertEqual(self.collect(days=6)["deleted"], [])
+
+        report = self.collect(days=8)
+
+        self.assertEqual(report["deleted"], [self.SHA1_UNUSED, ("block_id", self.SHA1_UNUSED)])
+        self.assertEqual(report["files_deleted"], 6)
+        for path in ("packages/{}", "packages/{}.json", "packages/{}.zip", "refs/{}", "block_id/{}", "gc/{}.json"):
+            self.assertFalse(self.storage.exists(os.path.join("scorm", path.format(self.SHA1_UNUSED))), path)
+        self.assertTrue(self.storage.exists("scorm/packages/{}/js/app.js".format(self.SHA1_USED)))
+        self.assertTrue(self.storage.exists("scorm/refs/{}/block.json".format(self.SHA1_USED)))
+        self.assertEqual(self.storage.listdir("scorm/gc"), ([], []))
+
+    def test_dry_run_changes_nothing(self):
+        self.collect()
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(self.tmp_dir) for name in names)
+
+        report = self.collect(days=8, dry_run=True)
+
+        self.assertEqual(report["deleted"], [self.SHA1_UNUSED, ("block_id", self.SHA1_UNUSED)])
+        self.assertEqual(report["files_deleted"], 6)
+        self.assertEqual(
+            sorted(os.path.join(root, name) for root, _, names in os.walk(self.tmp_dir) for name in names), files
+        )
+
+    def test_referenced_again_package_is_unmarked(self):
+        self.collect()
+
+        report = self.collect(days=8, referenced=({self.SHA1_USED, self.SHA1_UNUSED}, set()))
+
+        self.assertEqual(report["unmarked"], [self.SHA1_UNUSED])
+        self.assertEqual(report["deleted"], [("block_id", self.SHA1_UNUSED)])
+        self.assertFalse(self.storage.exists("scorm/gc/{}.json".format(self.SHA1_UNUSED)))
+        self.assertTrue(self.storage.exists("scorm/packages/{}/index.html".format(self.SHA1_UNUSED)))
+
+    def test_referenced_legacy_tree_is_kept(self):
+        self.collect(referenced=({self.SHA1_USED}, {("block_id", self.SHA1_UNUSED)}))
+
+        report = self.collect(days=8, referenced=({self.SHA1_USED}, {("block_id", self.SHA1_UNUSED)}))
+
+        self.assertEqual(report["deleted"], [self.SHA1_UNUSED])
+        self.assertTrue(self.storage.exists("scorm/block_id/{}/index.html".format(self.SHA1_UNUSED)))
+
+    def test_package_unmarked_during_the_run_is_kept(self):
+        self.collect()
+        markers = get_markers(self.storage, "scorm")
+        # An upload of the package removes its marker after the run listed the markers
+        self.storage.delete("scorm/gc/{}.json".format(self.SHA1_UNUSED))
+
+        with mock.patch("scormxblock.cleanup.get_markers", return_value=markers):
+            report = self.collect(days=8)
+
+        self.assertEqual(report["deleted"], [("block_id", self.SHA1_UNUSED)])
+        self.assertTrue(self.storage.exists("scorm/packages/{}/index.html".format(self.SHA1_UNUSED)))
+
+    @mock.patch("scormxblock.jobs.get_job")
+    def test_referenced_packages(self, get_job):
+        jobs = {
+            "job_id": {"status": "done", "meta": {"sha1": "c" * 40}},
+            "running": {"status": "running", "sha1": "d" * 40},
+            "hashing": {"status": "running"},
+            "failed": {"status": "failed", "sha1": "e" * 40},
+        }
+        get_job.side_effect = jobs.get
+        blocks = [
+            mock.Mock(scorm_file_meta={"sha1": self.SHA1_USED, "shared": True}, package_job="job_id"),
+            mock.Mock(scorm_file_meta={"sha1": self.SHA1_UNUSED}, package_job=None, location=mock.Mock(block_id="old")),
+            mock.Mock(scorm_file_meta={}, package_job="running"),
+            mock.Mock(scorm_file_meta={}, package_job="hashing"),
+            mock.Mock(scorm_file_meta={}, package_job="failed"),
+        ]
+
+        shared, legacy = get_referenced_packages(blocks)
+
+        self.assertEqual(shared, {self.SHA1_USED, "c" * 40, "d" * 40})
+        self.assertEqual(legacy, {("old", self.SHA1_UNUSED)})
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        override = override_settings(SCORM_METRICS={"backend": "memory"})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.metrics = get_metrics()
+
+    def test_null_backend_by_default(self):
+        with override_settings(SCORM_METRICS={}):
+            self.assertIsInstance(get_metrics(), NullMetrics)
+
+    def test_backend_is_reused(self):
+        self.assertIs(get_metrics(), self.metrics)
+        self.assertIsInstance(self.metrics, MemoryMetrics)
+
+    def test_handlers_are_timed(self):
+        block = ScormXBlockTests.make_one(has_score=True)
+        value = {"name": "cmi.core.score.raw", "value": "50"}
+
+        block.scorm_set_value(mock.Mock(method="POST", body=json.dumps(value).encode("utf-8")))
+        block.scorm_set_value(mock.Mock(method="POST", body=json.dumps(value).encode("utf-8")))
+
+        self.assertEqual(len(self.metrics.timings["handler.scorm_set_value"]), 2)
+        self.assertEqual(len(self.metrics.timings["grade.publish"]), 1)
+        self.assertEqual(self.metrics.counters["grade.suppressed"], 1)
+
+    def test_errors_are_counted(self):
+        with self.assertRaises(ValueError):
+            with timer("operation"):
+                raise ValueError()
+
+        self.assertEqual(self.metrics.counters["operation.errors"], 1)
+        self.assertEqual(len(self.metrics.timings["operation"]), 1)
+
+    def test_storage_is_timed(self):
+        reset_scorm_storage()
+        self.addCleanup(reset_scorm_storage)
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage_class = {"class": "django.core.files.storage.FileSystemStorage", "options": {"location": location}}
+
+        with override_settings(SCORM_STORAGE_CLASS=storage_class):
+            storage = get_scorm_storage()
+            storage.save("file.txt", ContentFile(b"content"))
+            storage.open("file.txt").close()
+
+        self.assertIsInstance(storage, FileSystemStorage)
+        self.assertEqual(len(self.metrics.timings["storage.save"]), 1)
+        self.assertEqual(len(self.metrics.timings["storage.open"]), 1)
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_is_timed(self, get_scorm_storage):
+        get_scorm_storage().open.return_value = ContentFile(b"0123456789")
+        request = RequestFactory().get("/", HTTP_RANGE="bytes=2-5")
+
+        proxy_scorm_media(request, file="media.mp4", sha1="sha1")
+
+        self.assertEqual(len(self.metrics.timings["proxy.request"]), 1)
+        self.assertEqual(self.metrics.counters["proxy.bytes"], 4)
+        self.assertEqual(self.metrics.counters["proxy.record_cache.misses"], 1)
+
+    def test_extraction_is_timed(self):
+        scorm_zipfile = zipfile.ZipFile(io.BytesIO(make_package({"a.html": b"abc", "b.js": b"de"})))
+
+        extract_package(scorm_zipfile, mock.Mock(), "folder", workers=1)
+
+        self.assertEqual(len(self.metrics.timings["extraction.package"]), 1)
+        self.assertEqual(self.metrics.counters["extraction.files"], 2)
+        self.assertEqual(self.metrics.counters["extraction.bytes"], 5)
+
+    def test_statsd_backend(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        options = {"host": "127.0.0.1", "port": server.getsockname()[1], "prefix": "lms.scorm"}
+
+        with override_settings(SCORM_METRICS={"backend": "statsd", "options": options}):
+            increment("proxy.bytes", 10)
+            get_metrics().timing("proxy.request", 1.5)
+
+        self.assertEqual(server.recv(100), b"lms.scorm.proxy.bytes:10|c")
+        self.assertEqual(server.recv(100), b"lms.scorm.proxy.request:1.500|ms")
+
+
+@ddt
+class ProxyScormMediaTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("scormxblock.views.get_package_record", return_value=None)
+        self.get_package_record = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def get_response(get_scorm_storage, content=b"0123456789", **headers):
+        """
+        Proxies a file with the given content through the v2 route.
+        """
+        get_scorm_storage().open.return_value = ContentFile(content)
+        request = RequestFactory().get("/", **headers)
+        return proxy_scorm_media(request, file="media.mp4", sha1="sha1")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @data(
+        ({"block_id": "block_id", "file": "index.html"}, "scorm/block_id/index.html"),
+        ({"block_id": "block_id", "sha1": "sha1", "file": "index.html"}, "scorm/block_id/sha1/index.html"),
+        ({"sha1": "sha1", "file": "index.html"}, "scorm/packages/sha1/index.html"),
+    )
+    def test_proxy_location(self, value, get_scorm_storage):
+        kwargs, location = value
+        get_scorm_storage().open.return_value = ContentFile(b"<html></html>")
+        get_scorm_storage().get_modified_time.return_value = datetime(2018, 5, 1, tzinfo=pytz.utc)
+
+        response = proxy_scorm_media(RequestFactory().get("/"), **kwargs)
+
+        get_scorm_storage().open.assert_called_once_with(location)
+        self.assertEqual(b"".join(response.streaming_content), b"<html></html>")
+        self.assertEqual(response["Content-Type"], "text/html")
+        self.assertEqual(response["Content-Length"], "13")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @data(
+        ({"block_id": "block_id", "sha1": "sha1", "file": "index.html"}, "media/scorm/block_id/sha1/index.html"),
+        ({"sha1": "sha1", "file": "index.html"}, "media/scorm/packages/sha1/index.html"),
+    )
+    @override_settings(XBLOCK_SETTINGS={"ScormXBlock": {"LOCATION": "media/scorm"}})
+    def test_proxy_custom_location(self, value, get_scorm_storage):
+        kwargs, location = value
+        get_scorm_storage().open.return_value = ContentFile(b"<html></html>")
+        block = ScormXBlockTests.make_one(scorm_file_meta={"sha1": "sha1", "shared": "block_id" not in kwargs})
+
+        response = proxy_scorm_media(RequestFactory().get("/"), **kwargs)
+
+        get_scorm_storage().open.assert_called_once_with(location)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual("{}/index.html".format(block.extract_folder_path), location)
+
+    @mock.patch("scormxblock.views.read_chunks")
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_streams_in_chunks(self, get_scorm_storage, read_chunks):
+        read_chunks.return_value = iter([b"01234", b"56789"])
+
+        response = self.get_response(get_scorm_storage)
+
+        read_chunks.assert_called_once_with(get_scorm_storage().open.return_value, 0, 10)
+        self.assertEqual(list(response.streaming_content), [b"01234", b"56789"])
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @data(
+        ("bytes=2-5", "2345", "bytes 2-5/10"),
+        ("bytes=7-", "789", "bytes 7-9/10"),
+        ("bytes=-3", "789", "bytes 7-9/10"),
+        ("bytes=8-100", "89", "bytes 8-9/10"),
+    )
+    def test_proxy_range(self, value, get_scorm_storage):
+        range_header, content, content_range = value
+
+        response = self.get_response(get_scorm_storage, HTTP_RANGE=range_header)
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), content.encode())
+        self.assertEqual(response["Content-Range"], content_range)
+        self.assertEqual(response["Content-Length"], str(len(content)))
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_local_file(self, get_scorm_storage):
+        storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        storage.save("scorm/packages/sha1/media.mp4", ContentFile(b"0123456789"))
+        get_scorm_storage.return_value = storage
+
+        response = proxy_scorm_media(RequestFactory().get("/"), file="media.mp4", sha1="sha1")
+        ranged = proxy_scorm_media(RequestFactory().get("/", HTTP_RANGE="bytes=2-5"), file="media.mp4", sha1="sha1")
+
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        self.assertEqual(response["Content-Type"], "video/mp4")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(ranged.status_code, 206)
+        self.assertEqual(b"".join(ranged.streaming_content), b"2345")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_missing_local_file(self, get_scorm_storage):
+        get_scorm_storage.return_value = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, get_scorm_storage.return_value.location)
+
+        with self.assertRaises(Http404):
+            proxy_scorm_media(RequestFactory().get("/"), file="media.mp4", sha1="sha1")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_unsatisfiable_range(self, get_scorm_storage):
+        response = self.get_response(get_scorm_storage, HTTP_RANGE="bytes=10-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @data("bytes=0-1,4-5", "items=0-1", "bytes=5-2")
+    def test_proxy_ignored_range(self, range_header, get_scorm_storage):
+        response = self.get_response(get_scorm_storage, HTTP_RANGE=range_header)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_immutable_cache_headers(self, get_scorm_storage):
+        response = self.get_response(get_scorm_storage)
+
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response["ETag"], get_etag("sha1", "media.mp4"))
+        self.assertNotEqual(get_etag("sha1", "media.mp4"), get_etag("sha1", "other.mp4"))
+        self.assertNotEqual(get_etag("sha1", "media.mp4"), get_etag("sha2", "media.mp4"))
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @data(
+        {"HTTP_IF_NONE_MATCH": get_etag("sha1", "media.mp4")},
+        {"HTTP_IF_NONE_MATCH": '"other", W/{}'.format(get_etag("sha1", "media.mp4"))},
+        {"HTTP_IF_NONE_MATCH": "*"},
+        {"HTTP_IF_MODIFIED_SINCE": "Tue, 01 May 2018 00:00:00 GMT"},
+    )
+    def test_proxy_not_modified(self, headers, get_scorm_storage):
+        response = self.get_response(get_scorm_storage, **headers)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], get_etag("sha1", "media.mp4"))
+        get_scorm_storage().open.assert_not_called()
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_modified(self, get_scorm_storage):
+        response = self.get_response(get_scorm_storage, HTTP_IF_NONE_MATCH='"other"')
+
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @data(
+        ("Mon, 30 Apr 2018 00:00:00 GMT", 200),
+        ("Tue, 01 May 2018 00:00:00 GMT", 304),
+    )
+    def test_proxy_deprecated_conditional(self, value, get_scorm_storage):
+        if_modified_since, status_code = value
+        get_scorm_storage().open.return_value = ContentFile(b"<html></html>")
+        get_scorm_storage().get_modified_time.return_value = datetime(2018, 5, 1, tzinfo=pytz.utc)
+        request = RequestFactory().get("/", HTTP_IF_MODIFIED_SINCE=if_modified_since)
+
+        response = proxy_scorm_media(request, block_id="block_id", file="index.html")
+
+        self.assertEqual(response.status_code, status_code)
+        self.assertEqual(response["Cache-Control"], "public, max-age=300, must-revalidate")
+        self.assertEqual(response["Last-Modified"], "Tue, 01 May 2018 00:00:00 GMT")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @override_settings(SCORM_DELIVERY={"mode": "x-accel-redirect", "internal_prefix": "/internal/"})
+    def test_proxy_x_accel_redirect(self, get_scorm_storage):
+        response = self.get_response(get_scorm_storage)
+
+        self.assertEqual(response["X-Accel-Redirect"], "/internal/scorm/packages/sha1/media.mp4")
+        self.assertEqual(response["Content-Type"], "video/mp4")
+        self.assertEqual(response["ETag"], get_etag("sha1", "media.mp4"))
+        self.assertEqual(response.content, b"")
+        get_scorm_storage().open.assert_not_called()
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @override_settings(SCORM_DELIVERY={"mode": "x-accel-redirect", "internal_prefix": "/internal/"})
+    def test_proxy_x_accel_redirect_skips_precompressed(self, get_scorm_storage):
+        self.get_package_record.return_value = {
+            "files": {"media.js": ["application/javascript", 100, "00000000", {"br": 10, "gzip": 12}]}
+        }
+
+        response = proxy_scorm_media(
+            RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip, br"), file="media.js", sha1="sha1"
+        )
+
+        self.assertEqual(response["X-Accel-Redirect"], "/internal/scorm/packages/sha1/media.js")
+        self.assertEqual(response["Content-Type"], "application/javascript")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertNotIn("Vary", response)
+        self.assertEqual(response["ETag"], get_etag("sha1", "media.js"))
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @override_settings(SCORM_DELIVERY={"mode": "x-sendfile"})
+    def test_proxy_x_sendfile(self, get_scorm_storage):
+        get_scorm_storage.return_value = FileSystemStorage(location="/srv/scorm")
+
+        response = proxy_scorm_media(RequestFactory().get("/"), file="media.mp4", sha1="sha1")
+
+        self.assertEqual(response["X-Sendfile"], "/srv/scorm/scorm/packages/sha1/media.mp4")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @override_settings(SCORM_DELIVERY={"mode": "redirect", "expires": 30, "redirect_base": "/bucket"})
+    def test_proxy_signed_redirect(self, get_scorm_storage):
+        get_scorm_storage().url.return_value = "https://bucket.s3.amazonaws.com/scorm/packages/sha1/media.mp4?Signature=x"
+
+        response = self.get_response(get_scorm_storage)
+
+        get_scorm_storage().url.assert_called_once_with("scorm/packages/sha1/media.mp4", expire=30)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], "/bucket/scorm/packages/sha1/media.mp4?Signature=x")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @data("index.html", "data.json", "imsmanifest.xml", "media.mp4")
+    @override_settings(SCORM_DELIVERY={"mode": "redirect"})
+    def test_proxy_signed_redirect_needs_redirect_base(self, file, get_scorm_storage):
+        get_scorm_storage().open.return_value = ContentFile(b"<html></html>")
+
+        response = proxy_scorm_media(RequestFactory().get("/"), file=file, sha1="sha1")
+
+        self.assertEqual(response.status_code, 200)
+        get_scorm_storage().url.assert_not_called()
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    @data(
+        ("gzip, deflate, br", "br", "media.js.br"),
+        ("gzip", "gzip", "media.js.gz"),
+        ("br;q=0, gzip;q=0.5", "gzip", "media.js.gz"),
+        ("*", "br", "media.js.br"),
+        ("identity", None, "media.js"),
+    )
+    def test_proxy_precompressed(self, value, get_scorm_storage):
+        accept_encoding, encoding, filename = value
+        self.get_package_record.return_value = {
+            "files": {"media.js": ["application/javascript", 100, "00000000", {"br": 10, "gzip": 12}]}
+        }
+        get_scorm_storage().open.return_value = ContentFile(b"compressed")
+
+        response = proxy_scorm_media(
+            RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept_encoding), file="media.js", sha1="sha1"
+        )
+
+        get_scorm_storage().open.assert_called_once_with("scorm/packages/sha1/" + filename)
+        self.assertEqual(response.get("Content-Encoding"), encoding)
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(response["ETag"], get_etag("sha1", "media.js", encoding))
+        self.assertEqual(response["Content-Type"], "application/javascript")
+        self.assertEqual(response["Content-Length"], {"br": "10", "gzip": "12", None: "100"}[encoding])
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_precompressed_range(self, get_scorm_storage):
+        self.get_package_record.return_value = {
+            "files": {"media.js": ["application/javascript", 10, "00000000", {"gzip": 5}]}
+        }
+        get_scorm_storage().open.return_value = ContentFile(b"0123456789")
+
+        response = proxy_scorm_media(
+            RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=0-1"), file="media.js", sha1="sha1"
+        )
+
+        get_scorm_storage().open.assert_called_once_with("scorm/packages/sha1/media.js")
+        self.assertEqual(response.status_code, 206)
+        self.assertNotIn("Content-Encoding", response)
+
+    def test_get_package_record_is_cached(self):
+        storage = mock.Mock()
+        storage.open.return_value = ContentFile(b'{"files": {}}')
+
+        self.assertEqual(get_package_record(storage, "cached_sha1"), {"files": {}})
+        self.assertEqual(get_package_record(storage, "cached_sha1"), {"files": {}})
+
+        storage.open.assert_called_once_with("scorm/packages/cached_sha1.json")
+
+    @override_settings(SCORM_DELIVERY={"record_cache_files": 3})
+    def test_get_package_record_cache_is_bounded_by_files(self):
+        clear_package_records()
+        self.addCleanup(clear_package_records)
+        records = {
+            "scorm/packages/{}.json".format(sha1): json.dumps({"files": dict.fromkeys(files, [])}).encode("utf8")
+            for sha1, files in [("one", "ab"), ("two", "c"), ("three", "d"), ("big", "efgh")]
+        }
+        storage = mock.Mock()
+        storage.open.side_effect = lambda path: ContentFile(records[path])
+
+        for sha1 in ("one", "two", "three", "two", "big", "big", "one"):
+            get_package_record(storage, sha1)
+
+        # "one" was evicted to make room for "three", and "big" is never cached
+        self.assertEqual(
+            [call[0][0] for call in storage.open.call_args_list],
+            ["scorm/packages/{}.json".format(sha1) for sha1 in ("one", "two", "three", "big", "big", "one")],
+        )
+
+    @override_settings(XBLOCK_SETTINGS={"ScormXBlock": {"LOCATION": "media/scorm"}})
+    def test_get_package_record_custom_location(self):
+        storage = mock.Mock()
+        storage.open.return_value = ContentFile(b'{"files": {}}')
+
+        self.assertEqual(get_package_record(storage, "located_sha1"), {"files": {}})
+
+        storage.open.assert_called_once_with("media/scorm/packages/located_sha1.json")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_file_index(self, get_scorm_storage):
+        self.get_package_record.return_value = {"files": {"data/lesson": ["application/json", 2, "00000000", {}]}}
+        get_scorm_storage().open.return_value = ContentFile(b"{}")
+
+        response = proxy_scorm_media(RequestFactory().get("/"), file="data/lesson", sha1="sha1")
+
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response["Content-Length"], "2")
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_missing_file(self, get_scorm_storage):
+        self.get_package_record.return_value = {"files": {}}
+
+        with self.assertRaises(Http404):
+            proxy_scorm_media(RequestFactory().get("/"), file="missing.html", sha1="sha1")
+
+        get_scorm_storage().open.assert_not_called()
+
+    @mock.patch("scormxblock.views.get_scorm_storage")
+    def test_proxy_missing_file_without_index(self, get_scorm_storage):
+        get_scorm_storage().open.side_effect = IOError("No such file")
+
+        with self.assertRaises(Http404):
+            proxy_scorm_media(RequestFactory().get("/"), block_id="block_id", file="missing.html", sha1="sha1")
@@ -0,0 +1,119 @@
+"""
+Chunked, resumable uploads of SCORM packages from Studio.
+
+The editor sends the package in chunks of at most SCORM_PROCESSING['chunk_size']
+bytes. Each chunk is written at its offset in a local part file, so that an
+interrupted upload resumes from the last offset received instead of from zero.
+The SHA-1 of the package is computed while the chunks arrive, and the part
+file is handed over to a processing job after the last one.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .jobs import get_processing_settings
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+UPLOAD_PREFIX = "scorm-upload-"
+# Seconds after which an abandoned part file is removed
+UPLOAD_TIMEOUT = 24 * 60 * 60
+
+# Running SHA-1 of the uploads received by this process: {upload id: (offset, sha1)}.
+# Chunks received by other processes leave it behind, and the processing job
+# then hashes the whole package again.
+MAX_HASHERS = 64
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+def create_upload():
+    """
+    Start a new upload and return its id. Part files of abandoned uploads are
+    removed on the way.
+    """
+    remove_stale_uploads()
+    upload_id = uuid.uuid4().hex
+    open(get_upload_path(upload_id), "wb").close()
+    return upload_id
+
+
+def is_valid_upload_id(upload_id):
+    return bool(upload_id and UPLOAD_ID_RE.match(upload_id))
+
+
+def get_upload_path(upload_id):
+    tmp_dir = get_processing_settings()['tmp_dir'] or tempfile.gettempdir()
+    return os.path.join(tmp_dir, "{}{}.part".format(UPLOAD_PREFIX, upload_id))
+
+
+def get_upload_offset(upload_id):
+    """
+    Number of bytes of an upload received so far, or None if it is unknown.
+    """
+    try:
+        return os.path.getsize(get_upload_path(upload_id))
+    except OSError:
+        return None
+
+
+def write_chunk(upload_id, offset, chunk):
+    """
+    Write the chunk file object at the given offset of an upload, dropping any
+    data received after it, and return the new offset.
+    """
+    with open(get_upload_path(upload_id), "r+b") as part_file:
+        part_file.seek(offset)
+        data = chunk.read()
+        part_file.write(data)
+        part_file.truncate()
+    update_hasher(upload_id, offset, data)
+    return offset + len(data)
+
+
+def update_hasher(upload_id, offset, data):
+    with _hashers_lock:
+        hasher_offset, sha1 = _hashers.pop(upload_id, (0, None))
+        if offset == 0:
+            hasher_offset, sha1 = 0, hashlib.sha1()
+        if sha1 is None or hasher_offset != offset:
+            return
+        sha1.update(data)
+        _hashers[upload_id] = (offset + len(data), sha1)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def finish_upload(upload_id):
+    """
+    Complete an upload. Return the path of its part file, which now belongs to
+    the caller, and its SHA-1 if it could be computed while receiving it.
+    """
+    path = get_upload_path(upload_id)
+    size = os.path.getsize(path)
+    with _hashers_lock:
+        hasher_offset, sha1 = _hashers.pop(upload_id, (0, None))
+    if sha1 is None or hasher_offset != size:
+        return path, None
+    return path, sha1.hexdigest()
+
+
+def remove_stale_uploads():
+    """
+    Remove the part files of the uploads abandoned for more than UPLOAD_TIMEOUT.
+    """
+    path = os.path.dirname(get_upload_path("x"))
+    expired = time.time() - UPLOAD_TIMEOUT
+    for name in os.listdir(path):
+        if not name.startswith(UPLOAD_PREFIX):
+            continue
+        try:
+            if os.path.getmtime(os.path.join(path, name)) < expired:
+                os.remove(os.path.join(path, name))
+        except OSError:
+            # Removed concurrently by another process
+            pass
@@ -1,7 +1,7 @@
 from django.contrib.auth.decorators import login_required
 from django.conf.urls import url
 
-from .views import proxy_scorm_media
+from .views import export_scorm_progress, proxy_scorm_media
 
 urlpatterns = (
     url(
@@ -14,4 +14,14 @@ urlpatterns = (
         proxy_scorm_media,
         name='scorm-proxy',
     ),
-)
\ No newline at end of file
+    url(
+        r'^v2/(?P<sha1>[0-9a-f]{40})\/(?P<file>.*)',
+        proxy_scorm_media,
+        name='scorm-proxy-package',
+    ),
+    url(
+        r'^export/(?P<usage_key>[^/]+)$',
+        export_scorm_progress,
+        name='scorm-export-progress',
+    ),
+)
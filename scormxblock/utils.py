@@ -1,11 +1,147 @@
+import hashlib
+import json
+import mimetypes
+import threading
+
 from django.conf import settings
-from django.core.files.storage import get_storage_class
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import instrument_storage
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Size of the blocks read and written when moving package files around
+CHUNK_SIZE = 64 * 2 ** 10
+
+# Folder of the SCORM files in the storage, unless LOCATION is set in the
+# ScormXBlock settings bucket
+DEFAULT_LOCATION = "scorm"
+
+# Folders, inside the scorm location, of the content-addressed package store
+# and of its reference index (which blocks use each package)
+PACKAGES_FOLDER = "packages"
+REFERENCES_FOLDER = "refs"
+# Folder, inside the scorm location, where uploads wait for a remote worker
+UPLOADS_FOLDER = "uploads"
+# Folder, inside the scorm location, of the results of the successful jobs
+JOBS_FOLDER = "jobs"
+
+# Storage backend shared by the whole process, with the settings it was built from
+_storage_entry = (None, None)
+_storage_lock = threading.Lock()
+_storage_backends_count = 0
+
 def get_scorm_storage():
   """
   Get the default storage for SCORM objects
+
+  The backend is built once per process and reused by every caller, so that
+  its clients and connection pools (e.g. boto sessions) are reused too. It is
+  built again when SCORM_STORAGE_CLASS changes.
+  """
+  global _storage_entry, _storage_backends_count
+  key = json.dumps(settings.SCORM_STORAGE_CLASS, sort_keys=True, default=repr)
+  storage_key, storage = _storage_entry
+  if storage_key == key:
+    return storage
+  with _storage_lock:
+    storage_key, storage = _storage_entry
+    if storage_key != key:
+      storage = get_storage_class(settings.SCORM_STORAGE_CLASS['class'])(**settings.SCORM_STORAGE_CLASS['options'])
+      instrument_storage(storage)
+      _storage_entry = (key, storage)
+      _storage_backends_count += 1
+      logger.info('Built SCORM storage backend "%s"', settings.SCORM_STORAGE_CLASS['class'])
+    return storage
+
+def get_storage_backends_count():
+  """
+  Number of SCORM storage backends built by this process.
+  """
+  return _storage_backends_count
+
+@receiver(setting_changed)
+def reset_scorm_storage(setting=None, **kwargs):
+  """
+  Drop the shared storage backend, so that the next call builds a new one.
+  """
+  global _storage_entry
+  if setting in (None, 'SCORM_STORAGE_CLASS'):
+    with _storage_lock:
+      _storage_entry = (None, None)
+
+def is_local_storage(storage):
+  """
+  Whether the files of the storage can be read and written straight in the
+  local filesystem, bypassing the storage API. Can be turned off with
+  'local_fast_path': False in SCORM_STORAGE_CLASS.
+  """
+  if not getattr(settings, 'SCORM_STORAGE_CLASS', {}).get('local_fast_path', True):
+    return False
+  return isinstance(storage, FileSystemStorage)
+
+def get_scorm_location():
+  """
+  Folder of the SCORM files in the storage, from the LOCATION of the
+  ScormXBlock settings bucket. Blocks, jobs and the proxy views all resolve it
+  here, so that packages are served from where they were extracted.
+  """
+  xblock_settings = getattr(settings, 'XBLOCK_SETTINGS', {}).get('ScormXBlock', {})
+  return xblock_settings.get('LOCATION', DEFAULT_LOCATION)
+
+def get_package_folder(sha1, location=DEFAULT_LOCATION):
+  """
+  Folder where the package with the given sha1 is extracted, shared by all the
+  blocks and course runs that use it.
   """
-  return get_storage_class(settings.SCORM_STORAGE_CLASS['class'])(**settings.SCORM_STORAGE_CLASS['options'])
\ No newline at end of file
+  return "{}/{}/{}".format(location, PACKAGES_FOLDER, sha1)
+
+def guess_content_type(path):
+  """
+  Content type of a SCORM file from its name. Files with unknown extensions
+  are served as HTML pages.
+  """
+  return mimetypes.guess_type(path)[0] or "text/html"
+
+def copy_and_hash(source, destination, chunk_size=CHUNK_SIZE):
+  """
+  Copy the source file object into destination, one chunk at a time, and
+  compute the SHA-1 of the data in the same pass.
+
+  Return the hex digest and the number of bytes copied.
+  """
+  sha1 = hashlib.sha1()
+  size = 0
+  while True:
+    chunk = source.read(chunk_size)
+    if not chunk:
+      break
+    sha1.update(chunk)
+    destination.write(chunk)
+    size += len(chunk)
+  return sha1.hexdigest(), size
+
+def hash_file(source, progress=None, chunk_size=CHUNK_SIZE):
+  """
+  Compute the SHA-1 of the source file object, one chunk at a time. If given,
+  progress is called with the number of bytes hashed so far after each chunk.
+
+  Return the hex digest and the number of bytes read.
+  """
+  sha1 = hashlib.sha1()
+  size = 0
+  while True:
+    chunk = source.read(chunk_size)
+    if not chunk:
+      break
+    sha1.update(chunk)
+    size += len(chunk)
+    if progress is not None:
+      progress(size)
+  return sha1.hexdigest(), size
+
+class ScormError(Exception):
+  pass
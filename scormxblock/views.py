@@ -1,31 +1,426 @@
+import hashlib
+import json
 import os.path
-import mimetypes
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import quote, urlsplit, urlunsplit
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import (
+  FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotModified,
+  HttpResponseRedirect, StreamingHttpResponse
+)
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 
-from .utils import get_scorm_storage
+from .export import FORMATS as EXPORT_FORMATS, export_progress
+from .extraction import ENCODING_SUFFIXES
+from .metrics import increment, timed
+from .utils import (
+  CHUNK_SIZE, get_package_folder, get_scorm_location, get_scorm_storage, guess_content_type, is_local_storage
+)
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-def proxy_scorm_media(request, block_id, file, sha1=None):
+# Only single byte ranges are supported, other Range headers are ignored
+RANGE_RE = re.compile(r'^\s*bytes=(\d*)-(\d*)\s*$')
+
+# Files at content-addressed (sha1) urls never change, a new upload gets a new url
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Files at deprecated urls may be replaced in place, so they must be revalidated
+DEPRECATED_CACHE_CONTROL = 'public, max-age=300, must-revalidate'
+
+# Preferred content codings of the precompressed siblings, best first
+ENCODING_PREFERENCE = ('br', 'gzip')
+
+# Per-process LRU cache of package records, by sha1, bounded by the total
+# number of files of the cached records, as a record has an entry per file
+_package_records = OrderedDict()
+_package_records_files = 0
+_package_records_lock = threading.Lock()
+
+class LocalFileResponse(FileResponse):
+    """
+    FileResponse of a local SCORM file. Its headers are set by the proxy, so
+    the guesses of FileResponse.set_headers, slow on Django 2.2, are skipped.
+    """
+    block_size = CHUNK_SIZE
+
+    def set_headers(self, filelike):
+      pass
+
+@timed('proxy.request')
+def proxy_scorm_media(request, file, block_id=None, sha1=None):
     """
     Render the media objects by proxy, as the files
     must be in the same domain as the LMS
     """
-    guess = mimetypes.guess_type(file)
-    if guess[0] is None:
-      content_type = "text/html"
+    content_type = guess_content_type(file)
+
+    scorm_location = get_scorm_location()
+    if block_id is None:
+      location = "{}/{}".format(get_package_folder(sha1, scorm_location), file)
+    elif sha1:
+      location = "{}/{}/{}/{}".format(scorm_location, block_id, sha1, file)
     else:
-      content_type = guess[0]
+      location = "{}/{}/{}".format(scorm_location, block_id, file)
+
+    storage = get_scorm_storage()
+    delivery = get_delivery_settings()
+    headers = {}
+    encoding = None
+    size = None
+    # Files of packages of the shared store are described by the package
+    # record, which avoids any storage lookup for their metadata
+    record = get_package_record(storage, sha1) if block_id is None else None
+    if record is not None:
+      entry = record.get('files', {}).get(file)
+      if entry is None:
+        raise Http404("No such file in the SCORM package")
+      content_type, size, _, encodings = entry
+      # nginx drops the Content-Encoding of an internal redirect, so it only
+      # gets the original files
+      if encodings and delivery['mode'] != 'x-accel-redirect':
+        headers['Vary'] = 'Accept-Encoding'
+        if not request.META.get('HTTP_RANGE'):
+          encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), encodings)
+      if encoding:
+        location += ENCODING_SUFFIXES[encoding]
+        headers['Content-Encoding'] = encoding
+        size = encodings[encoding]
 
     if sha1:
-      location = "scorm/{}/{}/{}".format(block_id, sha1, file)
+      etag = get_etag(sha1, file, encoding)
+      headers['ETag'] = etag
+      headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+      if is_not_modified(request, etag):
+        increment('proxy.not_modified')
+        return not_modified(headers)
+    else:
+      headers['Cache-Control'] = DEPRECATED_CACHE_CONTROL
+      modified_time = get_modified_time(storage, location)
+      if modified_time is not None:
+        headers['Last-Modified'] = http_date(modified_time)
+        if is_not_modified(request, last_modified=modified_time):
+          increment('proxy.not_modified')
+          return not_modified(headers)
+
+    response = None
+    if delivery['mode'] in ('x-accel-redirect', 'x-sendfile'):
+      response = internal_redirect_response(storage, location, content_type, delivery)
+    elif delivery['mode'] == 'redirect' and encoding is None:
+      # The object storage would not send the Content-Encoding of siblings
+      response = signed_redirect_response(storage, location, content_type, delivery)
+      if response is not None:
+        # The signed url expires, so the redirect itself must not be cached
+        headers = {'Cache-Control': 'no-cache'}
+    if response is None:
+      response = stream_response(request, storage, location, content_type, size)
     else:
-      location = "scorm/{}/{}".format(block_id, file)
+      increment('proxy.delivery.{}'.format(delivery['mode']))
+    if encoding:
+      increment('proxy.encoding.{}'.format(encoding))
+    for header, value in headers.items():
+      response[header] = value
+    return response
+
+def get_package_record(storage, sha1):
+    """
+    Record written at the end of the extraction of a package of the shared
+    store, or None if the package has none. Its "files" index maps the path of
+    each file to [content type, size, CRC-32, {encoding: size}].
+
+    Records never change once written, so they are kept in a per-process LRU
+    cache of at most record_cache_files file entries (see SCORM_DELIVERY).
+    Missing records are not cached: the package may be in extraction.
+    """
+    global _package_records_files
+    with _package_records_lock:
+      if sha1 in _package_records:
+        _package_records.move_to_end(sha1)
+        increment('proxy.record_cache.hits')
+        return _package_records[sha1]
+    increment('proxy.record_cache.misses')
+    try:
+      with storage.open(get_package_folder(sha1, get_scorm_location()) + ".json") as record_file:
+        record = json.loads(record_file.read().decode("utf8"))
+    except (IOError, ValueError):
+      return None
+    max_files = get_delivery_settings()['record_cache_files']
+    files = len(record.get('files', {}))
+    if files > max_files:
+      return record
+    with _package_records_lock:
+      if sha1 not in _package_records:
+        _package_records[sha1] = record
+        _package_records_files += files
+      while _package_records_files > max_files:
+        _, evicted = _package_records.popitem(last=False)
+        _package_records_files -= len(evicted.get('files', {}))
+    return record
+
+def clear_package_records():
+    global _package_records_files
+    with _package_records_lock:
+      _package_records.clear()
+      _package_records_files = 0
+
+def choose_encoding(accept_encoding, encodings):
+    """
+    Pick the preferred content coding, brotli first, among the available
+    encodings that the Accept-Encoding header allows.
+    """
+    accepted = {}
+    for coding in accept_encoding.split(','):
+      parts = coding.strip().split(';')
+      name = parts[0].strip().lower()
+      quality = 1.0
+      for parameter in parts[1:]:
+        key, _, value = parameter.strip().partition('=')
+        if key.strip() == 'q':
+          try:
+            quality = float(value)
+          except ValueError:
+            quality = 0.0
+      if name:
+        accepted[name] = quality
+    for encoding in ENCODING_PREFERENCE:
+      if encoding in encodings and accepted.get(encoding, accepted.get('*', 0)) > 0:
+        return encoding
+    return None
+
+def get_delivery_settings():
+    """
+    How the bytes of SCORM files reach the learner, see SCORM_DELIVERY in
+    settings/common.py. Defaults to streaming them through Django.
+    """
+    delivery = {
+      'mode': 'proxy',
+      'internal_prefix': '/scorm-internal/',
+      'expires': 60,
+      'redirect_base': '',
+      'record_cache_files': 50000,
+    }
+    delivery.update(getattr(settings, 'SCORM_DELIVERY', {}))
+    return delivery
+
+def internal_redirect_response(storage, location, content_type, delivery):
+    """
+    Let the front-end web server send the file: nginx with X-Accel-Redirect to
+    an internal location, or Apache/lighttpd with X-Sendfile to the path in the
+    filesystem storage. Return None if the storage has no local path.
+    """
+    response = HttpResponse(content_type=content_type)
+    if delivery['mode'] == 'x-accel-redirect':
+      response['X-Accel-Redirect'] = delivery['internal_prefix'].rstrip('/') + '/' + quote(location)
+    else:
+      try:
+        response['X-Sendfile'] = storage.path(location)
+      except NotImplementedError:
+        return None
+    return response
+
+def signed_redirect_response(storage, location, content_type, delivery):
+    """
+    Redirect to a short-lived signed url of the object storage, whose scheme
+    and host are replaced by redirect_base, so that the front-end server
+    proxies it from the LMS origin.
+
+    Without redirect_base, files are still streamed by Django: a redirect to
+    the bucket origin would break the SCORM runtime API of HTML pages, and
+    the XHR fetches of JSON or XML files by CORS.
+    """
+    if not delivery['redirect_base']:
+      return None
+    try:
+      url = storage.url(location, expire=delivery['expires'])
+    except TypeError:
+      # Storages without signed urls
+      url = storage.url(location)
+    parts = urlsplit(url)
+    url = delivery['redirect_base'].rstrip('/') + urlunsplit(('', '', parts.path, parts.query, parts.fragment))
+    return HttpResponseRedirect(url)
+
+def stream_response(request, storage, location, content_type, size=None):
+    """
+    Stream the file from the storage, in chunks, honouring Range requests.
+
+    Files of a local filesystem storage are opened directly, and whole files
+    are sent with a FileResponse, which the WSGI server can send with the
+    zero-copy sendfile system call.
+    """
+    local = is_local_storage(storage)
+    try:
+      if local:
+        media_file = open(storage.path(location), 'rb')
+        if size is None:
+          size = os.fstat(media_file.fileno()).st_size
+      else:
+        media_file = storage.open(location)
+        if size is None:
+          size = media_file.size
+    except (IOError, OSError):
+      raise Http404("No such SCORM file")
+    start, end = 0, size - 1
+    status = 200
+
+    byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    if byte_range is False:
+      media_file.close()
+      response = HttpResponse(status=416)
+      response['Content-Range'] = 'bytes */{}'.format(size)
+      return response
+    if byte_range:
+      start, end = byte_range
+      status = 206
+
+    if local and status == 200:
+      response = LocalFileResponse(media_file, content_type=content_type)
+      increment('proxy.delivery.file')
+    else:
+      response = StreamingHttpResponse(
+        read_chunks(media_file, start, end - start + 1),
+        content_type=content_type,
+        status=status,
+      )
+    response['Content-Length'] = end - start + 1
+    increment('proxy.bytes', end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    if status == 206:
+      response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+    return response
+
+def get_etag(sha1, file, encoding=None):
+    """
+    Strong ETag of a file of a package: the package sha1 and the path of the
+    file in the package identify its content. Each content coding of the file
+    gets its own ETag.
+    """
+    etag = hashlib.sha1("{}/{}".format(sha1, file).encode("utf8")).hexdigest()
+    if encoding:
+      etag += "-" + encoding
+    return quote_etag(etag)
+
+def get_modified_time(storage, location):
+    """
+    Modification timestamp of a file in the storage, or None if the storage
+    does not know it.
+    """
+    try:
+      return int(storage.get_modified_time(location).timestamp())
+    except (NotImplementedError, AttributeError, IOError):
+      return None
+
+def is_not_modified(request, etag=None, last_modified=None):
+    """
+    Evaluate the If-None-Match and If-Modified-Since headers of the request.
+
+    When no last_modified timestamp is given, the file is immutable: any copy
+    the client holds for the same url is still valid.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+      etags = parse_etags(if_none_match)
+      return etag is not None and ('*' in etags or etag in etags or 'W/' + etag in etags)
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    if if_modified_since is None:
+      return False
+    return last_modified is None or last_modified <= if_modified_since
+
+def not_modified(headers):
+    response = HttpResponseNotModified()
+    for header, value in headers.items():
+      response[header] = value
+    return response
+
+def parse_range(header, size):
+    """
+    Parse a single "bytes=start-end" Range header.
+
+    Return the (start, end) tuple of inclusive byte positions to serve, None if
+    the whole file must be served, or False if the range can't be satisfied.
+    """
+    if not header:
+      return None
+    match = RANGE_RE.match(header)
+    if not match or match.groups() == ('', ''):
+      return None
+    first, last = match.groups()
+    if not first:
+      # Suffix range: the last bytes of the file
+      length = int(last)
+      if length == 0 or size == 0:
+        return False
+      return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and start > end:
+      return None
+    if start >= size:
+      return False
+    return start, min(end, size - 1)
+
+def read_chunks(media_file, start, length, chunk_size=CHUNK_SIZE):
+    """
+    Yield `length` bytes of the file from the `start` position, one chunk at a
+    time, and close the file afterwards.
+    """
+    try:
+      if start:
+        media_file.seek(start)
+      while length > 0:
+        chunk = media_file.read(min(chunk_size, length))
+        if not chunk:
+          break
+        length -= len(chunk)
+        yield chunk
+    finally:
+      media_file.close()
+
+@login_required
+@timed('export.request')
+def export_scorm_progress(request, usage_key):
+    """
+    Stream the progress export of a SCORM block to course staff, as CSV or,
+    with format=jsonl, as JSON lines. The `columns` parameter selects CMI
+    elements, comma-separated, exported as columns.
+
+    The export_progress handler of the block redirects here, as the LMS
+    buffers the whole response of the XBlock handlers.
+    """
+    usage_key = get_usage_key(usage_key)
+    if usage_key is None or usage_key.block_type != 'scormxblock':
+      raise Http404("No such SCORM block")
+    if not is_course_staff(request.user, usage_key.course_key):
+      return HttpResponseForbidden()
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+      return HttpResponseBadRequest()
+    columns = [column for column in request.GET.get('columns', '').split(',') if column]
+    lines = export_progress([usage_key], export_format, columns)
+    response = StreamingHttpResponse(
+      (line.encode('utf8') for line in lines),
+      content_type='text/csv; charset=utf8' if export_format == 'csv' else 'application/x-ndjson; charset=utf8',
+    )
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(usage_key.block_id, export_format)
+    return response
+
+def get_usage_key(key):
+    """
+    UsageKey of the given string, or None if it is not a usage key.
+    """
+    from opaque_keys import InvalidKeyError
+    from opaque_keys.edx.keys import UsageKey
+
+    try:
+      return UsageKey.from_string(key)
+    except InvalidKeyError:
+      return None
+
+def is_course_staff(user, course_key):
+    from lms.djangoapps.courseware.access import has_access
 
-    return HttpResponse(
-      get_scorm_storage().open(location).read(),
-      content_type=content_type,
-    ) 
\ No newline at end of file
+    return bool(has_access(user, 'staff', course_key))
@@ -30,6 +30,10 @@ setup(
     install_requires=[
         'XBlock',
     ],
+    extras_require={
+        # Brotli siblings of the text files of extracted packages
+        'brotli': ['brotli'],
+    },
     entry_points={
         'xblock.v1': [
             'scormxblock = scormxblock:ScormXBlock',
@@ -37,6 +41,9 @@ setup(
         "lms.djangoapp": [
             "scormxblock = scormxblock.apps:ScormXBlockConfig",
         ],
+        "cms.djangoapp": [
+            "scormxblock = scormxblock.apps:ScormXBlockConfig",
+        ],
     },
     package_data=package_data("scormxblock", ["static", "public", "locale"]),
     license="Apache",